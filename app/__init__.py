@@ -1,10 +1,12 @@
 from flask import Flask
-from flask.ext.sqlalchemy import SQLAlchemy
 
 from config import config
+from .compression import Compress
+from .sharding import ShardedSQLAlchemy
 
 # instantiate 'app-facing' flask extensions:
-db = SQLAlchemy()
+db = ShardedSQLAlchemy()
+compress = Compress()
 
 def create_app(config_name):
     """ Creates and configures the flask application.
@@ -31,9 +33,56 @@ def create_app(config_name):
     from .api_1_0.authentication import jwt
     jwt.init_app(app)
 
+    # initialize request profiling on the app, first so that
+    # it measures the other extensions' request hooks too:
+    from .profiling import profiler
+    profiler.init_app(app)
+
+    # initialize the slow query log on the app:
+    from .slowqueries import slow_query_log
+    slow_query_log.init_app(app)
+
+    # initialize response compression on the app:
+    compress.init_app(app)
+
+    # initialize rate limiting on the app:
+    from .ratelimit import limiter
+    limiter.init_app(app)
+
+    # initialize idempotent retries on the app, after rate limiting
+    # so that retries count against the limits:
+    from .idempotency import idempotency
+    idempotency.init_app(app)
+
+    # initialize the bucketlist events on the app:
+    from .events import events
+    events.init_app(app)
+
     # register api blueprint:
     from .api_1_0 import api as api_1_0_blueprint
     app.register_blueprint(api_1_0_blueprint, url_prefix='/api/v1')
 
+    # do the first request's one-off setup now if configured to:
+    if app.config['WARM_UP']:
+        warm_up(app)
+
     return app
 
+
+def warm_up(app):
+    """ Does the one-off setup otherwise left to the first request:
+        configures the sqlalchemy mappers, opens the first pooled
+        connection to each database and sorts the url map.
+    """
+    from sqlalchemy.orm import configure_mappers
+    configure_mappers()
+
+    with app.app_context():
+        engines = [db.get_engine(app)]
+        for shard in range(len(app.config['SQLALCHEMY_SHARDS'])):
+            engines.append(db.get_shard_engine(shard, app))
+        for engine in engines:
+            engine.connect().close()
+
+    app.url_map.update()
+
@@ -1,10 +1,14 @@
 from collections import OrderedDict
+from datetime import datetime
 
-from flask import jsonify, url_for, g
+import jwt as pyjwt
+from flask import request, current_app, url_for, g
 from flask_jwt import JWT
 
 from .. import db
 from ..models import User
+from . import api
+from .responses import json_response
 from .errors import bad_request, unauthorized, forbidden
 
 
@@ -21,13 +25,15 @@ def authenticate(email, password):
         Returns the authenticated user or the default None.
     """
     if email and password:
-        user = User.query.filter_by(email=email).first()
+        user = User.get_user_by_email(email)
         if user and user.verify_password(password):
 
-            # set the logged-in status flag for the authenticated user:
-            user.logged_in = True
-            db.session.add(user)
-            db.session.commit()
+            # set the logged-in status flag for the authenticated user,
+            # writing only if it changes so repeat logins stay read-only:
+            if not user.logged_in:
+                user.logged_in = True
+                db.session.add(user)
+                db.session.commit()
 
             return user
 
@@ -39,7 +45,14 @@ def identity(payload):
         in the context of protected endpoints. 
         Also verifies that a user is logged in before proceeding with request.
     """
-    user = User.query.filter(User.id == payload['identity']).first()
+    # refresh tokens only get new access tokens:
+    if payload.get('type') == 'refresh':
+        return None
+
+    # reuse the user resolved for the batch the request is part of:
+    user = getattr(g, 'batch_identity', None)
+    if user is None or user.id != payload['identity']:
+        user = User.get_user(payload['identity'])
     if user and user.logged_in:
         return user
 
@@ -49,8 +62,9 @@ def auth_response(access_token, identity):
     """ Defines the response to an authenticated user
     """
     # return the json resons with token:
-    return jsonify({
+    return json_response({
         'access_token': access_token.decode('utf-8'),
+        'refresh_token': encode_refresh_token(identity).decode('utf-8'),
         'profile': identity.to_json(),
         'bucketlists_url': url_for('api.get_bucketlists', _external=True),
     })
@@ -64,8 +78,56 @@ def jwt_error_handler(error):
     if error.error == 'Invalid JWT':
         error.description = 'User not logged in or does not exist'
 
-    return jsonify({
+    return json_response({
         'status_code': error.status_code,
         'error': error.error,
         'description': error.description,
-    }), error.status_code, error.headers
\ No newline at end of file
+    }), error.status_code, error.headers
+
+
+def encode_refresh_token(user):
+    """ Returns a long-lived token for getting new access tokens from
+        '/auth/refresh' without the password, until it expires or
+        the user logs out.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    payload = {
+        'identity': user.id,
+        'type': 'refresh',
+        'version': user.token_version,
+        'iat': now,
+        'nbf': now,
+        'exp': now + config['JWT_REFRESH_EXPIRATION_DELTA'],
+    }
+    return pyjwt.encode(payload, config['JWT_SECRET_KEY'], algorithm=config['JWT_ALGORITHM'])
+
+
+@api.route('/auth/refresh', methods = ['POST'])
+def refresh_token():
+    """ Issues a new access token in exchange for a valid refresh token.
+        Only the token's signature and the user's token version are
+        checked, the password hash is left alone.
+    """
+    token = (request.json or {}).get('refresh_token')
+    if not token:
+        return bad_request('missing refresh token')
+
+    # check the token's signature and expiry:
+    try:
+        payload = jwt.jwt_decode_callback(token)
+    except pyjwt.InvalidTokenError:
+        return unauthorized('Invalid or expired refresh token')
+    if payload.get('type') != 'refresh':
+        return unauthorized('Invalid or expired refresh token')
+
+    # check the token wasn't revoked by logging out:
+    user = User.get_user(payload['identity'])
+    if not user or not user.logged_in or user.token_version != payload.get('version'):
+        return unauthorized('Refresh token revoked')
+
+    # return the json response with the new token:
+    return json_response({
+        'access_token': jwt.jwt_encode_callback(user).decode('utf-8'),
+        'bucketlists_url': url_for('api.get_bucketlists', _external=True),
+    }), 200
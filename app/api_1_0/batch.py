@@ -0,0 +1,197 @@
+import sys
+import json
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+from flask import request, current_app, g
+from flask_jwt import jwt_required, current_identity
+from werkzeug.test import EnvironBuilder
+from werkzeug.urls import url_unquote
+from werkzeug.exceptions import HTTPException
+from sqlalchemy.pool import SingletonThreadPool
+
+from .. import db
+from . import api
+from .responses import json_response
+from .errors import bad_request, internal_server_error
+
+
+# the request headers passed on from a batch to its sub-requests:
+INHERITED_HEADERS = ('Authorization', 'Accept', 'Content-Type')
+
+# the sub-request headers dropped, as the batch decodes its sub-responses:
+DROPPED_HEADERS = ('accept-encoding',)
+
+# guards the lazy creation of the apps' thread pools:
+pool_lock = Lock()
+
+
+def get_pool(app):
+    """ Returns the thread pool running the parallel sub-requests of the
+        app's batches, created on the first one.
+    """
+    pool = app.extensions.get('batch_pool')
+    if pool is None:
+        with pool_lock:
+            pool = app.extensions.get('batch_pool')
+            if pool is None:
+                pool = app.extensions['batch_pool'] = ThreadPool(app.config['BATCH_POOL_SIZE'])
+    return pool
+
+
+def can_run_in_parallel(app):
+    """ Returns whether requests can run on other threads, which they can't
+        with in-memory sqlite databases, private to the thread opening them.
+    """
+    engines = [db.get_engine(app)]
+    engines.extend(db.get_shard_engine(shard, app) for shard in range(len(app.config['SQLALCHEMY_SHARDS'])))
+    return not any(isinstance(engine.pool, SingletonThreadPool) for engine in engines)
+
+
+def get_endpoint(path, method):
+    """ Returns the endpoint the app routes a request to path (below the
+        script root) to, or None if it routes it nowhere.
+    """
+    try:
+        return current_app.url_map.bind('').match(path, method)[0]
+    except HTTPException:
+        return None
+
+
+def parse_sub_requests(json_batch):
+    """ Validates the sub-requests of a batch.
+        Returns a list of (method, url, headers, body) tuples.
+        Raises ValueError if a sub-request is invalid.
+    """
+    prefix = request.script_root + request.path[:-len('batch')]
+    sub_requests = json_batch.get('requests') if isinstance(json_batch, dict) else None
+    if not isinstance(sub_requests, list) or not sub_requests:
+        raise ValueError('A batch must have a list of requests')
+    if len(sub_requests) > current_app.config['BATCH_MAX_REQUESTS']:
+        raise ValueError('A batch can have at most {} requests'.format(current_app.config['BATCH_MAX_REQUESTS']))
+
+    parsed = []
+    for sub_request in sub_requests:
+        if not isinstance(sub_request, dict):
+            raise ValueError('Each request must be an object')
+        method = (sub_request.get('method') or 'GET').upper()
+        url = sub_request.get('url') or ''
+        headers = sub_request.get('headers') or {}
+        if method not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE'):
+            raise ValueError('Unsupported method {}'.format(method))
+        path = url_unquote(url.split('?')[0])
+        if not path.startswith(prefix) \
+                or get_endpoint(path[len(request.script_root):], method) == request.endpoint:
+            raise ValueError('Requests must be to the api, other than batch: {}'.format(url))
+        if not isinstance(headers, dict):
+            raise ValueError('Request headers must be an object')
+        parsed.append((method, url, headers, sub_request.get('body')))
+    return parsed
+
+
+def make_environ(method, url, headers, body):
+    """ Builds the wsgi environ of a sub-request, as sent by the batch's client.
+    """
+    sub_headers = dict((name, request.headers[name]) for name in INHERITED_HEADERS if name in request.headers)
+    sub_headers.update((name, value) for name, value in headers.items() if name.lower() not in DROPPED_HEADERS)
+    builder = EnvironBuilder(
+        path=url,
+        base_url=request.host_url,
+        method=method,
+        headers=sub_headers,
+        data=json.dumps(body) if body is not None else None,
+        environ_base={'REMOTE_ADDR': request.remote_addr, 'bucketlist.batch': True},
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def to_result(response):
+    """ Returns the entry of a sub-request's response in the batch response.
+    """
+    data = response.get_data()
+    if response.mimetype == 'application/json':
+        body = json.loads(data)
+    else:
+        body = data.decode('utf-8')
+    return {'status': response.status_code, 'body': body}
+
+
+def dispatch(app, environ, identity):
+    """ Runs a sub-request through the app's url map and request hooks,
+        within the app context of the batch. The sub-request starts with
+        a blank flask.g, bar the identity resolved for the batch, and the
+        batch's g is restored after it. A sub-request failing with an
+        exception is logged and rolled back, and answered with a 500 of
+        its own rather than failing the batch.
+    """
+    saved = dict(vars(g))
+    vars(g).clear()
+    g.batch_identity = identity
+    try:
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception:
+                app.log_exception(sys.exc_info())
+                db.session.rollback()
+                response = internal_server_error('The request could not be completed')
+        return to_result(response)
+    finally:
+        vars(g).clear()
+        vars(g).update(saved)
+
+
+def dispatch_in_thread(args):
+    """ Runs a sub-request in a thread of the pool, in its own app context
+        and so its own db session.
+    """
+    app, environ, identity = args
+    with app.app_context():
+        return dispatch(app, environ, identity)
+
+
+@api.route('/batch', methods = ['POST'])
+@jwt_required()
+def batch():
+    """ runs a list of api requests in one round trip, returning their
+        responses in order. The requests share the batch's identity and
+        db session. With "parallel" set, consecutive GET requests run
+        at the same time on a thread pool.
+    """
+    # get the sub-requests from the json:
+    json_batch = request.json or {}
+    try:
+        sub_requests = parse_sub_requests(json_batch)
+    except ValueError, e:
+        return bad_request(e.message)
+    app = current_app._get_current_object()
+    parallel = json_batch.get('parallel') is True and can_run_in_parallel(app)
+    identity = current_identity._get_current_object()
+    environs = [(method, make_environ(method, url, headers, body)) for method, url, headers, body in sub_requests]
+
+    # run the requests in order, spreading runs of GETs over the pool:
+    results = []
+    i = 0
+    while i < len(environs):
+        method, environ = environs[i]
+        if not parallel or method != 'GET':
+            results.append(dispatch(app, environ, identity))
+            i += 1
+            continue
+
+        reads = []
+        while i < len(environs) and environs[i][0] == 'GET':
+            reads.append(environs[i][1])
+            i += 1
+
+        # reload the identity if a write expired it, before other threads read it:
+        identity.id
+        results.extend(get_pool(app).map(dispatch_in_thread, [(app, environ, identity) for environ in reads]))
+
+    # return the json response:
+    return json_response({
+        "responses": results,
+    }), 200
@@ -1,10 +1,15 @@
-from flask import jsonify, request, current_app, url_for, g
+from flask import request, current_app, url_for, g
 from flask_jwt import jwt_required, current_identity
+from sqlalchemy.orm.exc import StaleDataError
 
-from ..models import User, Bucketlist, BucketlistItem
+from ..models import User, Bucketlist, BucketlistItem, PreconditionFailed
+from ..jobs import enqueue_once
+from ..events import publish_bucketlist_event
 from .. import db
 from . import api
-from .errors import bad_request, unauthorized, forbidden, not_found
+from .responses import json_response
+from .utils import get_if_match_versions, matches_version
+from .errors import bad_request, unauthorized, forbidden, not_found, conflict, precondition_failed
 
 
 @api.route('/bucketlists/<int:id>/items/', methods = ['POST'])
@@ -12,6 +17,9 @@ from .errors import bad_request, unauthorized, forbidden, not_found
 def create_bucketlist_item(id):
     """ creates a new bucketlist-item in the specified bucketlist. 
     """
+    # keep the user's id for after the commit, which expires the user:
+    user_id = current_identity.id
+
     # get the bucketlist:
     try:
         bucketlist = Bucketlist.get_user_bucketlist(current_identity, id)
@@ -28,13 +36,22 @@ def create_bucketlist_item(id):
     # associate the bucketlist_item with the bucketlist:
     bucketlist_item.bucketlist = bucketlist
 
-    # save the bucketlist to the db:
+    # save the bucketlist to the db, ranked last in its bucketlist:
     db.session.add(bucketlist_item)
+    db.session.flush()
+
+    # respread the ranks in the background once appends make them too long:
+    if len(bucketlist_item.rank) > current_app.config['ITEM_RANK_MAX_LENGTH']:
+        enqueue_once('rebalance_item_ranks', bucketlist_id=id, user_id=user_id)
     db.session.commit()
 
+    # notify the bucketlist's live clients:
+    bucketlist_item_json = bucketlist_item.to_json()
+    publish_bucketlist_event(user_id, id, 'item_created', {"bucketlist_item": bucketlist_item_json})
+
     # return the json response:
-    return jsonify({
-        "bucketlist_item": bucketlist_item.to_json(),
+    return json_response({
+        "bucketlist_item": bucketlist_item_json,
         "bucketlist_url": url_for('api.get_bucketlist', id=bucketlist.id, _external=True)
     }), 201
 
@@ -44,48 +61,146 @@ def create_bucketlist_item(id):
 def manage_bucketlist_item(id, item_id):
     """ updates or deletes an existing bucketlist item. 
     """
-    # get the bucketlist:
-    try:
-        bucketlist = Bucketlist.get_user_bucketlist(current_identity, id)
-    except Exception, e:
-        return not_found(e.message)
+    # keep the user's id for after the commit, which expires the user:
+    user_id = current_identity.id
 
-    # get bucketlist-item:
-    try:
-        bucketlist_item = BucketlistItem.get_bucketlist_item(bucketlist, item_id)
-    except Exception, e:
-        return not_found(e.message)
+    # get the url of the owning bucketlist for the response:
+    bucketlist_url = url_for('api.get_bucketlist', id=id, _external=True)
     
     if request.method == 'PUT':
-        # update it with the json values:
+        # get the new values from the json:
         json_bucketlist_item = request.json
         name = json_bucketlist_item.get('name')
         done = json_bucketlist_item.get('done')
-        
+
+        values = {}
         if name:
-            bucketlist_item.name = name
+            values['name'] = name
         if isinstance(done, bool):
-            bucketlist_item.done = done
-
-        # save the bucketlist_item to the db:
-        db.session.add(bucketlist_item)
+            values['done'] = done
+
+        # update the bucketlist-item in a single statement, checking that
+        # the user owns its bucketlist and that it is at the version the
+        # client expects, if any (or just fetch it if nothing changed):
+        versions = get_if_match_versions()
+        try:
+            if values:
+                bucketlist_item = BucketlistItem.update_user_bucketlist_item(
+                    current_identity, id, item_id, values, versions)
+            else:
+                bucketlist_item = BucketlistItem.get_user_bucketlist_item(current_identity, id, item_id)
+                if versions is not None and bucketlist_item.version_id not in versions:
+                    raise PreconditionFailed('Item has been modified')
+        except PreconditionFailed, e:
+            return precondition_failed(e.message)
+        except Exception, e:
+            return not_found(e.message)
+
+        # serialize before committing so the item needn't be reloaded:
+        bucketlist_item_json = bucketlist_item.to_json()
         db.session.commit()
 
-        # return the json response:
-        return jsonify({
-            "bucketlist_item": bucketlist_item.to_json(),
-            "bucketlist_url": url_for('api.get_bucketlist', id=bucketlist.id, _external=True)
-        }), 200
+        # notify the bucketlist's live clients of actual changes:
+        if values:
+            publish_bucketlist_event(user_id, id, 'item_updated', {"bucketlist_item": bucketlist_item_json})
+
+        # return the json response, tagged with the new version:
+        response = json_response({
+            "bucketlist_item": bucketlist_item_json,
+            "bucketlist_url": bucketlist_url
+        })
+        response.set_etag(str(bucketlist_item.version_id))
+        return response, 200
 
     elif request.method == 'DELETE':
-         # delete the bucketlist from the db:
-        db.session.delete(bucketlist_item)
-        db.session.commit()
+        # get the bucketlist-item, checking that the user owns its bucketlist:
+        try:
+            bucketlist_item = BucketlistItem.get_user_bucketlist_item(current_identity, id, item_id)
+        except Exception, e:
+            return not_found(e.message)
+
+        # check it is at the version the client expects, if any:
+        if not matches_version(bucketlist_item.version_id):
+            return precondition_failed('Item has been modified')
+
+        # soft delete the bucketlist item, unless changed since it was read:
+        BucketlistItem.delete_bucketlist_item(bucketlist_item)
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return conflict('Item has been modified')
+
+        # notify the bucketlist's live clients:
+        publish_bucketlist_event(user_id, id, 'item_deleted', {"id": item_id})
 
         # return the json response:
-        return jsonify({
+        return json_response({
             "status": "deleted",
-            "bucketlist_url": url_for('api.get_bucketlist', id=bucketlist.id, _external=True)
+            "bucketlist_url": bucketlist_url
         }), 200
 
-     
\ No newline at end of file
+     
+
+
+@api.route('/bucketlists/<int:id>/items/<int:item_id>/move', methods = ['PATCH'])
+@jwt_required()
+def move_bucketlist_item(id, item_id):
+    """ moves a bucketlist item just before or after another item of its
+        bucketlist, or first or last in it, rewriting only the moved item. 
+    """
+    # keep the user's id for after the commit, which expires the user:
+    user_id = current_identity.id
+
+    # get where to move the item from the json:
+    json_move = request.json or {}
+    before_id = json_move.get('before')
+    after_id = json_move.get('after')
+    position = json_move.get('position')
+    if len([value for value in (before_id, after_id, position) if value is not None]) != 1:
+        return bad_request('Specify one of before, after or position')
+    if position is not None and position not in ('first', 'last'):
+        return bad_request('position must be first or last')
+
+    # get the bucketlist-item and the item to move it next to,
+    # checking that the user owns their bucketlist:
+    anchor_id = before_id if before_id is not None else after_id
+    try:
+        bucketlist_item = BucketlistItem.get_user_bucketlist_item(current_identity, id, item_id)
+        anchor = None
+        if anchor_id is not None:
+            anchor = BucketlistItem.get_user_bucketlist_item(current_identity, id, anchor_id)
+    except Exception, e:
+        return not_found(e.message)
+    if anchor is bucketlist_item:
+        return bad_request('An item cannot be moved next to itself')
+
+    # rank the item between its new neighbours, respreading the ranks
+    # first if they're missing (on items older than ranks) or clashing:
+    before = before_id is not None or position == 'first'
+    try:
+        if bucketlist_item.rank is None or (anchor and anchor.rank is None):
+            raise ValueError('Unranked items')
+        rank = BucketlistItem.get_move_rank(bucketlist_item, anchor, before)
+    except ValueError:
+        BucketlistItem.rebalance_ranks(id)
+        db.session.expire_all()
+        rank = BucketlistItem.get_move_rank(bucketlist_item, anchor, before)
+    bucketlist_item.rank = rank
+
+    # respread the ranks in the background once they grow too long:
+    if len(rank) > current_app.config['ITEM_RANK_MAX_LENGTH']:
+        enqueue_once('rebalance_item_ranks', bucketlist_id=id, user_id=user_id)
+
+    # serialize before committing so the item needn't be reloaded:
+    bucketlist_item_json = bucketlist_item.to_json()
+    db.session.commit()
+
+    # notify the bucketlist's live clients:
+    publish_bucketlist_event(user_id, id, 'item_moved', {"bucketlist_item": bucketlist_item_json})
+
+    # return the json response:
+    return json_response({
+        "bucketlist_item": bucketlist_item_json,
+        "bucketlist_url": url_for('api.get_bucketlist', id=id, _external=True)
+    }), 200
@@ -1,34 +1,45 @@
-from flask import jsonify, request, current_app, url_for, g
+from flask import request, current_app, url_for, g
 from flask_jwt import jwt_required, current_identity
+from sqlalchemy.orm.exc import StaleDataError
 
-from ..models import Bucketlist
+from ..models import Bucketlist, BucketlistItem
 from .. import db
 from . import api
-from .utils import paginate
-from .errors import bad_request, unauthorized, forbidden, not_found
+from .responses import json_response
+from .utils import paginate, matches_version
+from .errors import bad_request, unauthorized, forbidden, not_found, conflict, precondition_failed
 
 
 @api.route('/bucketlists/', methods = ['GET'])
 @jwt_required()
 def get_bucketlists():
-    """ gets all [or searches] the bucketlists created by the current user. 
+    """ gets all [or searches] the bucketlists created by the current user,
+        or with archived=true those archived.
     """
     # fetch the pagination and search options from the request:
     options = request.args.copy()
 
-    # get/search user's bucketlists:
+    # get/search user's bucketlists, leaving the archived ones out unless asked for:
     results = Bucketlist.query.filter_by(created_by=current_identity)
+    archived = options.get('archived') in ('true', '1')
+    if archived:
+        results = results.filter(Bucketlist.archived_at != None)\
+                         .options(db.undefer(Bucketlist.archive))
+    else:
+        results = results.filter(Bucketlist.archived_at == None)
 
     # search if key isspecified:
     q = options.get('q', type=str)
+    count_key = None
     if q:
         results = results.filter(Bucketlist.name.ilike("%{}%".format(q)))
+        count_key = ('bucketlists', current_identity.id, q, archived)
     
     # paginate the results:
-    paginated_results = paginate(results, 'api.get_bucketlists', options)
+    paginated_results = paginate(results, 'api.get_bucketlists', options, count_key)
     
     # return the json response:
-    return jsonify({
+    return json_response({
         "bucketlists": [bucketlist.to_json() for bucketlist in paginated_results.get('items')],
         "current_page": paginated_results.get('current_page'),
         "total": paginated_results.get('total'),
@@ -47,12 +58,21 @@ def get_bucketlist(id):
 
     # get the bucketlist:
     try:
-        bucketlist = Bucketlist.get_user_bucketlist(current_identity, id)
+        bucketlist = Bucketlist.get_user_bucketlist(current_identity, id, restore=False)
     except Exception, e:
         return not_found(e.message)
 
-    # get its items as a queryset (because lazy='dynamic'):
-    bucketlist_items_query = bucketlist.items
+    # restore it if archived:
+    if bucketlist.archived_at is not None:
+        Bucketlist.restore_bucketlist(bucketlist)
+        db.session.commit()
+
+    # get its items as a queryset (because lazy='dynamic'),
+    # in their ranked order served by the (bucketlist_id, rank) index,
+    # as light rows of the columns in their json rather than mapped items:
+    bucketlist_items_query = bucketlist.items\
+                             .with_entities(*BucketlistItem.json_columns())\
+                             .order_by(BucketlistItem.rank, BucketlistItem.id)
 
     # paginate thebucketlist_items_query  results:
     options.update({'id': id})
@@ -60,10 +80,10 @@ def get_bucketlist(id):
     
     # prep the json repr:
     bucketlist_json = bucketlist.to_json()
-    bucketlist_json['items'] = [bucketlist_item.to_json() for bucketlist_item in paginated_results.get('items')]
+    bucketlist_json['items'] = [BucketlistItem.row_to_json(row) for row in paginated_results.get('items')]
 
     # return the json response:
-    return jsonify({
+    return json_response({
         "bucketlist": bucketlist_json,
         "current_page": paginated_results.get('current_page'),
         "total": paginated_results.get('total'),
@@ -93,7 +113,7 @@ def create_bucketlist():
     db.session.commit()
 
     # return the json response:
-    return jsonify({
+    return json_response({
         "bucketlist": bucketlist.to_json(),
         "bucketlists_url": url_for('api.get_bucketlists', _external=True)
     }), 201
@@ -110,6 +130,10 @@ def manage_bucketlist(id):
     except Exception, e:
         return not_found(e.message)
 
+    # check it is at the version the client expects, if any:
+    if not matches_version(bucketlist.version_id):
+        return precondition_failed('Bucketlist has been modified')
+
     if request.method == 'PUT':
         
         # update it with the json values:
@@ -118,26 +142,61 @@ def manage_bucketlist(id):
         if name:
             bucketlist.name = name
 
-        # save the bucketlist to the db:
+        # save the bucketlist to the db, unless changed since it was read:
         db.session.add(bucketlist)
-        db.session.commit()
-
-        # return the json response:
-        return jsonify({
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return conflict('Bucketlist has been modified')
+
+        # return the json response, tagged with the new version:
+        response = json_response({
             "bucketlist": bucketlist.to_json(),
             "bucketlists_url": url_for('api.get_bucketlists', _external=True)
-        }), 200
+        })
+        response.set_etag(str(bucketlist.version_id))
+        return response, 200
 
     elif request.method == 'DELETE':
 
-        # delete the bucketlist from the db:
-        db.session.delete(bucketlist)
-        db.session.commit()
+        # soft delete the bucketlist, hiding its items too,
+        # unless changed since it was read:
+        Bucketlist.delete_bucketlist(bucketlist)
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return conflict('Bucketlist has been modified')
 
         # return the json response:
-        return jsonify({
+        return json_response({
             "status": "deleted",
             "bucketlists_url": url_for('api.get_bucketlists', _external=True)
         }), 200
 
-    
\ No newline at end of file
+    
+
+
+@api.route('/bucketlists/<int:id>/archive', methods = ['POST'])
+@jwt_required()
+def archive_bucketlist(id):
+    """ archives an existing bucketlist, moving its items out of the
+        hot tables until it is next accessed.
+    """
+    # get the bucketlist, as it is if already archived:
+    try:
+        bucketlist = Bucketlist.get_user_bucketlist(current_identity, id, restore=False)
+    except Exception, e:
+        return not_found(e.message)
+
+    # archive it:
+    if bucketlist.archived_at is None:
+        Bucketlist.archive_bucketlist(bucketlist)
+        db.session.commit()
+
+    # return the json response:
+    return json_response({
+        "bucketlist": bucketlist.to_json(),
+        "bucketlists_url": url_for('api.get_bucketlists', archived='true', _external=True)
+    }), 200
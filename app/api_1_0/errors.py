@@ -1,27 +1,38 @@
-from flask import jsonify
 from . import api
+from .responses import error_response
 
 
 def bad_request(message):
-    response = jsonify({'error': 'bad request', 'message': message})
-    response.status_code = 400
-    return response
+    return error_response(400, 'bad request', message)
 
 
 def unauthorized(message):
-    response = jsonify({'error': 'unauthorized', 'message': message})
-    response.status_code = 401
-    return response
+    return error_response(401, 'unauthorized', message)
 
 
 def forbidden(message):
-    response = jsonify({'error': 'forbidden', 'message': message})
-    response.status_code = 403
-    return response
+    return error_response(403, 'forbidden', message)
 
 
 def not_found(message):
-    response = jsonify({'error': 'not_found', 'message': message})
-    response.status_code = 404
-    return response
+    return error_response(404, 'not_found', message)
 
+
+def too_many_requests(message):
+    return error_response(429, 'too many requests', message)
+
+
+def conflict(message):
+    return error_response(409, 'conflict', message)
+
+
+def unprocessable_entity(message):
+    return error_response(422, 'unprocessable entity', message)
+
+
+def precondition_failed(message):
+    return error_response(412, 'precondition failed', message)
+
+
+def internal_server_error(message):
+    return error_response(500, 'internal server error', message)
@@ -0,0 +1,43 @@
+from flask import Response, current_app
+from flask_jwt import jwt_required, current_identity
+
+from ..models import Bucketlist
+from ..events import bucketlist_channel
+from . import api
+from .errors import not_found
+
+
+@api.route('/bucketlists/<int:id>/events', methods = ['GET'])
+@jwt_required()
+def get_bucketlist_events(id):
+    """ streams the changes to the items of a bucketlist as server-sent
+        events, for clients to follow instead of polling the bucketlist.
+    """
+    # check that the user owns the bucketlist:
+    try:
+        Bucketlist.get_user_bucketlist(current_identity, id, restore=False)
+    except Exception, e:
+        return not_found(e.message)
+
+    # subscribe before responding, so no change made from now on is missed:
+    hub = current_app.extensions['events']
+    subscription = hub.subscribe(bucketlist_channel(current_identity.id, id))
+    retry = current_app.config['EVENTS_RETRY_MS']
+
+    # stream outside the request context, whose db session is released
+    # once the response starts, so idle streams hold no connection:
+    def stream():
+        try:
+            yield 'retry: {}\n\n'.format(retry)
+            while True:
+                message = subscription.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,19 @@
+from ..models import Job
+from . import api
+from .responses import json_response
+from .errors import not_found
+
+
+@api.route('/jobs/<key>', methods = ['GET'])
+def get_job(key):
+    """ gets the status of a background job. 
+    """
+    # get the job by its unguessable key:
+    job = Job.query.filter_by(key=key).first()
+    if not job:
+        return not_found('Job does not exist')
+
+    # return the json response:
+    return json_response({
+        "job": job.to_json(),
+    }), 200
@@ -0,0 +1,69 @@
+import json
+from threading import Lock
+from collections import OrderedDict
+
+from flask import current_app, request
+
+# use the fastest json encoder available, falling back to the stdlib's:
+try:
+    import ujson
+
+    def dumps(data):
+        return ujson.dumps(data, escape_forward_slashes=False)
+except ImportError:
+    try:
+        import simplejson
+
+        def dumps(data):
+            return simplejson.dumps(data, separators=(',', ':'))
+    except ImportError:
+        def dumps(data):
+            return json.dumps(data, separators=(',', ':'))
+
+
+# LRU cache of the encoded bodies of error responses, by error and
+# message, which are mostly the same few constant strings:
+error_bodies = OrderedDict()
+error_bodies_lock = Lock()
+ERROR_BODIES_MAX = 256
+
+
+def wants_pretty():
+    """ Returns whether the client asked for indented json with ?pretty=1.
+    """
+    return request.args.get('pretty') in ('1', 'true')
+
+
+def encode(data):
+    """ Encodes data as compact json, or indented with sorted keys for
+        clients asking for it with ?pretty=1.
+    """
+    if wants_pretty():
+        return json.dumps(data, indent=2, sort_keys=True, separators=(',', ': '))
+    return dumps(data)
+
+
+def json_response(data, status=200):
+    """ Returns a json response of data, the way every api view responds.
+    """
+    return current_app.response_class(encode(data), status=status, mimetype='application/json')
+
+
+def error_response(status, error, message):
+    """ Returns the json response of an error, encoding its body once for
+        each error and message still in the cache.
+    """
+    if wants_pretty():
+        return json_response({'error': error, 'message': message}, status)
+
+    # reuse the cached body, marking it as most recently used,
+    # and evict the least recently used ones:
+    key = (error, message)
+    with error_bodies_lock:
+        body = error_bodies.pop(key, None)
+        if body is None:
+            body = dumps({'error': error, 'message': message})
+        error_bodies[key] = body
+        while len(error_bodies) > ERROR_BODIES_MAX:
+            error_bodies.popitem(last=False)
+    return current_app.response_class(body, status=status, mimetype='application/json')
@@ -1,9 +1,14 @@
-from flask import jsonify, request, current_app, url_for, g
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from flask import request, current_app, url_for, g
 from flask_jwt import jwt_required, current_identity
 
-from ..models import User
+from ..models import User, Bucketlist, BucketlistItem, UserStats
+from ..jobs import enqueue
 from .. import db
 from . import api
+from .responses import json_response
 from .errors import bad_request, unauthorized, forbidden
 
 
@@ -19,7 +24,7 @@ def register_user():
     # validate the registration credentials:
     if email is None or password is None:
         return bad_request("missing email or password")
-    if User.query.filter_by(email=email).first() is not None:
+    if User.get_user_by_email(email) is not None:
         return forbidden("email not allowed to register")
     
     # create the user and save to the db:
@@ -28,7 +33,7 @@ def register_user():
     db.session.commit()
 
     # return json response:
-    return jsonify({
+    return json_response({
         'username': str(user),
         'login_url': url_for('login', _external=True)
     }), 201
@@ -39,13 +44,15 @@ def register_user():
 def logout():
     """ Logs the current user out. 
     """
-    # set the logged-in status flag for the user:
+    # set the logged-in status flag for the user
+    # and revoke the refresh tokens issued so far:
     current_identity.logged_in = False
+    current_identity.token_version += 1
     db.session.add(current_identity)
     db.session.commit()
 
     # return json response:
-    return jsonify({
+    return json_response({
         'status': 'logged out',
         'login_url': url_for('login', _external=True)
     }), 200
@@ -59,7 +66,7 @@ def manage_user():
     if request.method == 'GET':
 
         # return json response:
-        return jsonify({
+        return json_response({
             'profile': current_identity.to_json(),
             'bucketlists_url': url_for('api.get_bucketlists', _external=True),
         }), 200
@@ -76,19 +83,80 @@ def manage_user():
         db.session.commit()
 
         # return the json response:
-        return jsonify({
+        return json_response({
             "profile": current_identity.to_json(),
             "bucketlists_url": url_for('api.get_bucketlists', _external=True)
         }), 200
 
     elif request.method == 'DELETE':
-        
-        # remove the user from the db:
-        db.session.delete(current_identity)
+
+        # defer deleting the bucketlists of large accounts to the worker:
+        item_count = BucketlistItem.query\
+                     .join(Bucketlist)\
+                     .filter(Bucketlist.creator_id == current_identity.id)\
+                     .count()
+        if item_count > current_app.config['JOBS_DEFER_THRESHOLD']:
+            User.deregister_user(current_identity)
+            job = enqueue('delete_user_bucketlists', user_id=current_identity.id)
+            db.session.commit()
+
+            # return json response:
+            return json_response({
+                'status': 'deregistering',
+                'job': job.to_json(),
+                'registration_url': url_for('api.register_user', _external=True)
+            }), 202
+
+        # remove the user and their bucketlists from the db:
+        User.delete_user(current_identity)
         db.session.commit()
         
         # return json response:
-        return jsonify({
+        return json_response({
             'status': 'deregistered',
             'registration_url': url_for('api.register_user', _external=True)
-        }), 200
\ No newline at end of file
+        }), 200
+
+@api.route('/user/stats', methods = ['GET'])
+@jwt_required()
+def get_user_stats():
+    """ Returns the totals of the current user along with the number of
+        items they completed per day (or week) over the last days,
+        read from the rollup tables kept up to date as items change.
+    """
+    # get the query params:
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        return bad_request("period must be 'day' or 'week'")
+    try:
+        days = int(request.args.get('days', current_app.config['STATS_DEFAULT_DAYS']))
+    except ValueError:
+        return bad_request("days must be a number")
+    days = min(max(days, 1), current_app.config['STATS_MAX_DAYS'])
+
+    # get the stats in one read:
+    since = date.today() - timedelta(days=days - 1)
+    stats, completions = UserStats.get_user_stats(current_identity, since)
+
+    # group the completions by week (starting mondays) if asked to:
+    if period == 'week':
+        weeks = OrderedDict()
+        for day, count in completions:
+            week = day - timedelta(days=day.weekday())
+            weeks[week] = weeks.get(week, 0) + count
+        completions = weeks.items()
+
+    # return json response:
+    items = stats.item_count
+    return json_response({
+        'stats': {
+            'bucketlists': stats.bucketlist_count,
+            'items': items,
+            'items_done': stats.done_count,
+            'completion_percentage': round(100.0 * stats.done_count / items, 1) if items else 0.0,
+            'period': period,
+            'since': since.isoformat(),
+            'completed': [{period: day.isoformat(), 'count': count} for day, count in completions],
+        },
+        'profile_url': url_for('api.manage_user', _external=True),
+    }), 200
@@ -1,11 +1,92 @@
-from flask import current_app, url_for
+import time
+from threading import Lock
+from collections import OrderedDict
 
+from flask import current_app, request, url_for, g
 
-def paginate(queryset, endpoint, options):
+from ..compression import Compress
+from . import api
+
+
+# the ways the total of a paginated listing can be counted:
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+class CountCache(object):
+    """ Small LRU cache of query counts, each expiring ttl seconds
+        after it was counted.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.counts = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, count, now=None):
+        """ returns the cached count for key, calling count() for a
+            fresh one if there is none or it has expired.
+        """
+        now = time.time() if now is None else now
+
+        # reuse a fresh cached count:
+        with self.lock:
+            cached = self.counts.get(key)
+            if cached is not None and now - cached[1] < self.ttl:
+                self.counts[key] = self.counts.pop(key)
+                return cached[0]
+
+        # count and cache, evicting the least recently used counts:
+        total = count()
+        with self.lock:
+            self.counts.pop(key, None)
+            self.counts[key] = (total, now)
+            while len(self.counts) > self.size:
+                self.counts.popitem(last=False)
+        return total
+
+
+@api.record_once
+def init_count_cache(state):
+    """ gives the app the cache of the totals counted for estimates
+    """
+    config = state.app.config
+    state.app.extensions['count_cache'] = CountCache(
+        config['COUNT_CACHE_TTL'], config['COUNT_CACHE_SIZE'])
+
+
+@api.teardown_request
+def clear_request_memo(exception):
+    """ clears the lookups memoized while handling the request 
+    """
+    if hasattr(g, 'lookups'):
+        del g.lookups
+
+
+def count_total(queryset, options, count_key=None):
+    """ counts the total of a queryset the way the 'count' option asks:
+        'exact' always counts, 'none' skips counting (returning None) and
+        'estimate' reuses a recent count cached under count_key when given,
+        e.g for searches, else counts.
+    """
+    mode = options.get('count', current_app.config['DEFAULT_COUNT_MODE'])
+    if mode not in COUNT_MODES:
+        mode = current_app.config['DEFAULT_COUNT_MODE']
+
+    if mode == 'none':
+        return None
+
+    count = queryset.order_by(None).count
+    if mode == 'estimate' and count_key is not None:
+        return current_app.extensions['count_cache'].get(count_key, count)
+    return count()
+
+
+def paginate(queryset, endpoint, options, count_key=None):
     """ paginates a queryset 
     """
     # specify default page to show:
-    page = options.get('page', 1, type=int)
+    page = max(options.get('page', 1, type=int), 1)
 
     # specify default items per_page:
     limit = options.get('limit', current_app.config['DEFAULT_PER_PAGE'], type=int)
@@ -15,8 +96,10 @@ def paginate(queryset, endpoint, options):
     if limit > max_per_page:
         limit = max_per_page
 
-    # paginate queryset:
-    pagination = queryset.paginate(page, per_page=limit, error_out=False)
+    # paginate queryset, fetching one extra item to tell if there's a next page:
+    items = queryset.limit(limit + 1).offset((page - 1) * limit).all()
+    has_next = len(items) > limit
+    items = items[:limit]
 
     # update options to be used as url parameters:
     options = options.to_dict(); # converts from werkzeug multidict to dict
@@ -24,21 +107,46 @@ def paginate(queryset, endpoint, options):
     
     # get url to the previous page:
     prev_url = None
-    if pagination.has_prev:
+    if page > 1:
         options['page'] = page-1
         prev_url = url_for(endpoint, **options)
 
     # get url for the next page:
     next_url = None
-    if pagination.has_next:
+    if has_next:
         options['page'] = page+1
         next_url = url_for(endpoint, **options)
 
     # return the pagination results as a dict:
     return {
-        "items": pagination.items,
+        "items": items,
         "current_page": page,
-        "total": pagination.total,
+        "total": count_total(queryset, options, count_key),
         "next_url": next_url,
         "prev_url": prev_url,
-    }
\ No newline at end of file
+    }
+
+
+def get_if_match_versions():
+    """ returns the versions of the resource a write expects it to be at,
+        from the strong etags of its If-Match header (e.g If-Match: "3",
+        or "3-gzip" as tagged on a compressed response), or None if it has
+        no such header or matches any version with "*".
+    """
+    if 'If-Match' not in request.headers or request.if_match.star_tag:
+        return None
+
+    versions = []
+    for etag in request.if_match.as_set():
+        version, _, encoding = etag.partition('-')
+        if version.isdigit() and (not encoding or encoding in Compress.encodings):
+            versions.append(int(version))
+    return versions
+
+
+def matches_version(version):
+    """ checks the If-Match header of a write, if any, against the current
+        version of the resource it changes.
+    """
+    versions = get_if_match_versions()
+    return versions is None or version in versions
@@ -0,0 +1,37 @@
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import DateTime
+
+
+# archived rows are kept as zlib compressed json, their datetimes as text
+# in this format, so that a list's items take one small blob out of the
+# hot tables and their indexes:
+DATE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def pack_rows(rows):
+    """ Compresses a list of rows (dicts of column values) into a blob.
+    """
+    def encode(value):
+        if isinstance(value, datetime):
+            return value.strftime(DATE_TIME_FORMAT)
+        raise TypeError('Cannot archive {!r}'.format(value))
+    return zlib.compress(json.dumps(rows, default=encode, separators=(',', ':')))
+
+
+def unpack_rows(table, blob):
+    """ Returns the rows of table packed into blob, with the values of its
+        datetime columns parsed back.
+    """
+    if not blob:
+        return []
+    datetime_columns = [column.name for column in table.c if isinstance(column.type, DateTime)]
+    rows = [dict((str(name), value) for name, value in row.items())
+            for row in json.loads(zlib.decompress(blob))]
+    for row in rows:
+        for name in datetime_columns:
+            if row.get(name) is not None:
+                row[name] = datetime.strptime(row[name], DATE_TIME_FORMAT)
+    return rows
@@ -0,0 +1,102 @@
+import zlib
+from hashlib import sha1
+from threading import Lock
+from collections import OrderedDict
+
+from flask import current_app, request
+
+
+class Compress(object):
+    """ Compresses api responses negotiated by the Accept-Encoding header.
+        Responses smaller than COMPRESS_MIN_SIZE are sent as is, and the
+        compressed bytes of recent responses are kept in a small LRU cache
+        so that repeated hits on the same payload skip the compressor.
+    """
+
+    # supported content-codings mapped to their zlib window bits,
+    # in order of server preference:
+    encodings = OrderedDict([
+        ('gzip', 16 + zlib.MAX_WBITS),
+        ('deflate', zlib.MAX_WBITS),
+    ])
+
+    def __init__(self, app=None):
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Sets the compression config defaults and registers
+            the after_request hook on the app.
+        """
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json'])
+        app.config.setdefault('COMPRESS_CACHE_SIZE', 128)
+
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        """ Compresses the response body if the client accepts it
+            and the response is worth compressing.
+        """
+        config = current_app.config
+
+        # leave alone responses that can't or shouldn't be compressed:
+        if not config['COMPRESS_ENABLED'] \
+                or response.direct_passthrough \
+                or response.status_code < 200 \
+                or response.status_code in (204, 304) \
+                or response.mimetype not in config['COMPRESS_MIMETYPES'] \
+                or 'Content-Encoding' in response.headers:
+            return response
+
+        # the representation now depends on the request's Accept-Encoding:
+        response.vary.add('Accept-Encoding')
+
+        # pick the best encoding the client accepts:
+        encoding = request.accept_encodings.best_match(self.encodings.keys())
+        if not encoding:
+            return response
+
+        # skip bodies too small to benefit from compression:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        # compress (or fetch the already compressed bytes from the cache):
+        compressed = self.compress(data, encoding, config['COMPRESS_LEVEL'], config['COMPRESS_CACHE_SIZE'])
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+
+        # tell the encoded representation's strong etag from the identity
+        # one's, by its content-coding (e.g "3" becomes "3-gzip"):
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag('{}-{}'.format(etag, encoding))
+        return response
+
+    def compress(self, data, encoding, level, cache_size):
+        """ Returns data compressed with the given content-coding,
+            memoizing the result in an LRU cache of cache_size entries.
+        """
+        key = (encoding, level, sha1(data).digest())
+
+        # serve from the cache, marking the entry as most recently used:
+        with self.lock:
+            compressed = self.cache.pop(key, None)
+        if compressed is None:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, self.encodings[encoding])
+            compressed = compressor.compress(data) + compressor.flush()
+
+        # store the entry, evicting the least recently used ones:
+        if cache_size > 0:
+            with self.lock:
+                self.cache[key] = compressed
+                while len(self.cache) > cache_size:
+                    self.cache.popitem(last=False)
+
+        return compressed
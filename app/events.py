@@ -0,0 +1,197 @@
+import json
+import time
+from threading import Lock, Thread
+from Queue import Queue, Full
+
+from flask import current_app
+
+
+class LocalBackend(object):
+    """ In-process pub/sub backend.
+        Hands every published message straight to the listeners registered
+        on it, so it only reaches the streams of the apps sharing it
+        (a single worker, or several apps in the tests).
+    """
+
+    def __init__(self):
+        self.listeners = []
+
+    def publish(self, channel, message):
+        for listener in list(self.listeners):
+            listener(channel, message)
+
+    def listen(self, listener):
+        self.listeners.append(listener)
+
+
+class RedisBackend(object):
+    """ Pub/sub backend shared between processes through a redis server.
+        Each process holds a single subscription to all the channels,
+        read by a background thread, whatever its number of streams.
+        The client is any object exposing redis-py's publish and pubsub
+        methods, e.g redis.StrictRedis.from_url(...).
+    """
+
+    def __init__(self, client, prefix='events:'):
+        self.client = client
+        self.prefix = prefix
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, message)
+
+    def listen(self, listener):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.prefix + '*')
+
+        def run():
+            for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    listener(message['channel'][len(self.prefix):], message['data'])
+
+        thread = Thread(target=run, name='events-listener')
+        thread.daemon = True
+        thread.start()
+
+
+class Subscription(object):
+    """ The queue of the messages of one channel waiting to be sent to one
+        stream. A None message ends the stream.
+    """
+
+    def __init__(self, channel, max_size):
+        self.channel = channel
+        self.queue = Queue(max_size)
+
+    def get(self):
+        """ Blocks until the next message, without polling.
+        """
+        return self.queue.get()
+
+    def put(self, message):
+        """ Queues message, or ends the stream if it fell too far behind
+            (its client reconnects and refetches).
+            Returns whether the message was queued.
+        """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except Full:
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait(None)
+            return False
+
+
+class EventHub(object):
+    """ Fans the messages of the app's backend out to the subscriptions
+        of this process, and keeps idle streams alive with a heartbeat
+        sent every heartbeat seconds by a single thread.
+    """
+
+    def __init__(self, backend, heartbeat, queue_size):
+        self.backend = backend
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.subscriptions = {}
+        self.lock = Lock()
+        self.heartbeat_thread = None
+        backend.listen(self.dispatch)
+
+    def publish(self, channel, event, data):
+        """ Publishes an event to the streams of channel in every process.
+            The event is formatted once, for all of them.
+        """
+        message = 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+        self.backend.publish(channel, message)
+
+    def dispatch(self, channel, message):
+        """ Queues a message from the backend for the subscriptions of channel.
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            if not subscription.put(message):
+                self.unsubscribe(subscription)
+
+    def subscribe(self, channel):
+        """ Returns a new subscription to channel.
+        """
+        subscription = Subscription(channel, self.queue_size)
+        with self.lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = Thread(target=self.beat, name='events-heartbeat')
+                self.heartbeat_thread.daemon = True
+                self.heartbeat_thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.channel]
+
+    def beat(self):
+        """ Sends a comment to every stream every heartbeat seconds, which
+            keeps proxies from closing them and ends those whose client left.
+        """
+        while True:
+            time.sleep(self.heartbeat)
+            with self.lock:
+                subscriptions = [s for channel in self.subscriptions.values() for s in channel]
+            for subscription in subscriptions:
+                if not subscription.put(': heartbeat\n\n'):
+                    self.unsubscribe(subscription)
+
+
+class Events(object):
+    """ Server-sent events of the changes to bucketlists.
+        Views publish to a channel per bucketlist once their change is
+        committed, and the stream of each subscribed client is fed by the
+        hub of its process. The backend carrying the events between
+        processes is in-process by default, or a redis server when
+        EVENTS_REDIS_URL is set.
+    """
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Sets the events config defaults and creates the app's hub.
+        """
+        app.config.setdefault('EVENTS_REDIS_URL', None)
+        app.config.setdefault('EVENTS_HEARTBEAT', 15)
+        app.config.setdefault('EVENTS_QUEUE_SIZE', 100)
+        app.config.setdefault('EVENTS_RETRY_MS', 3000)
+
+        # pick the backend, defaulting to a fresh in-process one per app:
+        backend = self.backend
+        if backend is None and app.config['EVENTS_REDIS_URL']:
+            import redis
+            backend = RedisBackend(redis.StrictRedis.from_url(app.config['EVENTS_REDIS_URL']))
+        if backend is None:
+            backend = LocalBackend()
+
+        app.extensions['events'] = EventHub(
+            backend, app.config['EVENTS_HEARTBEAT'], app.config['EVENTS_QUEUE_SIZE'])
+
+
+def bucketlist_channel(user_id, bucketlist_id):
+    """ Returns the channel of the events of a user's bucketlist
+        (bucketlist ids are only unique within a shard).
+    """
+    return 'bucketlist:{}:{}'.format(user_id, bucketlist_id)
+
+
+def publish_bucketlist_event(user_id, bucketlist_id, event, data):
+    """ Publishes an event to the streams of a user's bucketlist.
+    """
+    current_app.extensions['events'].publish(bucketlist_channel(user_id, bucketlist_id), event, data)
+
+
+# instantiate the events extension:
+events = Events()
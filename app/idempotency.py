@@ -0,0 +1,218 @@
+import json
+import time
+import uuid
+from hashlib import sha1
+from threading import Lock
+
+from flask import current_app, request, g
+
+from .ratelimit import get_client_key, SweepingStore
+from .api_1_0.errors import bad_request, conflict, unprocessable_entity
+
+
+class MemoryStore(SweepingStore):
+    """ In-process idempotency store.
+        Keeps the stored responses and the keys being processed in dicts
+        guarded by a lock, so it is only shared between the threads of a
+        single worker.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.holders = {}
+        self.lock = Lock()
+        self.writes = 0
+
+    def get(self, key):
+        entry = self.records.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def set(self, key, record, ttl):
+        with self.lock:
+            self.records[key] = (time.time() + ttl, record)
+
+            # drop the responses that have expired:
+            self.sweep_expired(self.records, lambda entry: entry[0])
+
+    def acquire(self, key, ttl):
+        """ Takes the lock of key unless another request holds it.
+            Returns a token to release it with, or None.
+        """
+        now = time.time()
+        with self.lock:
+            holder = self.holders.get(key)
+            if holder is not None and holder[0] > now:
+                return None
+            token = uuid.uuid4().hex
+            self.holders[key] = (now + ttl, token)
+            return token
+
+    def release(self, key, token):
+        with self.lock:
+            holder = self.holders.get(key)
+            if holder is not None and holder[1] == token:
+                del self.holders[key]
+
+
+class RedisStore(object):
+    """ Idempotency store shared between processes through a redis server.
+        The client is any object exposing redis-py's get, set and eval
+        methods, e.g redis.StrictRedis.from_url(...).
+    """
+
+    # deletes KEYS[1] if it still holds ARGV[1]:
+    release_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, client, prefix='idempotency:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value else None
+
+    def set(self, key, record, ttl):
+        self.client.set(self.prefix + key, json.dumps(record), px=max(int(ttl * 1000), 1))
+
+    def acquire(self, key, ttl):
+        """ Takes the lock of key unless another request holds it.
+            Returns a token to release it with, or None.
+        """
+        token = uuid.uuid4().hex
+        if self.client.set(self.prefix + 'lock:' + key, token, nx=True, px=max(int(ttl * 1000), 1)):
+            return token
+        return None
+
+    def release(self, key, token):
+        self.client.eval(self.release_script, 1, self.prefix + 'lock:' + key, token)
+
+
+class Idempotency(object):
+    """ Makes retrying the writes of the api safe. The response to a write
+        carrying an IDEMPOTENCY_HEADER is stored for IDEMPOTENCY_TTL seconds
+        under the key, the client and the request path, and replayed to
+        retries without running the view again. A retry arriving while the
+        first request is still running waits for it, up to
+        IDEMPOTENCY_LOCK_TIMEOUT seconds.
+    """
+
+    # seconds between attempts at taking the lock of a busy key:
+    poll_interval = 0.05
+
+    def __init__(self, app=None, store=None):
+        self.store = store
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Sets the idempotency config defaults, creates the app's store
+            and registers the request hooks on the app.
+        """
+        app.config.setdefault('IDEMPOTENCY_ENABLED', True)
+        app.config.setdefault('IDEMPOTENCY_HEADER', 'Idempotency-Key')
+        app.config.setdefault('IDEMPOTENCY_METHODS', ('POST', 'PUT', 'PATCH', 'DELETE'))
+        app.config.setdefault('IDEMPOTENCY_TTL', 24 * 3600)
+        app.config.setdefault('IDEMPOTENCY_LOCK_TIMEOUT', 10)
+        app.config.setdefault('IDEMPOTENCY_MAX_KEY_LENGTH', 255)
+        app.config.setdefault('IDEMPOTENCY_REDIS_URL', None)
+
+        # pick the store, defaulting to a fresh in-process one per app:
+        store = self.store
+        if store is None and app.config['IDEMPOTENCY_REDIS_URL']:
+            import redis
+            store = RedisStore(redis.StrictRedis.from_url(app.config['IDEMPOTENCY_REDIS_URL']))
+        if store is None:
+            store = MemoryStore()
+        app.extensions['idempotency'] = store
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        """ Replays the stored response of a retried write, or takes the
+            lock of its key for the view to run.
+        """
+        config = current_app.config
+        if not config['IDEMPOTENCY_ENABLED'] \
+                or request.blueprint != 'api' \
+                or request.method not in config['IDEMPOTENCY_METHODS']:
+            return
+
+        idempotency_key = request.headers.get(config['IDEMPOTENCY_HEADER'])
+        if not idempotency_key:
+            return
+        if len(idempotency_key) > config['IDEMPOTENCY_MAX_KEY_LENGTH']:
+            return bad_request('Idempotency key too long')
+
+        store = current_app.extensions['idempotency']
+        key = '{}:{}:{}:{}'.format(get_client_key(), request.method, request.path, idempotency_key)
+        fingerprint = sha1(request.get_data()).hexdigest()
+
+        # wait for a concurrent request with the same key to finish:
+        timeout = config['IDEMPOTENCY_LOCK_TIMEOUT']
+        deadline = time.time() + timeout
+        token = store.acquire(key, timeout)
+        while token is None:
+            if time.time() >= deadline:
+                return conflict('A request with this idempotency key is in progress')
+            time.sleep(self.poll_interval)
+            token = store.acquire(key, timeout)
+
+        # replay the stored response if there is one:
+        record = store.get(key)
+        if record is not None:
+            store.release(key, token)
+            if record['fingerprint'] != fingerprint:
+                return unprocessable_entity('Idempotency key already used for a different request')
+            response = current_app.response_class(
+                record['body'], status=record['status'], content_type=record['content_type'])
+            if record.get('etag'):
+                response.headers['ETag'] = record['etag']
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        g.idempotency = (key, token, fingerprint)
+
+    def after_request(self, response):
+        """ Stores the response of a write for its retries, unless it failed
+            on the server's side, and releases the lock of its key.
+        """
+        state = getattr(g, 'idempotency', None)
+        if state is None:
+            return response
+        del g.idempotency
+
+        key, token, fingerprint = state
+        store = current_app.extensions['idempotency']
+        try:
+            if response.status_code < 500 and not response.is_streamed:
+                store.set(key, {
+                    'status': response.status_code,
+                    'content_type': response.content_type,
+                    'body': response.get_data().decode('utf-8'),
+                    'etag': response.headers.get('ETag'),
+                    'fingerprint': fingerprint,
+                }, current_app.config['IDEMPOTENCY_TTL'])
+        finally:
+            store.release(key, token)
+        return response
+
+    def teardown_request(self, exception):
+        """ Releases the lock of the key of a write that failed before its response.
+        """
+        state = getattr(g, 'idempotency', None)
+        if state is not None:
+            del g.idempotency
+            current_app.extensions['idempotency'].release(state[0], state[1])
+
+
+# instantiate the idempotency extension:
+idempotency = Idempotency()
@@ -0,0 +1,192 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, and_
+
+from . import db
+from .models import Job, User, Bucketlist, BucketlistItem, UserStats
+from .sharding import using_shard, using_user_shard
+
+
+# registered job handlers, by job name:
+handlers = {}
+
+
+def job(name):
+    """ Registers the decorated function as the handler of the named job.
+    """
+    def decorator(fn):
+        handlers[name] = fn
+        return fn
+    return decorator
+
+
+def enqueue(name, **kwargs):
+    """ Queues a job to be run by the worker with the given arguments.
+        The job is added to the current session; committing it is left
+        to the caller so it lands in the same transaction as its cause.
+    """
+    if name not in handlers:
+        raise ValueError('Unknown job: {}'.format(name))
+
+    queued_job = Job(name=name, args=json.dumps(kwargs, sort_keys=True))
+    db.session.add(queued_job)
+    return queued_job
+
+
+def enqueue_once(name, **kwargs):
+    """ Queues a job like enqueue, unless the same job with the same
+        arguments is already waiting to run. Returns the queued job.
+    """
+    queued_job = Job.query\
+                 .filter_by(name=name, args=json.dumps(kwargs, sort_keys=True), status='queued')\
+                 .first()
+    if queued_job is not None:
+        return queued_job
+    return enqueue(name, **kwargs)
+
+
+def runnable(now):
+    """ Returns the criterion of the jobs waiting for a worker: those
+        queued, and those left running past their lease, whose worker
+        has likely died.
+    """
+    lease_expired_at = now - timedelta(seconds=current_app.config['JOBS_LEASE_TIMEOUT'])
+    return or_(
+        Job.status == 'queued',
+        and_(Job.status == 'running', Job.claimed_at < lease_expired_at))
+
+
+def claim(queued_job):
+    """ Marks a queued job (or one whose lease has expired) as running,
+        leased to this worker from now on.
+        Returns False if another worker got to it first.
+    """
+    now = datetime.now()
+    claimed = Job.query\
+              .filter(Job.id == queued_job.id, runnable(now))\
+              .update({'status': 'running', 'claimed_at': now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def run(queued_job):
+    """ Runs a claimed job, recording whether it succeeded.
+    """
+    try:
+        handlers[queued_job.name](**queued_job.get_args())
+    except Exception, e:
+        db.session.rollback()
+        current_app.logger.exception('Job %s failed', queued_job.key)
+        status, error = 'failed', str(e)
+    else:
+        status, error = 'done', None
+
+    Job.query\
+        .filter_by(id=queued_job.id)\
+        .update({'status': status, 'error': error}, synchronize_session=False)
+    db.session.commit()
+
+
+def run_pending(limit=None):
+    """ Runs the queued jobs, and those whose lease has expired, oldest first.
+        Returns the number of jobs run.
+    """
+    query = Job.query.filter(runnable(datetime.now())).order_by(Job.id)
+    if limit:
+        query = query.limit(limit)
+
+    count = 0
+    for queued_job in query.all():
+        if claim(queued_job):
+            run(queued_job)
+            count += 1
+    return count
+
+
+def work(interval=1.0, once=False):
+    """ Runs queued jobs until interrupted, polling every interval seconds.
+    """
+    while True:
+        count = run_pending()
+        if once:
+            return count
+        if not count:
+            time.sleep(interval)
+
+
+def delete_in_batches(model, criterion, batch_size):
+    """ Deletes the rows of model matching criterion with set-based DELETE
+        statements of at most batch_size rows, committing after each batch
+        so no single transaction holds the write lock for long. Soft deleted
+        rows are deleted too. Returns the number of rows deleted.
+    """
+    total = 0
+    while True:
+        ids = db.session.query(model.id).with_deleted().filter(criterion).limit(batch_size).subquery()
+        deleted = model.query\
+                  .filter(model.id.in_(ids))\
+                  .delete(synchronize_session=False)
+        db.session.commit()
+        if not deleted:
+            return total
+        total += deleted
+
+
+@job('delete_user_bucketlists')
+def delete_user_bucketlists(user_id):
+    """ Deletes all the bucketlists and items of a deregistered user,
+        then the user itself.
+    """
+    batch_size = current_app.config['JOBS_DELETE_BATCH_SIZE']
+    with using_user_shard(user_id):
+        bucketlist_ids = db.session.query(Bucketlist.id).with_deleted().filter_by(creator_id=user_id).subquery()
+        delete_in_batches(BucketlistItem, BucketlistItem.bucketlist_id.in_(bucketlist_ids), batch_size)
+        delete_in_batches(Bucketlist, Bucketlist.creator_id == user_id, batch_size)
+        UserStats.delete_user_stats(db.session, user_id)
+        User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+@job('rebalance_item_ranks')
+def rebalance_item_ranks(bucketlist_id, user_id):
+    """ Respreads the ranks of the items of a user's bucketlist once
+        moves have made them too long.
+    """
+    with using_user_shard(user_id):
+        BucketlistItem.rebalance_ranks(bucketlist_id)
+        db.session.commit()
+
+
+@job('purge_deleted')
+def purge_deleted(older_than):
+    """ Hard deletes the bucketlists and items soft deleted more than
+        older_than seconds ago, on every shard, along with the items of
+        those bucketlists, once taken out of their owners' stats.
+        Returns the number of rows deleted.
+    """
+    batch_size = current_app.config['JOBS_DELETE_BATCH_SIZE']
+    cutoff = datetime.now() - timedelta(seconds=older_than)
+    shards = range(len(current_app.config['SQLALCHEMY_SHARDS'])) or [None]
+
+    total = 0
+    for shard in shards:
+        with using_shard(shard):
+            # take the items of the bucketlists about to go out of the stats:
+            deleted_bucketlists = Bucketlist.query.with_deleted()\
+                                  .filter(Bucketlist.deleted_at < cutoff)\
+                                  .options(db.undefer(Bucketlist.archive))
+            for bucketlist in deleted_bucketlists.all():
+                Bucketlist.settle_deleted_bucketlist(bucketlist)
+            db.session.commit()
+
+            bucketlist_ids = db.session.query(Bucketlist.id).with_deleted()\
+                             .filter(Bucketlist.deleted_at < cutoff).subquery()
+            total += delete_in_batches(BucketlistItem, or_(
+                BucketlistItem.deleted_at < cutoff,
+                BucketlistItem.bucketlist_id.in_(bucketlist_ids)
+            ), batch_size)
+            total += delete_in_batches(Bucketlist, Bucketlist.deleted_at < cutoff, batch_size)
+    return total
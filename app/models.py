@@ -1,9 +1,41 @@
-from datetime import datetime
+import json
+from uuid import uuid4
+from datetime import datetime, timedelta
 from abc import ABCMeta
 
+from sqlalchemy import bindparam, event, func, select, and_, case, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import current_app, request, url_for, g
 from . import db
+from .ranking import rank_between, spread_ranks
+from .softdelete import LiveQuery
+from .archiving import pack_rows, unpack_rows
+
+
+# cache of the hot lookup queries, built and compiled once then reused
+# with new parameters (see sqlalchemy.ext.baked):
+bakery = baked.bakery()
+
+
+def request_memo():
+    """ Returns the dict, stored on flask.g, in which lookups made while
+        handling the current request are memoized. The api blueprint
+        clears it when the request is torn down.
+    """
+    memo = getattr(g, 'lookups', None)
+    if memo is None:
+        memo = g.lookups = {}
+    return memo
+
+
+class PreconditionFailed(Exception):
+    """ Raised when a write expects a version of a row other than its current one.
+    """
 
 
 class BaseModel(db.Model):
@@ -11,6 +43,7 @@ class BaseModel(db.Model):
         methods to be used in other concrete models.
     """
     __abstract__ = True
+    query_class = LiveQuery
 
     id = db.Column(db.Integer, primary_key=True)
     date_created = db.Column(db.DateTime, index=True, default=datetime.now())
@@ -24,12 +57,15 @@ class User(BaseModel):
     password_hash = db.Column(db.Text)
     username = db.Column(db.Text, nullable=True)
     logged_in = db.Column(db.Boolean, default=False)
+    token_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     bucketlists = db.relationship(
         'Bucketlist', 
         lazy='dynamic', 
+        query_class=LiveQuery,
         backref=db.backref('created_by', lazy='select'),
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     @property
@@ -43,6 +79,49 @@ class User(BaseModel):
     def verify_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @staticmethod
+    def get_user(id):
+        """ Fetchs a user by id.
+        """
+        query = bakery(lambda session: session.query(User))
+        query += lambda q: q.filter(User.id == bindparam('id'))
+        return query(db.session()).params(id=id).first()
+
+    @staticmethod
+    def get_user_by_email(email):
+        """ Fetchs a user by email.
+        """
+        query = bakery(lambda session: session.query(User))
+        query += lambda q: q.filter(User.email == bindparam('email'))
+        return query(db.session()).params(email=email).first()
+
+    @staticmethod
+    def delete_user(user):
+        """ Deletes a user along with their bucketlists and items
+            using one set-based DELETE statement per table.
+        """
+        bucketlist_ids = db.session.query(Bucketlist.id).with_deleted().filter_by(creator_id=user.id).subquery()
+        BucketlistItem.query\
+            .filter(BucketlistItem.bucketlist_id.in_(bucketlist_ids))\
+            .delete(synchronize_session=False)
+        Bucketlist.query\
+            .filter_by(creator_id=user.id)\
+            .delete(synchronize_session=False)
+        UserStats.delete_user_stats(db.session, user.id)
+        db.session.delete(user)
+
+    @staticmethod
+    def deregister_user(user):
+        """ Logs a user out for good and frees their email, keeping their
+            row until the worker has deleted their bucketlists, as their id
+            would otherwise be handed out again to a new user while the
+            bucketlists still point at it.
+        """
+        user.logged_in = False
+        user.email = None
+        user.token_version += 1
+        db.session.add(user)
+
     def __repr__(self):
         return self.username if self.username else self.email
 
@@ -61,15 +140,37 @@ class User(BaseModel):
 
 class Bucketlist(BaseModel):
     __tablename__ = 'bucketlists'
+    __table_args__ = (
+        db.Index('ix_bucketlists_live_creator_id', 'creator_id',
+                 postgresql_where=db.text('deleted_at IS NULL AND archived_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL AND archived_at IS NULL')),
+        db.Index('ix_bucketlists_archived_creator_id', 'creator_id',
+                 postgresql_where=db.text('deleted_at IS NULL AND archived_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL AND archived_at IS NOT NULL')),
+        {'info': {'sharded': True}},
+    )
 
     name = db.Column(db.Text, index=True, nullable=False)
-    creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    creator_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    # an archived bucketlist keeps its items packed in archive (see
+    # app.archiving) instead of in the bucketlist_item table:
+    archived_at = db.Column(db.DateTime, nullable=True)
+    archive = db.deferred(db.Column(db.LargeBinary, nullable=True))
+
+    # bumped by every update, which only applies to the version it was
+    # loaded at (see PreconditionFailed):
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
    
     items = db.relationship(
         'BucketlistItem', 
         lazy='dynamic', 
+        query_class=LiveQuery,
         backref=db.backref('bucketlist', lazy='select'),
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     def to_json(self, with_items=False):
@@ -79,7 +180,9 @@ class Bucketlist(BaseModel):
         json_bucketlist = {
             'id': self.id,
             'name': self.name,
-            'item_count': self.items.count(),
+            'item_count': len(self.get_archived_items()) if self.archived_at else self.items.count(),
+            'archived': self.archived_at is not None,
+            'version': self.version_id,
             'date_created': self.date_created.strftime(current_app.config['DATE_TIME_FORMAT']),
             'date_modified': self.date_modified.strftime(current_app.config['DATE_TIME_FORMAT']),
             'created_by': {
@@ -105,36 +208,206 @@ class Bucketlist(BaseModel):
 
         return bucketlist
 
+    def get_archived_items(self):
+        """ Returns the items packed in the bucketlist's archive, as dicts
+            of their column values.
+        """
+        return unpack_rows(BucketlistItem.__table__, self.archive)
+
     @staticmethod
-    def get_user_bucketlist(user, id):
-        """ Fetchs a user's bucketlist by id.
+    def get_user_bucketlist(user, id, restore=True):
+        """ Fetchs a user's bucketlist by id, restoring it first if it
+            was archived unless restore is False.
         """
+        # reuse the bucketlist if already fetched in this request:
+        memo = request_memo()
+        key = ('bucketlist', user.id, id)
+        if key in memo:
+            return memo[key]
+
         # get the bucketlist:
-        bucketlist = Bucketlist.query\
-                     .filter_by(created_by=user, id=id)\
-                     .first()
+        query = bakery(lambda session: session.query(Bucketlist))
+        query += lambda q: q.filter(
+            Bucketlist.creator_id == bindparam('user_id'),
+            Bucketlist.id == bindparam('id'))
+        bucketlist = query(db.session()).params(user_id=user.id, id=id).first()
         if not bucketlist:
             raise Exception('Item does not exist')
+        if not restore:
+            return bucketlist
+        if bucketlist.archived_at is not None:
+            Bucketlist.restore_bucketlist(bucketlist)
         
+        memo[key] = bucketlist
         return bucketlist
 
+    @staticmethod
+    def restore_user_bucketlist(user, id):
+        """ Restores a user's bucketlist if it is archived.
+            Returns whether it was.
+        """
+        bucketlist = Bucketlist.query\
+                     .filter_by(id=id, creator_id=user.id)\
+                     .filter(Bucketlist.archived_at != None)\
+                     .first()
+        if not bucketlist:
+            return False
+        Bucketlist.restore_bucketlist(bucketlist)
+        return True
+
+    @staticmethod
+    def archive_bucketlist(bucketlist):
+        """ Archives a bucketlist: packs its items into its archive and
+            deletes their rows, taking them out of the hot table and its
+            indexes. The user's stats still count them.
+        """
+        table = BucketlistItem.__table__
+        items = db.session.execute(
+            table.select()
+            .where(table.c.bucketlist_id == bucketlist.id)
+            .where(table.c.deleted_at == None)
+            .order_by(table.c.rank, table.c.id)).fetchall()
+
+        # archiving changes neither the bucketlist's version nor its
+        # modification date, which are those of its content:
+        archive = pack_rows([dict(item) for item in items])
+        archived_at = datetime.now()
+        bucketlists = Bucketlist.__table__
+        db.session.execute(
+            bucketlists.update()
+            .where(bucketlists.c.id == bucketlist.id)
+            .values(archive=archive, archived_at=archived_at, date_modified=bucketlists.c.date_modified))
+        set_committed_value(bucketlist, 'archive', archive)
+        set_committed_value(bucketlist, 'archived_at', archived_at)
+
+        # soft deleted items go too, already out of the stats:
+        db.session.execute(table.delete().where(table.c.bucketlist_id == bucketlist.id))
+
+    @staticmethod
+    def restore_bucketlist(bucketlist):
+        """ Puts the items of an archived bucketlist back in the
+            bucketlist_item table, with their ids, once the restore is
+            claimed by unsetting archived_at where still set, so that of
+            concurrent restores only one inserts them. Leaves the commit
+            to the caller.
+        """
+        items = bucketlist.get_archived_items()
+        table = Bucketlist.__table__
+        claimed = db.session.execute(
+            table.update()
+            .where(table.c.id == bucketlist.id)
+            .where(table.c.archived_at != None)
+            .values(archive=None, archived_at=None, date_modified=table.c.date_modified)).rowcount
+        if claimed and items:
+            for item in items:
+                item['bucketlist_id'] = bucketlist.id
+            db.session.execute(BucketlistItem.__table__.insert(), items)
+
+        # the bucketlist as loaded is restored too, at the same version:
+        set_committed_value(bucketlist, 'archive', None)
+        set_committed_value(bucketlist, 'archived_at', None)
+
+    @staticmethod
+    def delete_bucketlist(bucketlist):
+        """ Soft deletes a bucketlist with a single UPDATE, which hides its
+            items too. The purge later takes the items out of their owner's
+            stats (see settle_deleted_bucketlist), then hard deletes both.
+        """
+        bucketlist.deleted_at = datetime.now()
+        db.session.add(bucketlist)
+
+    @staticmethod
+    def settle_deleted_bucketlist(bucketlist):
+        """ Takes the items of a soft deleted bucketlist, archived ones
+            included, out of its owner's stats, soft deleting them (and
+            dropping its archive) so that they're only taken out once.
+        """
+        items, done = Bucketlist.count_items(bucketlist.id)
+        done_dates = db.session.query(BucketlistItem.date_done_changed)\
+                     .filter(BucketlistItem.bucketlist_id == bucketlist.id)\
+                     .filter(BucketlistItem.done == True)
+        done_dates = [date_done for (date_done,) in done_dates]
+        for item in bucketlist.get_archived_items():
+            items += 1
+            if item['done']:
+                done += 1
+                done_dates.append(item['date_done_changed'] or item['date_modified'])
+        UserStats.adjust(db.session, bucketlist.creator_id, items=-items, done=-done)
+        UserDailyCompletions.remove_completions(db.session, bucketlist.creator_id, done_dates)
+
+        table = BucketlistItem.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.bucketlist_id == bucketlist.id)
+            .where(table.c.deleted_at == None)
+            .values(deleted_at=bucketlist.deleted_at))
+        bucketlists = Bucketlist.__table__
+        db.session.execute(
+            bucketlists.update()
+            .where(bucketlists.c.id == bucketlist.id)
+            .values(archive=None, date_modified=bucketlists.c.date_modified))
+
+    @staticmethod
+    def count_items(id):
+        """ Counts the items of a bucketlist and those of them done.
+            Returns a tuple of (items, done).
+        """
+        items, done = db.session.query(
+            func.count(BucketlistItem.id),
+            func.sum(case([(BucketlistItem.done, 1)], else_=0))
+        ).filter(BucketlistItem.bucketlist_id == id).first()
+        return items, done or 0
+
 
 class BucketlistItem(BaseModel):
     __tablename__ = 'bucketlist_item'
+    __table_args__ = (
+        db.Index('ix_bucketlist_item_bucketlist_id_rank', 'bucketlist_id', 'rank',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+        # never reuse the ids of deleted items, so archived ones keep theirs:
+        {'info': {'sharded': True}, 'sqlite_autoincrement': True},
+    )
 
     name = db.Column(db.Text, index=True, nullable=False)
-    bucketlist_id = db.Column(db.Integer, db.ForeignKey('bucketlists.id'), nullable=False)
-    done = db.Column(db.Boolean, default=False)
+    bucketlist_id = db.Column(db.Integer, db.ForeignKey('bucketlists.id', ondelete='CASCADE'), nullable=False)
+    done = db.column_property(db.Column(db.Boolean, default=False), active_history=True)
+    date_done_changed = db.Column(db.DateTime, nullable=True)
+    rank = db.Column(db.Text, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    # bumped by every update, like the bucketlist's:
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
    
     def to_json(self):
         """ returns a json-style dictionary representation of the bucketlist item
         """
+        return BucketlistItem.row_to_json(self)
+
+    @staticmethod
+    def json_columns():
+        """ Returns the columns a bucketlist item's json is made of, for
+            read-only listings to query rows of just these instead of
+            mapped instances (see row_to_json).
+        """
+        return (BucketlistItem.id, BucketlistItem.name, BucketlistItem.date_created,
+                BucketlistItem.date_modified, BucketlistItem.done, BucketlistItem.version_id)
+
+    @staticmethod
+    def row_to_json(row):
+        """ returns a json-style dictionary representation of a bucketlist
+            item, or of a row of its json_columns. Such rows are plain keyed
+            tuples, without the instrumentation, identity map entry and
+            session state of a mapped instance.
+        """
         json_bucketlist_item = {
-            'id': self.id,
-            'name': self.name,
-            'date_created': self.date_created.strftime(current_app.config['DATE_TIME_FORMAT']),
-            'date_modified': self.date_modified.strftime(current_app.config['DATE_TIME_FORMAT']),
-            'done': self.done,
+            'id': row.id,
+            'name': row.name,
+            'date_created': row.date_created.strftime(current_app.config['DATE_TIME_FORMAT']),
+            'date_modified': row.date_modified.strftime(current_app.config['DATE_TIME_FORMAT']),
+            'done': row.done,
+            'version': row.version_id,
         }
         return json_bucketlist_item
 
@@ -160,11 +433,533 @@ class BucketlistItem(BaseModel):
     def get_bucketlist_item(bucketlist, id):
         """ Fetchs an item by id from a bucketlist.
         """
+        # reuse the bucketlist-item if already fetched in this request:
+        memo = request_memo()
+        key = ('bucketlist_item', bucketlist.id, id)
+        if key in memo:
+            return memo[key]
+
         # get bucketlist-item:
-        bucketlist_item = BucketlistItem.query\
-                          .filter_by(bucketlist=bucketlist, id=id)\
-                          .first()
+        query = bakery(lambda session: session.query(BucketlistItem))
+        query += lambda q: q.filter(
+            BucketlistItem.bucketlist_id == bindparam('bucketlist_id'),
+            BucketlistItem.id == bindparam('id'))
+        bucketlist_item = query(db.session()).params(bucketlist_id=bucketlist.id, id=id).first()
         if not bucketlist_item:
             raise Exception('Item does not exist')
         
-        return bucketlist_item
\ No newline at end of file
+        memo[key] = bucketlist_item
+        return bucketlist_item
+
+    @staticmethod
+    def get_user_bucketlist_item(user, bucketlist_id, id):
+        """ Fetchs an item by id from a user's bucketlist.
+            The item and its bucketlist are loaded and the ownership
+            checked in a single joined query.
+        """
+        # reuse the bucketlist-item if already fetched in this request:
+        memo = request_memo()
+        key = ('user_bucketlist_item', user.id, bucketlist_id, id)
+        if key in memo:
+            return memo[key]
+
+        # get bucketlist-item joined with its owned bucketlist:
+        query = bakery(lambda session: session.query(BucketlistItem))
+        query += lambda q: q.join(BucketlistItem.bucketlist)\
+                           .options(db.contains_eager(BucketlistItem.bucketlist))\
+                           .filter(
+                               BucketlistItem.id == bindparam('id'),
+                               BucketlistItem.bucketlist_id == bindparam('bucketlist_id'),
+                               Bucketlist.creator_id == bindparam('user_id'),
+                               Bucketlist.deleted_at == None)
+        bucketlist_item = query(db.session())\
+                          .params(id=id, bucketlist_id=bucketlist_id, user_id=user.id)\
+                          .first()
+
+        # look again once the items of an archived bucketlist are restored:
+        if not bucketlist_item and Bucketlist.restore_user_bucketlist(user, bucketlist_id):
+            bucketlist_item = query(db.session())\
+                              .params(id=id, bucketlist_id=bucketlist_id, user_id=user.id)\
+                              .first()
+        if not bucketlist_item:
+            raise Exception('Item does not exist')
+
+        memo[key] = bucketlist_item
+        memo[('bucketlist', user.id, bucketlist_id)] = bucketlist_item.bucketlist
+        return bucketlist_item
+
+    @staticmethod
+    def update_user_bucketlist_item(user, bucketlist_id, id, values, versions=None):
+        """ Updates an item of a user's bucketlist with a single UPDATE
+            statement guarded by the ownership check, without loading it first
+            (but for the date it was done when un-doing it).
+            Given a list of versions, only updates the item at one of them,
+            raising PreconditionFailed if it is at another.
+            Returns a transient bucketlist item holding the updated row.
+        """
+        table = BucketlistItem.__table__
+        owned_bucketlist_ids = db.session.query(Bucketlist.id).filter_by(creator_id=user.id).subquery()
+        now = datetime.now()
+
+        # update the (live) item if it belongs to the user's (live) bucketlist,
+        # and is at an expected version (versions start at 1, so [0] is none):
+        owned = and_(
+            table.c.id == id,
+            table.c.deleted_at == None,
+            table.c.bucketlist_id == bucketlist_id,
+            table.c.bucketlist_id.in_(owned_bucketlist_ids))
+        statement = table.update()\
+                    .where(owned)\
+                    .values(date_modified=now, version_id=table.c.version_id + 1, **values)
+        if versions is not None:
+            statement = statement.where(table.c.version_id.in_(versions or [0]))
+
+        # get the updated row back in the same statement where supported:
+        def execute(statement):
+            if db.session.bind.dialect.implicit_returning:
+                return db.session.execute(statement.returning(*table.c)).first()
+            if db.session.execute(statement).rowcount:
+                return db.session.execute(table.select().where(table.c.id == id)).first()
+
+        # the user's stats follow the flips of the done flag, each made by an
+        # UPDATE guarded by the state it flips from, so that of concurrent
+        # flips only the one that matched the row is counted. Un-doing first
+        # reads when the item was done, to take back that day's completion.
+        # Returns a tuple of (flipped, date done before, updated row):
+        def update():
+            if 'done' not in values:
+                return False, None, execute(statement)
+
+            done = func.coalesce(table.c.done, False)
+            for attempt in range(2):
+                flip, date_done = statement.where(done != values['done']), None
+                if not values['done']:
+                    was_done = db.session.execute(
+                        select([table.c.date_done_changed]).where(owned).where(done == True)).first()
+                    date_done = was_done and was_done.date_done_changed
+                    flip = flip.where(table.c.date_done_changed == date_done) if was_done else None
+                row = flip is not None and execute(flip.values(date_done_changed=now))
+                if row:
+                    return True, date_done, row
+
+                # or the flag is as asked already, unless it flipped meanwhile:
+                row = execute(statement.where(done == values['done']))
+                if row:
+                    return False, None, row
+            return False, None, None
+        flipped, date_done, row = update()
+
+        # try again once the items of an archived bucketlist are restored:
+        if not row and Bucketlist.restore_user_bucketlist(user, bucketlist_id):
+            flipped, date_done, row = update()
+        if not row and versions is not None and db.session.execute(select([table.c.id]).where(owned)).first():
+            raise PreconditionFailed('Item has been modified')
+        if not row:
+            raise Exception('Item does not exist')
+
+        # count the item in or out of the user's completions:
+        if flipped:
+            UserStats.adjust(db.session, user.id, done=1 if row.done else -1)
+            if row.done:
+                UserDailyCompletions.adjust(db.session, user.id, now.date(), 1)
+            else:
+                UserDailyCompletions.remove_completions(db.session, user.id, [date_done])
+
+        # forget any stale copy memoized earlier in the request:
+        memo = request_memo()
+        memo.pop(('bucketlist_item', bucketlist_id, id), None)
+        memo.pop(('user_bucketlist_item', user.id, bucketlist_id, id), None)
+
+        return BucketlistItem(**dict(row))
+
+    @staticmethod
+    def delete_bucketlist_item(bucketlist_item):
+        """ Soft deletes an item by setting its deleted_at, flushed
+            with the session, leaving it to be hard deleted later by
+            the purge.
+        """
+        bucketlist_item.deleted_at = datetime.now()
+        db.session.add(bucketlist_item)
+
+    @staticmethod
+    def get_move_rank(bucketlist_item, anchor=None, before=False):
+        """ Returns the rank placing an item just before (or after) the
+            anchor item of its bucketlist, or first (or last) in it if
+            anchor is None. Only the nearest rank past the anchor is
+            looked up, using the (bucketlist_id, rank) index.
+        """
+        table = BucketlistItem.__table__
+        others = and_(
+            table.c.bucketlist_id == bucketlist_item.bucketlist_id,
+            table.c.id != bucketlist_item.id,
+            table.c.deleted_at == None)
+
+        # first goes before the lowest rank, last after the highest:
+        if anchor is None:
+            nearest = func.min if before else func.max
+            rank = db.session.execute(select([nearest(table.c.rank)]).where(others)).scalar()
+            return rank_between(None, rank) if before else rank_between(rank, None)
+
+        # otherwise get the nearest rank on the other side of the anchor:
+        if before:
+            rank = db.session.execute(
+                select([func.max(table.c.rank)])
+                .where(others)
+                .where(table.c.rank < anchor.rank)).scalar()
+            return rank_between(rank, anchor.rank)
+        rank = db.session.execute(
+            select([func.min(table.c.rank)])
+            .where(others)
+            .where(table.c.rank > anchor.rank)).scalar()
+        return rank_between(anchor.rank, rank)
+
+    @staticmethod
+    def rebalance_ranks(bucketlist_id):
+        """ Replaces the ranks of a bucketlist's items, keeping their
+            order, by short evenly spread ones. Unranked items are
+            ranked first, in the order they were created.
+        """
+        table = BucketlistItem.__table__
+        ids = [id for (id,) in db.session.execute(
+            select([table.c.id])
+            .where(table.c.bucketlist_id == bucketlist_id)
+            .where(table.c.deleted_at == None)
+            .order_by(table.c.rank.isnot(None), table.c.rank, table.c.id))]
+        if not ids:
+            return
+
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam('item_id'))
+            .values(rank=bindparam('new_rank')),
+            [{'item_id': id, 'new_rank': rank} for id, rank in zip(ids, spread_ranks(len(ids)))]
+        )
+
+
+@event.listens_for(BucketlistItem, 'before_insert')
+def rank_new_bucketlist_item(mapper, connection, bucketlist_item):
+    """ Ranks new bucketlist items, unless already ranked, last in their
+        bucketlist, after any item ranked earlier in the same flush.
+    """
+    if bucketlist_item.rank is not None:
+        return
+
+    table = BucketlistItem.__table__
+    ranks = [connection.execute(
+        select([func.max(table.c.rank)])
+        .where(table.c.bucketlist_id == bucketlist_item.bucketlist_id)).scalar()]
+    ranks.extend(
+        item.rank for item in object_session(bucketlist_item).new
+        if isinstance(item, BucketlistItem) and item.bucketlist_id == bucketlist_item.bucketlist_id
+    )
+    ranks = [rank for rank in ranks if rank is not None]
+
+    bucketlist_item.rank = rank_between(max(ranks) if ranks else None, None)
+
+
+class UserStats(db.Model):
+    """ Running totals of a user's bucketlists and items, kept on the
+        user's shard and updated along with them, so that reading a
+        user's stats doesn't scan their bucketlists.
+    """
+    __tablename__ = 'user_stats'
+    __table_args__ = {'info': {'sharded': True}}
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucketlist_count = db.Column(db.Integer, default=0, nullable=False)
+    item_count = db.Column(db.Integer, default=0, nullable=False)
+    done_count = db.Column(db.Integer, default=0, nullable=False)
+
+    @staticmethod
+    def adjust(executor, user_id, bucketlists=0, items=0, done=0):
+        """ Adds to the totals of a user, creating them if need be, through
+            executor: the session, or the connection of a flush.
+        """
+        table = UserStats.__table__
+        deltas = {'bucketlist_count': bucketlists, 'item_count': items, 'done_count': done}
+        deltas = dict((column, delta) for column, delta in deltas.items() if delta)
+        if not deltas:
+            return
+
+        # add to the totals in place, or start them:
+        update = table.update()\
+                 .where(table.c.user_id == user_id)\
+                 .values(**dict((column, table.c[column] + delta) for column, delta in deltas.items()))
+        if not executor.execute(update).rowcount:
+            values = {'bucketlist_count': 0, 'item_count': 0, 'done_count': 0}
+            values.update(deltas)
+            insert_or_update(executor, table.insert().values(user_id=user_id, **values), update)
+
+    @staticmethod
+    def delete_user_stats(executor, user_id):
+        """ Deletes the totals and completions of a user.
+        """
+        for table in (UserStats.__table__, UserDailyCompletions.__table__):
+            executor.execute(table.delete().where(table.c.user_id == user_id))
+
+    @staticmethod
+    def get_user_stats(user, since):
+        """ Fetchs a user's totals along with their completions per day
+            from the date since, in a single indexed query.
+            Returns a tuple of (totals, [(day, count), ...]).
+        """
+        rows = db.session.query(UserStats, UserDailyCompletions.day, UserDailyCompletions.count)\
+               .outerjoin(UserDailyCompletions, and_(
+                   UserDailyCompletions.user_id == UserStats.user_id,
+                   UserDailyCompletions.day >= since))\
+               .filter(UserStats.user_id == user.id)\
+               .order_by(UserDailyCompletions.day)\
+               .all()
+        if not rows:
+            return UserStats(user_id=user.id, bucketlist_count=0, item_count=0, done_count=0), []
+
+        return rows[0][0], [(day, count) for stats, day, count in rows if day is not None]
+
+    @staticmethod
+    def backfill(user_id):
+        """ Recomputes a user's totals and completions per day from their
+            bucketlists and items, dating the completions of items done
+            before they were tracked by their last modification.
+        """
+        items = BucketlistItem.__table__
+        # the items of deleted bucketlists count until the purge settles them:
+        bucketlist_ids = db.session.query(Bucketlist.id).with_deleted().filter_by(creator_id=user_id).subquery()
+        owned = items.c.bucketlist_id.in_(bucketlist_ids)
+
+        # date the completions of items done before completions were tracked:
+        db.session.execute(
+            items.update()
+            .where(owned)
+            .where(items.c.done == True)
+            .where(items.c.date_done_changed == None)
+            .values(date_done_changed=items.c.date_modified)
+        )
+
+        # count afresh:
+        UserStats.delete_user_stats(db.session, user_id)
+        bucketlists = Bucketlist.query.filter_by(creator_id=user_id).count()
+        item_count, done_count = db.session.query(
+            func.count(BucketlistItem.id),
+            func.sum(case([(BucketlistItem.done, 1)], else_=0))
+        ).filter(BucketlistItem.bucketlist_id.in_(bucketlist_ids)).first()
+        done_count = done_count or 0
+
+        completion_days = db.session.query(BucketlistItem.date_done_changed)\
+                          .filter(BucketlistItem.bucketlist_id.in_(bucketlist_ids))\
+                          .filter(BucketlistItem.done == True)
+        completion_days = [date_done_changed for (date_done_changed,) in completion_days]
+
+        # add the items of the archived bucketlists:
+        archived_bucketlists = Bucketlist.query.with_deleted()\
+                               .filter_by(creator_id=user_id)\
+                               .filter(Bucketlist.archived_at != None)\
+                               .options(db.undefer(Bucketlist.archive))
+        for bucketlist in archived_bucketlists:
+            for item in bucketlist.get_archived_items():
+                item_count += 1
+                if item['done']:
+                    done_count += 1
+                    completion_days.append(item['date_done_changed'] or item['date_modified'])
+        UserStats.adjust(db.session, user_id, bucketlists=bucketlists, items=item_count, done=done_count)
+
+        days = {}
+        for date_done_changed in completion_days:
+            day = date_done_changed.date()
+            days[day] = days.get(day, 0) + 1
+        for day, count in days.items():
+            UserDailyCompletions.adjust(db.session, user_id, day, count)
+
+
+class UserDailyCompletions(db.Model):
+    """ The number of items a user marked done each day (and still done),
+        kept on the user's shard and updated as items get done, undone or
+        deleted.
+    """
+    __tablename__ = 'user_daily_completions'
+    __table_args__ = {'info': {'sharded': True}}
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    @staticmethod
+    def adjust(executor, user_id, day, count):
+        """ Adds to the completions of a user on a day, through executor.
+        """
+        table = UserDailyCompletions.__table__
+        update = table.update()\
+                 .where(table.c.user_id == user_id)\
+                 .where(table.c.day == day)\
+                 .values(count=table.c.count + count)
+        if not executor.execute(update).rowcount:
+            insert_or_update(executor, table.insert().values(user_id=user_id, day=day, count=count), update)
+
+    @staticmethod
+    def remove_completions(executor, user_id, dates):
+        """ Takes the completions made at dates (the date_done_changed of
+            items leaving the done state, None for those done before
+            completions were tracked) out of a user's days, through executor.
+        """
+        days = {}
+        for date_done in dates:
+            if date_done is not None:
+                days[date_done.date()] = days.get(date_done.date(), 0) + 1
+        if not days:
+            return
+
+        table = UserDailyCompletions.__table__
+        for day, count in days.items():
+            executor.execute(
+                table.update()
+                .where(table.c.user_id == user_id)
+                .where(table.c.day == day)
+                .values(count=table.c.count - count)
+            )
+        executor.execute(table.delete().where(table.c.user_id == user_id).where(table.c.count <= 0))
+
+
+def insert_or_update(executor, insert, update):
+    """ Runs the insert of a row its update found missing, through
+        executor, running the update again instead if a concurrent request
+        inserted the row in between. The insert runs in a savepoint, but
+        on sqlite, which holds the database's write lock from the update
+        on so that nothing can come in between (and whose python driver
+        mishandles savepoints).
+    """
+    connection = executor if isinstance(executor, Connection) else executor.connection(clause=insert)
+    if connection.dialect.name == 'sqlite':
+        connection.execute(insert)
+        return
+
+    try:
+        with connection.begin_nested():
+            connection.execute(insert)
+    except IntegrityError:
+        connection.execute(update)
+
+
+def get_creator_id(connection, bucketlist_item):
+    """ Returns the id of the owner of an item being flushed, from its
+        loaded bucketlist if any, without loading anything within the flush.
+    """
+    bucketlist = inspect(bucketlist_item).dict.get('bucketlist')
+    creator_id = inspect(bucketlist).dict.get('creator_id') if bucketlist is not None else None
+    if creator_id is None:
+        table = Bucketlist.__table__
+        creator_id = connection.execute(
+            select([table.c.creator_id]).where(table.c.id == bucketlist_item.bucketlist_id)).scalar()
+    return creator_id
+
+
+@event.listens_for(BucketlistItem, 'before_insert')
+@event.listens_for(BucketlistItem, 'before_update')
+def date_bucketlist_item_completion(mapper, connection, bucketlist_item):
+    """ Notes when the done flag of an item is set or flipped.
+    """
+    if inspect(bucketlist_item).attrs.done.history.has_changes() and \
+       (bucketlist_item.done or inspect(bucketlist_item).has_identity):
+        bucketlist_item.date_done_changed = datetime.now()
+
+
+@event.listens_for(BucketlistItem, 'after_insert')
+def count_new_bucketlist_item(mapper, connection, bucketlist_item):
+    """ Counts a new item into its owner's stats.
+    """
+    user_id = get_creator_id(connection, bucketlist_item)
+    UserStats.adjust(connection, user_id, items=1, done=1 if bucketlist_item.done else 0)
+    if bucketlist_item.done:
+        UserDailyCompletions.adjust(connection, user_id, bucketlist_item.date_done_changed.date(), 1)
+
+
+@event.listens_for(BucketlistItem, 'after_update')
+def count_updated_bucketlist_item(mapper, connection, bucketlist_item):
+    """ Counts an item whose done flag flipped in or out of its owner's
+        completions, or a soft deleted item out of its owner's stats.
+    """
+    attrs = inspect(bucketlist_item).attrs
+    history = attrs.done.history
+    was_done = history.deleted[0] if history.has_changes() and history.deleted else bucketlist_item.done
+    date_history = attrs.date_done_changed.history
+    date_done = date_history.deleted[0] if date_history.deleted else bucketlist_item.date_done_changed
+
+    if attrs.deleted_at.history.added and bucketlist_item.deleted_at is not None:
+        user_id = get_creator_id(connection, bucketlist_item)
+        UserStats.adjust(connection, user_id, items=-1, done=-1 if was_done else 0)
+        if was_done:
+            UserDailyCompletions.remove_completions(connection, user_id, [date_done])
+        return
+
+    if not history.has_changes() or bool(history.added[0]) == bool(was_done):
+        return
+
+    user_id = get_creator_id(connection, bucketlist_item)
+    UserStats.adjust(connection, user_id, done=1 if bucketlist_item.done else -1)
+    if bucketlist_item.done:
+        UserDailyCompletions.adjust(connection, user_id, bucketlist_item.date_done_changed.date(), 1)
+    else:
+        UserDailyCompletions.remove_completions(connection, user_id, [date_done])
+
+
+@event.listens_for(BucketlistItem, 'after_delete')
+def count_deleted_bucketlist_item(mapper, connection, bucketlist_item):
+    """ Counts a deleted item out of its owner's stats.
+    """
+    user_id = get_creator_id(connection, bucketlist_item)
+    UserStats.adjust(connection, user_id, items=-1, done=-1 if bucketlist_item.done else 0)
+    if bucketlist_item.done:
+        UserDailyCompletions.remove_completions(connection, user_id, [bucketlist_item.date_done_changed])
+
+
+@event.listens_for(Bucketlist, 'after_insert')
+def count_new_bucketlist(mapper, connection, bucketlist):
+    """ Counts a new bucketlist into its owner's stats.
+    """
+    UserStats.adjust(connection, bucketlist.creator_id, bucketlists=1)
+
+
+@event.listens_for(Bucketlist, 'after_delete')
+def count_deleted_bucketlist(mapper, connection, bucketlist):
+    """ Counts a deleted bucketlist out of its owner's stats.
+    """
+    if bucketlist.deleted_at is None:
+        UserStats.adjust(connection, bucketlist.creator_id, bucketlists=-1)
+
+
+@event.listens_for(Bucketlist, 'after_update')
+def count_soft_deleted_bucketlist(mapper, connection, bucketlist):
+    """ Counts a soft deleted bucketlist out of its owner's stats.
+    """
+    if inspect(bucketlist).attrs.deleted_at.history.added and bucketlist.deleted_at is not None:
+        UserStats.adjust(connection, bucketlist.creator_id, bucketlists=-1)
+
+
+class Job(BaseModel):
+    __tablename__ = 'jobs'
+
+    key = db.Column(db.Text, index=True, unique=True, default=lambda: uuid4().hex)
+    name = db.Column(db.Text, nullable=False)
+    args = db.Column(db.Text, default='{}')
+    status = db.Column(db.Text, index=True, default='queued')
+    error = db.Column(db.Text, nullable=True)
+
+    # when a worker last claimed the job, which another worker runs again
+    # if it is still running JOBS_LEASE_TIMEOUT seconds later:
+    claimed_at = db.Column(db.DateTime, nullable=True)
+
+    def to_json(self):
+        """ returns a json-style dictionary representation of the job.
+        """
+        json_job = {
+            'name': self.name,
+            'status': self.status,
+            'error': self.error,
+            'date_created': self.date_created.strftime(current_app.config['DATE_TIME_FORMAT']),
+            'date_modified': self.date_modified.strftime(current_app.config['DATE_TIME_FORMAT']),
+            'url': url_for('api.get_job', key=self.key, _external=True),
+        }
+        return json_job
+
+    def get_args(self):
+        """ returns the job's keyword arguments.
+        """
+        return json.loads(self.args)
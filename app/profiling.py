@@ -0,0 +1,179 @@
+import os
+import time
+import random
+import pstats
+import cProfile
+
+from flask import current_app, request, g
+from itsdangerous import TimestampSigner, BadSignature
+
+
+class Profiler(object):
+    """ Profiles requests with cProfile when PROFILE_ENABLED is set.
+        A request carrying a valid signed PROFILE_HEADER is profiled on its
+        own and its stats dumped under PROFILE_DIR. A PROFILE_SAMPLE_RATE
+        fraction of all requests is also profiled into a rolling set of
+        samples, aggregated by 'manage.py profile-report'.
+        Both sets of dumps are bounded to their most recent files.
+    """
+
+    # the sub-directories of PROFILE_DIR holding each set of dumps:
+    requests_dir = 'requests'
+    samples_dir = 'samples'
+
+    # what the profile header tokens sign:
+    salt = 'profile'
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Sets the profiling config defaults and registers
+            the request hooks on the app if profiling is enabled.
+        """
+        app.config.setdefault('PROFILE_ENABLED', False)
+        app.config.setdefault('PROFILE_HEADER', 'X-Profile')
+        app.config.setdefault('PROFILE_TOKEN_MAX_AGE', 3600)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILE_MAX_FILES', 50)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_MAX_SAMPLES', 500)
+
+        if not app.config['PROFILE_ENABLED']:
+            return
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    @classmethod
+    def get_signer(cls, app):
+        return TimestampSigner(app.config['SECRET_KEY'], salt=cls.salt)
+
+    @classmethod
+    def make_token(cls, app):
+        """ Returns a token that gets requests profiled when sent
+            in the profile header, until it expires.
+        """
+        return cls.get_signer(app).sign(cls.salt)
+
+    def is_requested(self):
+        """ Returns whether the request carries a valid profile token.
+        """
+        config = current_app.config
+        token = request.headers.get(config['PROFILE_HEADER'])
+        if not token:
+            return False
+        try:
+            self.get_signer(current_app).unsign(token, max_age=config['PROFILE_TOKEN_MAX_AGE'])
+        except BadSignature:
+            return False
+        return True
+
+    def before_request(self):
+        """ Starts profiling the request if asked to or sampled.
+        """
+        if request.environ.get('bucketlist.batch'):
+            return # profiled as part of its batch
+        if self.is_requested():
+            g.profile_dir = self.requests_dir
+        elif random.random() < current_app.config['PROFILE_SAMPLE_RATE']:
+            g.profile_dir = self.samples_dir
+        else:
+            return
+
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+    def after_request(self, response):
+        """ Stops profiling the request and dumps its stats.
+        """
+        profile = getattr(g, 'profile', None)
+        if profile is None:
+            return response
+        profile.disable()
+        del g.profile
+
+        config = current_app.config
+        max_files = config['PROFILE_MAX_FILES'] if g.profile_dir == self.requests_dir \
+                    else config['PROFILE_MAX_SAMPLES']
+        filename = self.dump(profile, g.profile_dir, max_files)
+
+        # point the requester to the stats of their request:
+        if g.profile_dir == self.requests_dir:
+            response.headers['X-Profile-Id'] = filename
+        return response
+
+    def teardown_request(self, exception):
+        """ Stops profiling a request that failed before its response.
+        """
+        profile = getattr(g, 'profile', None)
+        if profile is not None:
+            profile.disable()
+            del g.profile
+
+    def dump(self, profile, subdir, max_files):
+        """ Dumps the stats of profile to a new file named after the time
+            and endpoint of the request, removing the oldest files over
+            max_files. Returns the file name.
+        """
+        directory = os.path.join(current_app.config['PROFILE_DIR'], subdir)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filename = '{:.6f}-{}-{}.prof'.format(time.time(), os.getpid(), request.endpoint)
+        profile.dump_stats(os.path.join(directory, filename))
+
+        # keep only the most recent files:
+        for old in list_profiles(directory)[:-max_files]:
+            try:
+                os.remove(os.path.join(directory, old))
+            except OSError:
+                pass # already removed by another process
+
+        return filename
+
+
+def list_profiles(directory):
+    """ Returns the names of the stats dumps in directory, oldest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (name for name in os.listdir(directory) if name.endswith('.prof')),
+        key=lambda name: float(name.split('-', 1)[0])
+    )
+
+
+def get_profile_endpoint(filename):
+    """ Returns the endpoint of the request profiled in a stats dump.
+    """
+    return filename[:-len('.prof')].split('-', 2)[2]
+
+
+def load_profile_report(app, endpoint_prefix='api.', samples=True, requests=False):
+    """ Aggregates the stats dumps of the requests to endpoints starting
+        with endpoint_prefix. Returns the pstats.Stats and the number of
+        requests aggregated, or (None, 0) if there are none.
+    """
+    subdirs = []
+    if samples:
+        subdirs.append(Profiler.samples_dir)
+    if requests:
+        subdirs.append(Profiler.requests_dir)
+
+    paths = []
+    for subdir in subdirs:
+        directory = os.path.join(app.config['PROFILE_DIR'], subdir)
+        for filename in list_profiles(directory):
+            if get_profile_endpoint(filename).startswith(endpoint_prefix):
+                paths.append(os.path.join(directory, filename))
+
+    if not paths:
+        return None, 0
+    return pstats.Stats(*paths), len(paths)
+
+
+# instantiate the profiler extension:
+profiler = Profiler()
@@ -0,0 +1,60 @@
+# items are ordered by rank: a string of base-36 digits compared as text.
+# A new rank fits between any two others, so that moving an item only
+# rewrites its own rank. Ranks never end with the lowest digit (which would
+# leave no room before them) and grow as items are squeezed into the same
+# gap, until the list's ranks are respread:
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+
+
+def digit(rank, i, default):
+    """ Returns the value of the i-th digit of rank, or default past its end.
+    """
+    return DIGITS.index(rank[i]) if rank is not None and i < len(rank) else default
+
+
+def rank_between(before=None, after=None):
+    """ Returns a new rank sorting strictly after the rank before and before
+        the rank after, either of which may be None for no bound (the bottom
+        or top of the key space). The rank takes the middle digit of the
+        first gap, so that appends (and prepends) keep halving the room left
+        rather than using it up a digit at a time.
+        Raises ValueError if there is no room between the ranks.
+    """
+    if before is not None and after is not None and before >= after:
+        raise ValueError('No rank between {!r} and {!r}'.format(before, after))
+
+    rank = ''
+    i = 0
+    while True:
+        low = digit(before, i, 0)
+        high = digit(after, i, BASE)
+
+        # take the middle digit of the gap:
+        if high - low > 1:
+            return rank + DIGITS[(low + high) // 2]
+
+        # no room at this digit, keep before's digit and look further:
+        rank += DIGITS[low]
+        if high > low:
+            after = None # the rank is now below after whatever follows
+        i += 1
+
+
+def spread_ranks(count):
+    """ Returns count short ranks, in order, evenly spread over the lowest
+        part of the key space to leave room for appends after them.
+    """
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    width += 1
+
+    ranks = []
+    for position in range(1, count + 1):
+        digits = ''
+        for i in range(width):
+            position, value = divmod(position, BASE)
+            digits = DIGITS[value] + digits
+        ranks.append(digits.rstrip(DIGITS[0]))
+    return ranks
@@ -0,0 +1,217 @@
+import math
+import time
+from threading import Lock
+
+from flask import current_app, request, g
+
+from .api_1_0.errors import too_many_requests
+
+
+def get_client_key():
+    """ Returns the key identifying the client of the current request: the
+        id of the authenticated user if the request carries a valid token
+        (checked without touching the database), else the remote address.
+    """
+    jwt = current_app.extensions.get('jwt')
+    if jwt is not None:
+        try:
+            token = jwt.request_callback()
+            if token:
+                return 'user:{}'.format(jwt.jwt_decode_callback(token)['identity'])
+        except Exception:
+            pass
+
+    return 'ip:{}'.format(request.remote_addr)
+
+
+class SweepingStore(object):
+    """ Base of the in-process stores, whose dicts of entries are swept
+        of the expired ones every sweep_interval writes.
+    """
+
+    # number of writes between sweeps of the expired entries:
+    sweep_interval = 1000
+
+    def sweep_expired(self, entries, get_expiry):
+        """ Counts a write to entries and, once every sweep_interval writes,
+            drops the entries whose expiry (read by get_expiry) has passed.
+            Must be called holding the store's lock.
+        """
+        self.writes += 1
+        if self.writes < self.sweep_interval:
+            return
+        self.writes = 0
+        now = time.time()
+        for key, value in entries.items():
+            if get_expiry(value) <= now:
+                del entries[key]
+
+
+class MemoryStore(SweepingStore):
+    """ In-process rate limit store.
+        Keeps the state of every bucket in a dict guarded by a lock,
+        so it is only shared between the threads of a single worker.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = Lock()
+        self.writes = 0
+
+    def get(self, key):
+        return self.buckets.get(key)
+
+    def compare_and_set(self, key, expected, value, ttl):
+        """ Sets key to value if it is still set to expected.
+            Returns whether the value was set.
+        """
+        with self.lock:
+            if self.buckets.get(key) != expected:
+                return False
+            self.buckets[key] = value
+
+            # drop the buckets that have refilled since they were last used:
+            self.sweep_expired(self.buckets, lambda tat: tat)
+        return True
+
+
+class RedisStore(object):
+    """ Rate limit store shared between processes through a redis server.
+        The client is any object exposing redis-py's get and eval methods,
+        e.g redis.StrictRedis.from_url(...).
+    """
+
+    # atomically sets KEYS[1] to ARGV[2] if it still holds ARGV[1]:
+    cas_script = """
+        local current = redis.call('get', KEYS[1]) or ''
+        if current ~= ARGV[1] then
+            return 0
+        end
+        redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return float(value) if value else None
+
+    def compare_and_set(self, key, expected, value, ttl):
+        """ Sets key to value if it is still set to expected.
+            Returns whether the value was set.
+        """
+        expected = repr(expected) if expected is not None else ''
+        ttl = max(int(ttl * 1000), 1)
+        return bool(self.client.eval(self.cas_script, 1, self.prefix + key, expected, repr(value), ttl))
+
+
+class RateLimiter(object):
+    """ Limits the rate of the requests made with one of RATELIMIT_METHODS
+        (the writes) to the endpoints listed in RATELIMIT_LIMITS, leaving
+        their reads unlimited. Each client gets a token bucket per endpoint,
+        keyed by the id of the authenticated user or by remote address for
+        anonymous requests.
+        A bucket is tracked as the single timestamp at which it will be full
+        again, so checking and updating it is one read and one write.
+    """
+
+    # attempts at updating a bucket raced by a concurrent request:
+    max_retries = 5
+
+    def __init__(self, app=None, store=None):
+        self.store = store
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Sets the rate limit config defaults, creates the app's store
+            and registers the request hooks on the app.
+        """
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_LIMITS', {})
+        app.config.setdefault('RATELIMIT_METHODS', ('POST', 'PUT', 'PATCH', 'DELETE'))
+        app.config.setdefault('RATELIMIT_REDIS_URL', None)
+
+        # pick the store, defaulting to a fresh in-process one per app:
+        store = self.store
+        if store is None and app.config['RATELIMIT_REDIS_URL']:
+            import redis
+            store = RedisStore(redis.StrictRedis.from_url(app.config['RATELIMIT_REDIS_URL']))
+        if store is None:
+            store = MemoryStore()
+        app.extensions['ratelimit'] = store
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def get_key(self):
+        """ Returns the key identifying the client of the current request.
+        """
+        return get_client_key()
+
+    def hit(self, store, key, limit, period, now):
+        """ Takes a token from the bucket stored under key.
+            Returns a tuple of (allowed, remaining, reset_at, retry_after).
+        """
+        interval = float(period) / limit
+
+        for i in range(self.max_retries):
+            current = store.get(key)
+
+            # the bucket is full again at tat, and holds a token
+            # for every interval between now and tat - period:
+            tat = max(current or now, now)
+            new_tat = tat + interval
+            allow_at = new_tat - period
+            if now < allow_at:
+                return False, 0, tat, allow_at - now
+
+            if store.compare_and_set(key, current, new_tat, new_tat - now):
+                remaining = int((now - allow_at) / interval)
+                return True, remaining, new_tat, 0
+
+        # too much contention on the bucket, treat as exhausted:
+        return False, 0, now + period, interval
+
+    def before_request(self):
+        """ Rejects the request with a 429 if its client's bucket is empty.
+        """
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED'] or request.method not in config['RATELIMIT_METHODS']:
+            return
+
+        limit = config['RATELIMIT_LIMITS'].get(request.endpoint)
+        if limit is None:
+            return
+
+        count, period = limit
+        key = '{}:{}'.format(request.endpoint, self.get_key())
+        allowed, remaining, reset_at, retry_after = self.hit(
+            current_app.extensions['ratelimit'], key, count, period, time.time())
+
+        # save the limit headers for the after_request hook:
+        g.ratelimit_headers = {
+            'X-RateLimit-Limit': str(count),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(int(math.ceil(reset_at))),
+        }
+
+        if not allowed:
+            response = too_many_requests('Rate limit exceeded, retry later')
+            response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+            return response
+
+    def after_request(self, response):
+        """ Adds the rate limit headers to the response of a limited endpoint.
+        """
+        headers = getattr(g, 'ratelimit_headers', None)
+        if headers:
+            response.headers.extend(headers)
+        return response
+
+
+# instantiate the rate limiter extension:
+limiter = RateLimiter()
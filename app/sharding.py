@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from flask_jwt import current_identity
+
+from .softdelete import LiveQuery
+
+
+def shard_bind_key(shard):
+    """ Returns the flask-sqlalchemy bind key of a shard.
+    """
+    return 'shard{}'.format(shard)
+
+
+def shard_for(user_id, shard_count):
+    """ Returns the shard holding the bucketlists of a user.
+    """
+    return user_id % shard_count
+
+
+@contextmanager
+def using_user_shard(user_id):
+    """ Routes the sharded queries made in the block to the shard of
+        user_id, for code running outside an authenticated request
+        (e.g jobs and commands).
+    """
+    previous = getattr(g, 'shard_user_id', None)
+    g.shard_user_id = user_id
+    try:
+        yield
+    finally:
+        g.shard_user_id = previous
+
+
+@contextmanager
+def using_shard(shard):
+    """ Routes the sharded queries made in the block to shard, for code
+        working through every shard in turn (e.g maintenance commands).
+    """
+    previous = getattr(g, 'shard', None)
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+
+def current_shard(app):
+    """ Returns the shard that sharded queries should go to: the shard set
+        with using_shard, or that of the user set with using_user_shard,
+        else that of the authenticated user. Returns None if sharding is
+        off or there is no such user.
+    """
+    shards = app.config['SQLALCHEMY_SHARDS']
+    if not shards or not has_app_context():
+        return None
+
+    shard = getattr(g, 'shard', None)
+    if shard is not None:
+        return shard
+
+    user_id = getattr(g, 'shard_user_id', None)
+    if user_id is None:
+        identity = current_identity._get_current_object()
+        if identity is None:
+            return None
+        user_id = identity.id
+
+    return shard_for(user_id, len(shards))
+
+
+def is_sharded(table):
+    """ Returns whether rows of table are spread across the shards.
+    """
+    info = getattr(table, 'info', None)
+    return bool(info and info.get('sharded'))
+
+
+class RoutingSession(SignallingSession):
+    """ Session routing the queries on sharded tables (those declaring
+        info={'sharded': True}) to the engine of the current user's shard.
+        Other tables stay on the default database.
+    """
+
+    def get_bind(self, mapper, clause=None):
+        # find the tables the query is about:
+        if mapper is not None:
+            tables = [mapper.mapped_table]
+        elif clause is not None:
+            tables = [clause.table] if hasattr(clause, 'table') else getattr(clause, 'froms', [])
+        else:
+            tables = []
+
+        if any(is_sharded(table) for table in tables):
+            shard = current_shard(self.app)
+            if shard is not None:
+                state = get_state(self.app)
+                return state.db.get_engine(self.app, bind=shard_bind_key(shard))
+
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class ShardedSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy extension spreading the sharded tables across the
+        databases listed in SQLALCHEMY_SHARDS, keyed by user id.
+        With no shards configured it behaves exactly as SQLAlchemy.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_SHARDS', [])
+
+        # register each shard as a flask-sqlalchemy bind:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for shard, uri in enumerate(app.config['SQLALCHEMY_SHARDS']):
+            binds[shard_bind_key(shard)] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+        SQLAlchemy.init_app(self, app)
+
+    def create_session(self, options):
+        options.setdefault('query_cls', LiveQuery)
+        return RoutingSession(self, **options)
+
+    def get_shard_engine(self, shard, app=None):
+        """ Returns the engine of a shard.
+        """
+        return self.get_engine(self.get_app(app), bind=shard_bind_key(shard))
+
+    def get_sharded_tables(self):
+        """ Returns the tables spread across the shards.
+        """
+        return [table for table in self.Model.metadata.sorted_tables if is_sharded(table)]
+
+    def _execute_for_shards(self, app, operation):
+        app = self.get_app(app)
+        for shard in range(len(app.config['SQLALCHEMY_SHARDS'])):
+            op = getattr(self.Model.metadata, operation)
+            op(bind=self.get_shard_engine(shard, app), tables=self.get_sharded_tables())
+
+    def create_all(self, bind='__all__', app=None):
+        SQLAlchemy.create_all(self, bind, app)
+        if bind == '__all__':
+            self._execute_for_shards(app, 'create_all')
+
+    def drop_all(self, bind='__all__', app=None):
+        SQLAlchemy.drop_all(self, bind, app)
+        if bind == '__all__':
+            self._execute_for_shards(app, 'drop_all')
+
+
+def rebalance_shards(previous_count, app=None):
+    """ Moves the bucketlists (and items) of every user whose shard changed
+        since there were previous_count shards (0 meaning everything was on
+        the default database) to their current shard. Shards can be added
+        but not removed. Moved rows get new ids on their new shard.
+        Returns the number of users moved.
+    """
+    from . import db
+    from .models import User, Bucketlist, BucketlistItem, UserStats, UserDailyCompletions
+    from .archiving import pack_rows, unpack_rows
+
+    app = db.get_app(app)
+    count = len(app.config['SQLALCHEMY_SHARDS'])
+    if not count or previous_count > count:
+        raise ValueError('Shards can only be added')
+
+    def get_engine(shard_count, shard):
+        if not shard_count:
+            return db.get_engine(app)
+        return db.get_shard_engine(shard, app)
+
+    bucketlists = Bucketlist.__table__
+    items = BucketlistItem.__table__
+    user_tables = (UserStats.__table__, UserDailyCompletions.__table__)
+
+    moved = 0
+    for (user_id,) in db.session.query(User.id).order_by(User.id).all():
+        source = get_engine(previous_count, shard_for(user_id, previous_count or 1))
+        target = get_engine(count, shard_for(user_id, count))
+        if source is target:
+            continue
+
+        # copy to the target then delete from the source, committing the
+        # target first so a failure leaves duplicates rather than losses:
+        with source.begin() as source_conn, target.begin() as target_conn:
+            user_bucketlists = source_conn.execute(
+                bucketlists.select().where(bucketlists.c.creator_id == user_id)).fetchall()
+
+            for bucketlist in user_bucketlists:
+                values = dict(bucketlist)
+                bucketlist_id = values.pop('id')
+
+                # archived items get new ids once restored too:
+                if values['archive']:
+                    archived_items = unpack_rows(items, values['archive'])
+                    for item in archived_items:
+                        del item['id']
+                    values['archive'] = pack_rows(archived_items)
+
+                new_bucketlist_id = target_conn.execute(
+                    bucketlists.insert().values(**values)).inserted_primary_key[0]
+
+                bucketlist_items = []
+                for item in source_conn.execute(items.select().where(items.c.bucketlist_id == bucketlist_id)):
+                    values = dict(item, bucketlist_id=new_bucketlist_id)
+                    del values['id']
+                    bucketlist_items.append(values)
+                if bucketlist_items:
+                    target_conn.execute(items.insert(), bucketlist_items)
+
+                source_conn.execute(items.delete().where(items.c.bucketlist_id == bucketlist_id))
+            source_conn.execute(bucketlists.delete().where(bucketlists.c.creator_id == user_id))
+
+            # move the user's stats along:
+            for table in user_tables:
+                rows = [dict(row) for row in source_conn.execute(table.select().where(table.c.user_id == user_id))]
+                if rows:
+                    target_conn.execute(table.insert(), rows)
+                source_conn.execute(table.delete().where(table.c.user_id == user_id))
+
+        moved += 1
+
+    return moved
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app, request, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# the statements explained, and how each dialect explains them
+# without running them:
+EXPLAINED_STATEMENTS = ('select', 'update', 'delete')
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+
+
+class SlowQueryLog(object):
+    """ Logs the SQL statements taking over SLOWQUERY_THRESHOLD_MS to the
+        rotating SLOWQUERY_LOG_FILE, one json record per line, along with
+        their parameters, the view that ran them and their query plan.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Sets the slow query log config defaults, creates the app's
+            logger and starts timing the statements of all engines.
+        """
+        app.config.setdefault('SLOWQUERY_ENABLED', False)
+        app.config.setdefault('SLOWQUERY_THRESHOLD_MS', 100)
+        app.config.setdefault('SLOWQUERY_LOG_FILE', os.path.join(app.instance_path, 'slowqueries.log'))
+        app.config.setdefault('SLOWQUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)
+        app.config.setdefault('SLOWQUERY_LOG_BACKUP_COUNT', 5)
+
+        if not app.config['SLOWQUERY_ENABLED']:
+            return
+
+        # log to a file of the app's own, opened on the first slow query:
+        path = app.config['SLOWQUERY_LOG_FILE']
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=app.config['SLOWQUERY_LOG_MAX_BYTES'],
+            backupCount=app.config['SLOWQUERY_LOG_BACKUP_COUNT'],
+            delay=True
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.Logger('slowqueries')
+        logger.addHandler(handler)
+        app.extensions['slowqueries'] = logger
+
+        # time the statements of every engine, whichever app it serves:
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+            event.listen(Engine, 'handle_error', handle_error)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def handle_error(context):
+    # drop the start time of a statement that failed, as it has no after_cursor_execute:
+    if context.connection is not None and context.execution_context is not None:
+        start_times = context.connection.info.get('query_start_time')
+        if start_times:
+            start_times.pop()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return # started before the log was turned on
+    duration = (time.time() - start_times.pop()) * 1000
+
+    # only log for apps with the slow query log on:
+    if not has_app_context():
+        return
+    logger = current_app.extensions.get('slowqueries')
+    if logger is None or duration < current_app.config['SLOWQUERY_THRESHOLD_MS']:
+        return
+
+    record = {
+        'time': datetime.now().isoformat(),
+        'duration_ms': round(duration, 3),
+        'statement': statement,
+        'parameters': parameters,
+        'database': conn.engine.url.database,
+        'explain': None if executemany else explain(conn, statement, parameters),
+    }
+    record.update(get_view_details())
+    logger.warning(json.dumps(record, default=repr))
+
+
+def explain(conn, statement, parameters):
+    """ Returns the query plan of statement as a list of rows, each a list
+        of strings, or None if it can't be explained.
+    """
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().lower().startswith(EXPLAINED_STATEMENTS):
+        return None
+
+    # explain on a raw cursor, so as not to time the explain itself,
+    # within a savepoint where a failure would abort the transaction:
+    savepoint = conn.dialect.name == 'postgresql'
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT slowquery_explain')
+        cursor.execute(prefix + statement, parameters)
+        plan = [[unicode(column) for column in row] for row in cursor.fetchall()]
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT slowquery_explain')
+        return plan
+    except Exception, e:
+        if savepoint:
+            cursor.execute('ROLLBACK TO SAVEPOINT slowquery_explain')
+        return [['explain failed: {}'.format(e)]]
+    finally:
+        cursor.close()
+
+
+def get_view_details():
+    """ Returns the details of the request and view running the statement.
+    """
+    if not has_request_context():
+        return {'view': None}
+
+    view = current_app.view_functions.get(request.endpoint)
+    return {
+        'view': view.__name__ if view else None,
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'path': request.path,
+    }
+
+
+# instantiate the slow query log extension:
+slow_query_log = SlowQueryLog()
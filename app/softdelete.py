@@ -0,0 +1,45 @@
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import event
+
+
+class LiveQuery(BaseQuery):
+    """ Query leaving out the soft deleted rows (those with a deleted_at
+        set) of the entities it selects, unless asked for them with
+        with_deleted(). Being the session's query class, it also filters
+        the baked queries, relationships and subqueries. Bulk updates and
+        deletes are left alone.
+    """
+
+    def with_deleted(self):
+        """ Returns the query including the soft deleted rows.
+        """
+        return self.execution_options(include_deleted=True)
+
+    def get(self, ident):
+        # the identity map may hold an instance deleted since it was loaded:
+        instance = super(LiveQuery, self).get(ident)
+        if instance is not None and getattr(instance, 'deleted_at', None) is not None \
+                and not self._execution_options.get('include_deleted'):
+            return None
+        return instance
+
+
+@event.listens_for(LiveQuery, 'before_compile', retval=True)
+def filter_deleted(query):
+    """ Adds the live rows criterion of each soft deletable entity
+        selected to a query about to be compiled.
+    """
+    if query._execution_options.get('include_deleted'):
+        return query
+
+    entities = []
+    for description in query.column_descriptions:
+        entity = description['entity']
+        if entity is not None and hasattr(entity, 'deleted_at') and entity not in entities:
+            entities.append(entity)
+
+    if entities:
+        query = query.enable_assertions(False)
+        for entity in entities:
+            query = query.filter(entity.deleted_at == None)
+    return query
@@ -12,10 +12,109 @@ class BaseConfig:
     DATE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
     DEFAULT_PER_PAGE = 20
     MAX_PER_PAGE = 100
+
+    # how paginated totals are counted unless the request asks with
+    # ?count=exact|estimate|none, and how long estimated totals are cached:
+    DEFAULT_COUNT_MODE = 'estimate'
+    COUNT_CACHE_TTL = 30
+    COUNT_CACHE_SIZE = 1024
     
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
 
+    # do the first request's one-off setup in create_app():
+    WARM_UP = False
+    # time-to-first-request budget checked by 'manage.py startup-profile':
+    STARTUP_TARGET_MS = 300
+
+    # profile requests carrying a signed PROFILE_HEADER token (see
+    # 'manage.py profile-token') and a fraction of all requests:
+    PROFILE_ENABLED = os.environ.get('BUCKETLIST_PROFILE_ENABLED') == '1'
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_TOKEN_MAX_AGE = 3600
+    PROFILE_DIR = os.path.join(basedir, 'profiles')
+    PROFILE_MAX_FILES = 50
+    PROFILE_SAMPLE_RATE = float(os.environ.get('BUCKETLIST_PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_MAX_SAMPLES = 500
+
+    # log the statements slower than SLOWQUERY_THRESHOLD_MS with their
+    # query plan to a rotating file of json records:
+    SLOWQUERY_ENABLED = True
+    SLOWQUERY_THRESHOLD_MS = float(os.environ.get('BUCKETLIST_SLOWQUERY_THRESHOLD_MS') or 100)
+    SLOWQUERY_LOG_FILE = os.path.join(basedir, 'logs', 'slowqueries.log')
+    SLOWQUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOWQUERY_LOG_BACKUP_COUNT = 5
+
+    # databases the bucketlists are spread across, keyed by user id
+    # (bucketlists stay in SQLALCHEMY_DATABASE_URI if empty):
+    SQLALCHEMY_SHARDS = [
+        uri for uri in (os.environ.get('BUCKETLIST_SHARD_DATABASE_URLS') or '').split(',') if uri
+    ]
+
+    COMPRESS_ENABLED = True
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_CACHE_SIZE = 128
+
+    # deletes touching more rows than this are left to the job worker:
+    JOBS_DEFER_THRESHOLD = 500
+    JOBS_DELETE_BATCH_SIZE = 1000
+
+    # seconds after which a job left running (e.g by a crashed worker)
+    # is claimed and run again by another worker:
+    JOBS_LEASE_TIMEOUT = 600
+
+    # seconds a soft deleted bucketlist or item is kept before the purge
+    # (manage.py purge) hard deletes it:
+    PURGE_AFTER = 7 * 24 * 3600
+
+    # length past which moving items respreads the ranks of their bucketlist:
+    ITEM_RANK_MAX_LENGTH = 12
+
+    # responses to writes replayed to their retries carrying the same
+    # Idempotency-Key: for how many seconds, where they're stored (in
+    # process if unset) and for how long a retry waits on the first request:
+    IDEMPOTENCY_TTL = 24 * 3600
+    IDEMPOTENCY_REDIS_URL = os.environ.get('BUCKETLIST_IDEMPOTENCY_REDIS_URL')
+    IDEMPOTENCY_LOCK_TIMEOUT = 10
+
+    # the most requests a batch can hold, and the threads running
+    # the GET requests of parallel batches:
+    BATCH_MAX_REQUESTS = 20
+    BATCH_POOL_SIZE = 4
+
+    # bucketlist events: the redis server carrying them between processes
+    # (in process if unset), the seconds between heartbeats of idle streams,
+    # the events a stream may fall behind by, and the client reconnect delay:
+    EVENTS_REDIS_URL = os.environ.get('BUCKETLIST_EVENTS_REDIS_URL')
+    EVENTS_HEARTBEAT = 15
+    EVENTS_QUEUE_SIZE = 100
+    EVENTS_RETRY_MS = 3000
+
+    # days of completions the user stats cover by default, and at most:
+    STATS_DEFAULT_DAYS = 30
+    STATS_MAX_DAYS = 366
+
+    # request limits per endpoint, as (requests, per seconds), applied to
+    # its writes only:
+    RATELIMIT_ENABLED = True
+    RATELIMIT_REDIS_URL = os.environ.get('BUCKETLIST_RATELIMIT_REDIS_URL')
+    RATELIMIT_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+    RATELIMIT_LIMITS = {
+        'login': (10, 60),
+        'api.refresh_token': (30, 60),
+        'api.register_user': (5, 60),
+        'api.create_bucketlist': (60, 60),
+        'api.manage_bucketlist': (120, 60),
+        'api.archive_bucketlist': (60, 60),
+        'api.create_bucketlist_item': (120, 60),
+        'api.manage_bucketlist_item': (300, 60),
+        'api.move_bucketlist_item': (300, 60),
+        'api.manage_user': (60, 60),
+        'api.batch': (60, 60),
+    }
+
     JWT_EXPIRATION_DELTA = timedelta(hours=1)
+    JWT_REFRESH_EXPIRATION_DELTA = timedelta(days=30)
     JWT_AUTH_USERNAME_KEY = 'email'
     JWT_AUTH_PASSWORD_KEY = 'password'
     JWT_AUTH_URL_RULE = '/api/v1/auth/login'
@@ -44,13 +143,34 @@ class TestingConfig(BaseConfig):
     """ Defines configurations for testing
     """
     TESTING = True
+    SLOWQUERY_ENABLED = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('BUCKETLIST_TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'bucketlist-test.sqlite')
 
+    @staticmethod
+    def init_app(app):
+        """ Moves the test databases in memory when BUCKETLIST_TEST_IN_MEMORY
+            is set (e.g by parallel test workers), so that every app, and so
+            every test, gets fresh databases of its own.
+        """
+        if os.environ.get('BUCKETLIST_TEST_IN_MEMORY'):
+            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+            app.config['SQLALCHEMY_SHARDS'] = ['sqlite://' for uri in app.config['SQLALCHEMY_SHARDS']]
+
+
+class ShardedTestingConfig(TestingConfig):
+    """ Defines configurations for testing with sharded bucketlists
+    """
+    SQLALCHEMY_SHARDS = [
+        'sqlite:///' + os.path.join(basedir, 'bucketlist-test-shard{}.sqlite'.format(shard))
+        for shard in range(3)
+    ]
+
 
 class ProductionConfig(BaseConfig):
     """ Defines configurations for production
     """
+    WARM_UP = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('BUCKETLIST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'bucketlist.sqlite')
 
@@ -58,6 +178,7 @@ class ProductionConfig(BaseConfig):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'testing-sharded': ShardedTestingConfig,
     'production': ProductionConfig,
     'default': DevelopmentConfig
 }
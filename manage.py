@@ -1,28 +1,436 @@
 #!/usr/bin/env python
 
 import os
-from flask.ext.script import Manager
-from flask.ext.migrate import Migrate, MigrateCommand
+import unittest
+from flask_script import Manager, Command, Option
+from flask_migrate import Migrate, MigrateCommand
+
+# start measuring coverage before the app is imported:
+COV = None
+if os.environ.get('BUCKETLIST_COVERAGE'):
+    import coverage
+    COV = coverage.coverage(branch=True, include='app/*', data_suffix=True)
+    COV.start()
 
 from app import create_app, db
 
-# create the flask application:
-app = create_app(os.getenv('BUCKETLIST_FLASK_CONFIG') or 'default')
+# initialize the 'CLI facing' flask extensions, leaving the flask
+# application to be created only once a command is actually run:
+migrate = Migrate(db=db)
+
+
+def make_app(config=None):
+    """Creates the flask application for the command being run"""
+    # keep the chosen config for any child process the command starts:
+    config = config or os.getenv('BUCKETLIST_FLASK_CONFIG') or 'default'
+    os.environ['BUCKETLIST_FLASK_CONFIG'] = config
+
+    app = create_app(config)
+    migrate.init_app(app, db)
+    return app
+
 
-# initialize the 'CLI facing' flask extensions on the created app:
-manager = Manager(app)
-migrate = Migrate(app, db)
+manager = Manager(make_app)
+manager.add_option('-c', '--config', dest='config', required=False)
 
 # add the flask-script commands to be run from the CLI:
 manager.add_command('db', MigrateCommand)
 
 @manager.command
-def test(coverage=False):
+def test(coverage=False, parallel=1):
     """Discovers and runs unit tests"""
+    # restart under coverage so the app's imports are measured too:
+    if coverage and not COV:
+        import sys
+        os.environ['BUCKETLIST_COVERAGE'] = '1'
+        os.execvp(sys.executable, [sys.executable] + sys.argv)
+
     # run the tests:
-    import unittest
     tests = unittest.TestLoader().discover('tests')
-    unittest.TextTestRunner(verbosity=1).run(tests)
+    if int(parallel) > 1:
+        run_parallel_tests(tests, int(parallel))
+    else:
+        unittest.TextTestRunner(verbosity=1).run(tests)
+
+    # merge the coverage of all the test processes and report it:
+    if COV:
+        COV.stop()
+        COV.save()
+        combined = type(COV)(branch=True, include='app/*')
+        combined.combine()
+        combined.save()
+        combined.report()
+
+
+def iter_test_cases(suite):
+    """Yields the test cases of a (nested) test suite"""
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for test_case in iter_test_cases(test):
+                yield test_case
+        else:
+            yield test
+
+
+def run_test_worker(test_ids):
+    """Runs the named tests in a test worker process and returns the results"""
+    from StringIO import StringIO
+
+    tests = unittest.TestLoader().loadTestsFromNames(test_ids)
+    result = unittest.TextTestRunner(stream=StringIO(), verbosity=1).run(tests)
+
+    # save this worker's coverage for the parent to combine:
+    if COV:
+        COV.stop()
+        COV.save()
+
+    return {
+        'run': result.testsRun,
+        'errors': [('ERROR', str(test), error) for test, error in result.errors],
+        'failures': [('FAIL', str(test), error) for test, error in result.failures],
+    }
+
+
+def run_parallel_tests(tests, parallel):
+    """Runs tests split by test case class across parallel worker processes,
+    each using its own in-memory databases, and prints the merged results"""
+    import time
+    from multiprocessing import Pool
+
+    # group the tests by class and spread the classes across the workers:
+    classes = {}
+    for test in iter_test_cases(tests):
+        classes.setdefault(type(test), []).append(test.id())
+    buckets = [[] for i in range(parallel)]
+    for test_ids in sorted(classes.values(), key=len, reverse=True):
+        min(buckets, key=len).extend(test_ids)
+
+    # give every app created by the workers fresh in-memory databases:
+    os.environ['BUCKETLIST_TEST_IN_MEMORY'] = '1'
+
+    start = time.time()
+    pool = Pool(parallel)
+    try:
+        results = pool.map(run_test_worker, [bucket for bucket in buckets if bucket])
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    # print the merged results the way the text runner does:
+    run = sum(result['run'] for result in results)
+    problems = [problem for result in results for problem in result['errors'] + result['failures']]
+    for flavour, test, error in problems:
+        print('=' * 70)
+        print('{}: {}'.format(flavour, test))
+        print('-' * 70)
+        print(error)
+    print('-' * 70)
+    print('Ran {} tests in {:.3f}s using {} workers'.format(run, elapsed, parallel))
+    print('')
+    if problems:
+        print('FAILED (failures={}, errors={})'.format(
+            sum(len(result['failures']) for result in results),
+            sum(len(result['errors']) for result in results)))
+    else:
+        print('OK')
+
+
+@manager.command
+def worker(interval=1.0, once=False):
+    """Runs the background job worker"""
+    from app.jobs import work
+    work(interval=float(interval), once=once)
+
+
+@manager.command
+def rebalance(previous=0):
+    """Moves bucketlists to their new shard after shards are added"""
+    from app.sharding import rebalance_shards
+    moved = rebalance_shards(int(previous))
+    print('Moved the bucketlists of {} users'.format(moved))
+
+
+def backfill_stats(user=None):
+    """Recomputes the rollup stats of every user (or of one user id)"""
+    from app.models import User, UserStats
+    from app.sharding import using_user_shard
+    user_ids = [int(user)] if user else [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    for user_id in user_ids:
+        with using_user_shard(user_id):
+            UserStats.backfill(user_id)
+            db.session.commit()
+    print('Backfilled the stats of {} users'.format(len(user_ids)))
+
+manager.add_command('backfill-stats', Command(backfill_stats))
+
+
+@manager.option('-o', '--older-than', dest='older_than', default=None, help='Age in seconds of the soft deleted rows to purge')
+def purge(older_than=None):
+    """Hard deletes the bucketlists and items soft deleted a while ago"""
+    from flask import current_app
+    from app.jobs import purge_deleted
+    if older_than is None:
+        older_than = current_app.config['PURGE_AFTER']
+    deleted = purge_deleted(int(older_than))
+    print('Purged {} soft deleted rows'.format(deleted))
+
+
+STARTUP_SCRIPT = '''
+import sys, time, cProfile, pstats
+start = time.time()
+profile = cProfile.Profile() if {profile!r} else None
+if profile:
+    profile.enable()
+from app import create_app
+imported = time.time()
+app = create_app({config!r})
+created = time.time()
+response = app.test_client().get('/api/v1/bucketlists/')
+served = time.time()
+if profile:
+    profile.disable()
+    pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+print('%f %f %f' % (imported - start, created - imported, served - created))
+'''
+
+
+def startup_profile(runs=5, profile=False):
+    """Times cold starts of the app up to its first served request"""
+    import sys
+    import subprocess
+    from flask import current_app
+
+    # time fresh interpreters importing the app, creating it and serving a request:
+    timings = []
+    for run in range(int(runs)):
+        script = STARTUP_SCRIPT.format(
+            config=os.environ['BUCKETLIST_FLASK_CONFIG'], profile=profile and run == 0)
+        output = subprocess.check_output(
+            [sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append([float(t) * 1000 for t in output.split()])
+
+    # report the median of each phase against the configured target:
+    def median(values):
+        return sorted(values)[len(values) // 2]
+    phases = [median([timing[i] for timing in timings]) for i in range(3)]
+    total = sum(phases)
+    target = current_app.config['STARTUP_TARGET_MS']
+    print('import: {:.1f}ms, create_app: {:.1f}ms, first request: {:.1f}ms'.format(*phases))
+    print('time to first request: {:.1f}ms (target {}ms) {}'.format(
+        total, target, 'OK' if total <= target else 'OVER TARGET'))
+    if total > target:
+        sys.exit(1)
+
+manager.add_command('startup-profile', Command(startup_profile))
+
+
+def profile_report(endpoint='api.', limit=30, sort='cumulative', requests=False):
+    """Prints the top functions of the sampled profiles of the api views"""
+    from flask import current_app
+    from app.profiling import load_profile_report
+
+    stats, count = load_profile_report(current_app, endpoint, samples=True, requests=requests)
+    if stats is None:
+        print('No profiles of {}* endpoints in {}'.format(endpoint, current_app.config['PROFILE_DIR']))
+        return
+
+    print('Aggregated profiles of {} requests to {}* endpoints'.format(count, endpoint))
+    stats.sort_stats(sort).print_stats(int(limit))
+
+
+def profile_token():
+    """Prints a token getting requests profiled when sent in the profile header"""
+    from flask import current_app
+    from app.profiling import Profiler
+
+    print('{}: {}'.format(current_app.config['PROFILE_HEADER'], Profiler.make_token(current_app)))
+
+
+manager.add_command('profile-report', Command(profile_report))
+manager.add_command('profile-token', Command(profile_token))
+
+
+def make_benchmark_app(database_uri='sqlite://'):
+    """Creates an unthrottled testing app on a fresh database, in memory
+    by default, for the benchmarks"""
+    app = create_app('testing')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_SHARDS=[],
+        RATELIMIT_ENABLED=False,
+    )
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def time_calls(function, runs):
+    """Returns the mean CPU time, in microseconds, of calling function"""
+    import time
+    function()
+    start = time.clock()
+    for run in range(runs):
+        function()
+    return (time.clock() - start) / runs * 1e6
+
+
+def benchmark_queries(runs=2000):
+    """Compares the CPU time of the baked hot lookups with plain queries"""
+    from flask import g
+    from app.models import User, Bucketlist, BucketlistItem
+    from app.api_1_0.authentication import identity
+
+    app = make_benchmark_app()
+    with app.test_request_context():
+        user = User(email='somebody@somedomain.com', password='anything', logged_in=True)
+        bucketlist = Bucketlist(name="The Melancholic's Wishlist", created_by=user)
+        item = BucketlistItem(name='Kayak across the Atlantic', bucketlist=bucketlist)
+        db.session.add_all([user, bucketlist, item])
+        db.session.commit()
+        user_id, bucketlist_id, item_id = user.id, bucketlist.id, item.id
+
+        def unmemoized(lookup):
+            # forget the lookup memoized by the previous call:
+            def call():
+                g.lookups = {}
+                lookup()
+            return call
+
+        lookups = [
+            ('get_user_bucketlist',
+                lambda: Bucketlist.query.filter_by(created_by=user, id=bucketlist_id).first(),
+                unmemoized(lambda: Bucketlist.get_user_bucketlist(user, bucketlist_id))),
+            ('get_bucketlist_item',
+                lambda: BucketlistItem.query.filter_by(bucketlist=bucketlist, id=item_id).first(),
+                unmemoized(lambda: BucketlistItem.get_bucketlist_item(bucketlist, item_id))),
+            ('identity',
+                lambda: User.query.filter(User.id == user_id).first(),
+                lambda: identity({'identity': user_id})),
+        ]
+
+        print('{:<22}{:>14}{:>14}{:>10}'.format('lookup', 'plain (us)', 'baked (us)', 'speedup'))
+        for name, plain, baked in lookups:
+            plain_time = time_calls(plain, int(runs))
+            baked_time = time_calls(baked, int(runs))
+            print('{:<22}{:>14.1f}{:>14.1f}{:>9.2f}x'.format(
+                name, plain_time, baked_time, plain_time / baked_time))
+
+manager.add_command('benchmark-queries', Command(benchmark_queries))
+
+
+MEMORY_SCRIPT = '''
+import resource
+from manage import make_benchmark_app
+from app import db
+from app.models import User, Bucketlist, BucketlistItem
+
+app = make_benchmark_app()
+with app.test_request_context():
+    user = User(email='somebody@somedomain.com', password='anything')
+    bucketlist = Bucketlist(name="The Melancholic's Wishlist", created_by=user)
+    db.session.add_all([user, bucketlist] + [
+        BucketlistItem(name='Wish number %d' % i, bucketlist=bucketlist) for i in range({items})])
+    db.session.commit()
+    bucketlist_id = bucketlist.id
+
+    def load_page():
+        # a request's own session, loading a page of items the way the view does:
+        session = db.create_session({{}})
+        query = session.query(*BucketlistItem.json_columns()) if {rows!r} else session.query(BucketlistItem)
+        items = query.filter(BucketlistItem.bucketlist_id == bucketlist_id)\\
+                     .order_by(BucketlistItem.rank, BucketlistItem.id)\\
+                     .limit({items}).all()
+        return session, items, [BucketlistItem.row_to_json(item) for item in items]
+
+    # hold the pages of concurrent requests, measuring the peak resident memory:
+    load_page()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pages = [load_page() for request in range({requests})]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('%d' % (after - before))
+'''
+
+
+def benchmark_memory(requests=200, items=100):
+    """Compares the peak memory of get_bucketlist pages loaded as mapped
+    items with pages of plain rows"""
+    import sys
+    import subprocess
+
+    # measure each way in a fresh interpreter, as peak memory only grows:
+    print('{:<16}{:>16}{:>18}'.format('page of', 'peak (KB)', 'per request (KB)'))
+    for name, rows in (('mapped items', False), ('rows', True)):
+        script = MEMORY_SCRIPT.format(requests=int(requests), items=int(items), rows=rows)
+        peak = int(subprocess.check_output(
+            [sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__))))
+        print('{:<16}{:>16}{:>18.1f}'.format(name, peak, float(peak) / int(requests)))
+
+manager.add_command('benchmark-memory', Command(benchmark_memory))
+
+
+def benchmark_logins(threads=8, logins=25):
+    """Compares concurrent logins that set the logged-in flag with repeat
+    logins that leave it unchanged, on a sqlite database file"""
+    import json
+    import time
+    import shutil
+    import tempfile
+    import threading
+    from flask import url_for
+    from sqlalchemy import event
+    from app.models import User
+
+    threads, logins = int(threads), int(logins)
+    directory = tempfile.mkdtemp()
+    try:
+        app = make_benchmark_app('sqlite:///' + os.path.join(directory, 'benchmark.sqlite'))
+        with app.test_request_context():
+            login_url = url_for('login')
+            emails = ['user{}@somedomain.com'.format(i) for i in range(threads * logins)]
+            db.session.add_all([User(email=email, password='anything') for email in emails])
+            db.session.commit()
+
+            # count the writes made by the logins:
+            writes = []
+            def count_writes(conn, cursor, statement, *args):
+                if not statement.lstrip().upper().startswith('SELECT'):
+                    writes.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count_writes)
+
+        def client(emails, failures):
+            test_client = app.test_client()
+            for email in emails:
+                response = test_client.post(
+                    login_url,
+                    headers={'Content-Type': 'application/json'},
+                    data=json.dumps({'email': email, 'password': 'anything'})
+                )
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+        def run():
+            # each client logs in its own share of the users:
+            failures = []
+            del writes[:]
+            workers = [threading.Thread(target=client, args=(emails[i::threads], failures))
+                       for i in range(threads)]
+            start = time.time()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            return time.time() - start, len(writes), len(failures)
+
+        print('{:<26}{:>12}{:>10}{:>10}'.format('logins', 'logins/s', 'writes', 'failed'))
+        for name in ('first (flag set)', 'repeat (flag unchanged)'):
+            elapsed, write_count, failed = run()
+            print('{:<26}{:>12.1f}{:>10}{:>10}'.format(
+                name, len(emails) / elapsed, write_count, failed))
+    finally:
+        shutil.rmtree(directory)
+
+manager.add_command('benchmark-logins', Command(benchmark_logins))
 
 
 # start the server:
@@ -0,0 +1,189 @@
+import unittest
+import json
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem, UserStats
+
+
+class ArchiveTestCase(unittest.TestCase):
+    """ Testcase for archiving bucketlists and restoring them on access
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1))
+        db.session.add(BucketlistItem(name="Camp on Mount Kilimanjaro", done=True, bucketlist=bucketlist_1))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def archive_bucketlist(self, id):
+        return self.client.post(
+            url_for('api.archive_bucketlist', id=id),
+            headers=self.get_api_headers(self.access_token)
+        )
+
+
+    def get_bucketlists(self, **params):
+        response = self.client.get(
+            url_for('api.get_bucketlists', **params),
+            headers=self.get_api_headers(self.access_token)
+        )
+        return json.loads(response.data)['bucketlists']
+
+
+    def test_archive_moves_items_out_of_the_hot_tables(self):
+        """ Tests that archiving a bucketlist packs its items and leaves it
+            out of the bucketlists listed.
+            POST '/bucketlists/<int:id>/archive'
+        """
+        response = self.archive_bucketlist(1)
+        bucketlist = json.loads(response.data)['bucketlist']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(bucketlist['archived'])
+        self.assertEqual(bucketlist['item_count'], 2)
+        self.assertEqual(BucketlistItem.query.count(), 0)
+
+        self.assertEqual([b['id'] for b in self.get_bucketlists()], [2])
+        archived = self.get_bucketlists(archived='true')
+        self.assertEqual([(b['id'], b['item_count']) for b in archived], [(1, 2)])
+
+        # archiving again leaves it as it is:
+        self.assertEqual(self.archive_bucketlist(1).status_code, 200)
+        self.assertEqual(self.archive_bucketlist(233).status_code, 404)
+
+
+    def test_access_restores_the_bucketlist(self):
+        """ Tests that getting an archived bucketlist restores it with its items.
+            GET '/bucketlists/<int:id>'
+        """
+        self.archive_bucketlist(1)
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        bucketlist = json.loads(response.data)['bucketlist']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(bucketlist['archived'])
+        self.assertEqual([(item['id'], item['done']) for item in bucketlist['items']], [(1, False), (2, True)])
+        self.assertEqual(BucketlistItem.query.count(), 2)
+        self.assertEqual([b['id'] for b in self.get_bucketlists()], [1, 2])
+        self.assertEqual(self.get_bucketlists(archived='true'), [])
+
+
+    def test_item_update_restores_the_bucketlist(self):
+        """ Tests that updating an item of an archived bucketlist restores it first.
+            PUT '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        self.archive_bucketlist(1)
+        response = self.client.put(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'done': True})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(BucketlistItem.query.filter_by(done=True).count(), 2)
+        self.assertIsNone(Bucketlist.query.get(1).archived_at)
+
+
+    def test_archive_and_restore_keep_the_version(self):
+        """ Tests that archiving and restoring a bucketlist leave its version
+            as it is, so that clients' If-Match headers still apply.
+        """
+        bucketlist = json.loads(self.archive_bucketlist(1).data)['bucketlist']
+        self.assertEqual(bucketlist['version'], 1)
+
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(json.loads(response.data)['bucketlist']['version'], 1)
+        self.assertEqual(Bucketlist.query.get(1).version_id, 1)
+
+
+    def test_concurrent_restores_insert_the_items_once(self):
+        """ Tests that a restore from a bucketlist read before another
+            request restored it leaves the items as they are.
+        """
+        self.archive_bucketlist(1)
+        stale = Bucketlist.query.options(db.undefer(Bucketlist.archive)).get(1)
+        db.session.expunge(stale)
+
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+
+        Bucketlist.restore_bucketlist(stale)
+        db.session.commit()
+        self.assertIsNone(stale.archived_at)
+        self.assertEqual(BucketlistItem.query.count(), 2)
+        self.assertIsNone(Bucketlist.query.get(1).archived_at)
+
+
+    def test_archived_items_stay_in_the_stats(self):
+        """ Tests that archived items are still counted, including by a backfill.
+        """
+        self.archive_bucketlist(1)
+        UserStats.backfill(self.user.id)
+        db.session.commit()
+        stats = UserStats.query.get(self.user.id)
+        self.assertEqual((stats.bucketlist_count, stats.item_count, stats.done_count), (2, 2, 1))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import json
+from sqlalchemy import event
 from flask import current_app, url_for
 from app import create_app, db
 from app.models import User
@@ -241,6 +242,127 @@ class AuthenticationTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 401)
 
 
+    def test_repeat_login_does_not_write(self):
+        """ Tests that logging in an already logged-in user only reads.
+            POST '/auth/login'
+        """
+        def login():
+            return self.client.post(
+                url_for('login'),
+                headers=self.get_api_headers(),
+                data=json.dumps({
+                    'email': 'somebody@somedomain.com',
+                    'password': 'anything',
+                })
+            )
+
+        # the first login sets the logged-in flag:
+        self.assertEqual(login().status_code, 200)
+
+        # count the statements of the next login:
+        statements = []
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = login()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('SELECT'))
+
+
+    def login(self):
+        """ logs the test user in and returns the response data.
+        """
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        return json.loads(response.data)
+
+
+    def refresh(self, refresh_token):
+        """ exchanges a refresh token for a new access token.
+        """
+        return self.client.post(
+            url_for('api.refresh_token'),
+            headers=self.get_api_headers(),
+            data=json.dumps({'refresh_token': refresh_token})
+        )
+
+
+    def test_refresh_token_gets_new_access_token(self):
+        """ Tests that a refresh token is exchanged for a working access
+            token without verifying the password.
+            POST '/auth/refresh'
+        """
+        refresh_token = self.login().get('refresh_token')
+        self.assertIsNotNone(refresh_token)
+
+        verify_password = User.verify_password
+        def fail_verify_password(user, password):
+            self.fail('the password was verified')
+        User.verify_password = fail_verify_password
+        try:
+            response = self.refresh(refresh_token)
+        finally:
+            User.verify_password = verify_password
+        self.assertEqual(response.status_code, 200)
+
+        access_token = json.loads(response.data).get('access_token')
+        response = self.client.get(
+            url_for('api.get_bucketlists'),
+            headers=self.get_api_headers(access_token=access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_tokens_are_not_interchangeable(self):
+        """ Tests that refresh tokens don't access resources and access
+            tokens don't refresh.
+            GET '/bucketlists/', POST '/auth/refresh'
+        """
+        response_data = self.login()
+
+        response = self.client.get(
+            url_for('api.get_bucketlists'),
+            headers=self.get_api_headers(access_token=response_data.get('refresh_token'))
+        )
+        self.assertEqual(response.status_code, 401)
+
+        response = self.refresh(response_data.get('access_token'))
+        self.assertEqual(response.status_code, 401)
+
+        response = self.refresh('not.a.token')
+        self.assertEqual(response.status_code, 401)
+
+
+    def test_logout_revokes_refresh_tokens(self):
+        """ Tests that refresh tokens stop working once the user logs out,
+            even after logging back in.
+            GET '/auth/logout', POST '/auth/refresh'
+        """
+        response_data = self.login()
+        self.client.get(
+            url_for('api.logout'),
+            headers=self.get_api_headers(access_token=response_data.get('access_token'))
+        )
+
+        response = self.refresh(response_data.get('refresh_token'))
+        self.assertEqual(response.status_code, 401)
+
+        self.login()
+        response = self.refresh(response_data.get('refresh_token'))
+        self.assertEqual(response.status_code, 401)
+
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
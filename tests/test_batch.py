@@ -0,0 +1,201 @@
+import unittest
+import json
+from sqlalchemy import event
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem
+
+
+class BatchTestCase(unittest.TestCase):
+    """ Testcase for the batch endpoint running several requests in one
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def post_batch(self, requests, parallel=False):
+        return self.client.post(
+            url_for('api.batch'),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'requests': requests, 'parallel': parallel})
+        )
+
+
+    def get_reads(self):
+        return [
+            {'url': url_for('api.manage_user')},
+            {'url': url_for('api.get_bucketlists')},
+            {'url': url_for('api.get_bucketlist', id=1)},
+            {'url': url_for('api.get_bucketlist', id=2)},
+            {'url': url_for('api.get_bucketlist', id=233)},
+        ]
+
+
+    def test_batch_returns_responses_in_order(self):
+        """ Tests that a batch runs its requests and returns their responses in order.
+            POST '/batch'
+        """
+        response = self.post_batch(self.get_reads())
+        responses = json.loads(response.data)['responses']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in responses], [200, 200, 200, 200, 404])
+        self.assertEqual(responses[0]['body']['profile']['email'], 'somebody@somedomain.com')
+        self.assertEqual(len(responses[1]['body']['bucketlists']), 2)
+        self.assertEqual(responses[2]['body']['bucketlist']['name'], "The Choleric's Wishlist")
+        self.assertEqual(responses[3]['body']['bucketlist']['name'], "The Sanguine's Wishlist")
+
+
+    def test_parallel_batch_matches_sequential_batch(self):
+        """ Tests that running the GET requests of a batch in parallel
+            returns the same responses.
+            POST '/batch'
+        """
+        sequential = json.loads(self.post_batch(self.get_reads()).data)
+        parallel = json.loads(self.post_batch(self.get_reads(), parallel=True).data)
+        self.assertEqual(parallel, sequential)
+
+
+    def test_batch_writes_are_seen_by_later_requests(self):
+        """ Tests that the requests of a batch run in order around writes.
+            POST '/batch'
+        """
+        response = self.post_batch([
+            {'method': 'POST', 'url': url_for('api.create_bucketlist_item', id=2),
+             'body': {'name': 'Camp on Mount Kilimanjaro'}},
+            {'url': url_for('api.get_bucketlist', id=2)},
+            {'method': 'DELETE', 'url': url_for('api.manage_bucketlist_item', id=1, item_id=1)},
+            {'url': url_for('api.get_bucketlist', id=1)},
+        ], parallel=True)
+        responses = json.loads(response.data)['responses']
+
+        self.assertEqual([r['status'] for r in responses], [201, 200, 200, 200])
+        self.assertEqual(len(responses[1]['body']['bucketlist']['items']), 1)
+        self.assertEqual(responses[3]['body']['bucketlist']['items'], [])
+
+
+    def test_batch_resolves_the_identity_once(self):
+        """ Tests that the requests of a batch reuse the batch's user.
+            POST '/batch'
+        """
+        statements = []
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM users' in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statements)
+
+        try:
+            response = self.post_batch(self.get_reads())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statements)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+
+
+    def test_invalid_batches(self):
+        """ Tests that malformed batches are rejected.
+            POST '/batch'
+        """
+        self.app.config['BATCH_MAX_REQUESTS'] = 2
+        invalid_batches = [
+            [],
+            [{'url': 'http://example.com/'}],
+            [{'url': url_for('api.batch'), 'method': 'POST'}],
+            [{'url': url_for('api.get_bucketlists'), 'method': 'TRACE'}],
+            [{'url': url_for('api.get_bucketlists')}] * 3,
+            [{'url': url_for('api.batch').replace('batch', '%62atch'), 'method': 'POST'}],
+            [{'url': url_for('api.batch') + '?nested=1', 'method': 'POST'}],
+        ]
+        for requests in invalid_batches:
+            self.assertEqual(self.post_batch(requests).status_code, 400)
+
+
+    def test_batch_ignores_sub_request_accept_encoding(self):
+        """ Tests that sub-requests asking for compression get json bodies.
+            POST '/batch'
+        """
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        response = self.post_batch([
+            {'url': url_for('api.manage_user'), 'headers': {'Accept-Encoding': 'gzip'}},
+        ])
+        responses = json.loads(response.data)['responses']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(responses[0]['body']['profile']['email'], 'somebody@somedomain.com')
+
+
+    def test_failing_sub_request_gets_its_own_error(self):
+        """ Tests that an exception in a sub-request doesn't fail the batch.
+            POST '/batch'
+        """
+        def fail(*args, **kwargs):
+            raise RuntimeError('boom')
+        self.app.view_functions['api.manage_user'] = fail
+        self.app.logger.disabled = True
+
+        response = self.post_batch(self.get_reads())
+        responses = json.loads(response.data)['responses']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in responses], [500, 200, 200, 200, 404])
+        self.assertEqual(responses[0]['body']['error'], 'internal server error')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import json
+from sqlalchemy import event
 from flask import current_app, url_for
 from app import create_app, db
 from app.models import User, Bucketlist, BucketlistItem
@@ -137,6 +138,48 @@ class BucketlistsTestCase(unittest.TestCase):
         self.assertEqual(response_data.get('next_url'),  None)
 
 
+    def test_get_bucketlists_without_counting_total(self):
+        """ Tests that the total is skipped when not wanted while the
+            next page is still found.
+            GET '/bucketlists/?limit=2&count=none'
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlists', limit=2, count='none'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        response_data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response_data.get('bucketlists')), 2)
+        self.assertEqual(response_data.get('total'), None)
+        self.assertEqual(response_data.get('next_url'),
+            url_for('api.get_bucketlists', limit=2, count='none', page=2, _external=True))
+
+
+    def test_search_total_estimate_is_cached(self):
+        """ Tests that estimated search totals are reused for a while,
+            while exact totals are always counted.
+            GET '/bucketlists/?q=Wishlist&count=estimate|exact'
+        """
+        def get_total(count):
+            response = self.client.get(
+                url_for('api.get_bucketlists', q='Wishlist', count=count),
+                headers=self.get_api_headers(self.access_token)
+            )
+            return json.loads(response.data).get('total')
+
+        self.assertEqual(get_total('estimate'), 3)
+        db.session.add(Bucketlist(name="The Sanguine's Wishlist", created_by=self.user))
+        db.session.commit()
+
+        self.assertEqual(get_total('estimate'), 3)
+        self.assertEqual(get_total('exact'), 4)
+
+        # the cached total expires:
+        self.app.extensions['count_cache'].ttl = 0
+        self.assertEqual(get_total('estimate'), 4)
+
+
     def test_get_bucketlist_with_valid_id_and_parameters(self):
         """ Tests the get_bucketlist API using valid id.
             Page and limit params for its items are also specified
@@ -302,6 +345,37 @@ class BucketlistsTestCase(unittest.TestCase):
         )
 
 
+    def test_delete_bucketlist_is_a_single_update(self):
+        """ Tests delete bucketlist soft deletes it with one UPDATE, hiding its items.
+            DELETE '/bucketlists/3'
+        """
+        statements = []
+        def count_writes(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith(('UPDATE bucketlist', 'DELETE')) or 'FROM bucketlist_item' in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_writes)
+
+        try:
+            response = self.client.delete(
+                url_for('api.manage_bucketlist', id=3),
+                headers=self.get_api_headers(self.access_token)
+            )
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_writes)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertIsNone(Bucketlist.query.get(3))
+        self.assertIsNotNone(Bucketlist.query.with_deleted().get(3))
+
+        response = self.client.put(
+            url_for('api.manage_bucketlist_item', id=3, item_id=BucketlistItem.query.filter_by(bucketlist_id=3).first().id),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'done': True})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
 
 
 if __name__ == '__main__':
@@ -1,8 +1,10 @@
 import unittest
 import json
+from sqlalchemy import event
 from flask import current_app, url_for
 from app import create_app, db
 from app.models import User, Bucketlist, BucketlistItem
+from app.jobs import run_pending
 
 
 class BucketlistsItemsTestCase(unittest.TestCase):
@@ -189,6 +191,232 @@ class BucketlistsItemsTestCase(unittest.TestCase):
         )
 
 
+    def test_update_bucketlist_item_is_single_guarded_update(self):
+        """ Tests that updating an item issues one UPDATE without loading it first.
+            PUT '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        statements = []
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            if 'bucketlist_item' in statement:
+                statements.append(statement.split()[0])
+        event.listen(db.engine, 'before_cursor_execute', count_statements)
+
+        try:
+            response = self.client.put(
+                url_for('api.manage_bucketlist_item', id=1, item_id=2),
+                headers=self.get_api_headers(self.access_token),
+                data=json.dumps({
+                    'name': 'Row across the Atlantic',
+                    'done': True,
+                })
+            )
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statements)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statements[0], 'UPDATE')
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertLessEqual(len(statements), 2)
+
+        bucketlist_item = BucketlistItem.query.get(2)
+        self.assertEqual(bucketlist_item.name, 'Row across the Atlantic')
+        self.assertEqual(bucketlist_item.done, True)
+        self.assertEqual(
+            json.loads(response.data)['bucketlist_item']['name'],
+            'Row across the Atlantic'
+        )
+
+
+    def test_update_other_users_bucketlist_item_not_found(self):
+        """ Tests that the guarded update leaves other users' items untouched.
+            PUT '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        other_user = User(email="nobody@somedomain.com", password="anything")
+        db.session.add(other_user)
+        db.session.commit()
+
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'nobody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        access_token = json.loads(response.data).get('access_token')
+
+        response = self.client.put(
+            url_for('api.manage_bucketlist_item', id=1, item_id=2),
+            headers=self.get_api_headers(access_token),
+            data=json.dumps({
+                'done': True,
+            })
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(BucketlistItem.query.get(2).done, False)
+
+
+    def test_get_user_bucketlist_item_is_one_memoized_query(self):
+        """ Tests that the joined item lookup takes a single query
+            and is memoized for the rest of the request.
+        """
+        statements = []
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        # load the user before counting:
+        self.user.id
+
+        with self.app.test_request_context():
+            event.listen(db.engine, 'before_cursor_execute', count_statements)
+            try:
+                bucketlist_item = BucketlistItem.get_user_bucketlist_item(self.user, 1, 2)
+                bucketlist = Bucketlist.get_user_bucketlist(self.user, 1)
+                self.assertIs(BucketlistItem.get_user_bucketlist_item(self.user, 1, 2), bucketlist_item)
+                self.assertIs(bucketlist_item.bucketlist, bucketlist)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count_statements)
+
+        self.assertEqual(len(statements), 1)
+
+
+    def test_get_user_bucketlist_item_checks_owner(self):
+        """ Tests that the joined item lookup rejects other users' items.
+        """
+        other_user = User(email="nobody@somedomain.com", password="anything")
+        db.session.add(other_user)
+        db.session.commit()
+
+        with self.app.test_request_context():
+            self.assertRaises(Exception, BucketlistItem.get_user_bucketlist_item, other_user, 1, 2)
+
+
+    def move_bucketlist_item(self, item_id, **move):
+        """ moves an item of the test bucketlist through the api.
+        """
+        return self.client.patch(
+            url_for('api.move_bucketlist_item', id=1, item_id=item_id),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps(move)
+        )
+
+
+    def get_item_ids(self):
+        """ gets the ids of the test bucketlist's items in the listed order.
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        return [item['id'] for item in json.loads(response.data)['bucketlist']['items']]
+
+
+    def test_new_bucketlist_items_are_ranked_last(self):
+        """ Tests that items are listed in the order they were added.
+            POST '/bucketlists/<int:id>/items/'
+        """
+        response = self.client.post(
+            url_for('api.create_bucketlist_item', id=1),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'name': 'Hike up Kilimanjaro'})
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_item_ids(), [1, 2, 3, 4])
+
+        ranks = [item.rank for item in BucketlistItem.query.order_by(BucketlistItem.id)]
+        self.assertEqual(ranks, sorted(ranks))
+
+
+    def test_move_bucketlist_item(self):
+        """ Tests moving items before, after, first and last.
+            PATCH '/bucketlists/<int:id>/items/<int:item_id>/move'
+        """
+        response = self.move_bucketlist_item(3, position='first')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_item_ids(), [3, 1, 2])
+
+        self.move_bucketlist_item(3, after=1)
+        self.assertEqual(self.get_item_ids(), [1, 3, 2])
+
+        self.move_bucketlist_item(2, before=3)
+        self.assertEqual(self.get_item_ids(), [1, 2, 3])
+
+        self.move_bucketlist_item(1, position='last')
+        self.assertEqual(self.get_item_ids(), [2, 3, 1])
+
+
+    def test_move_bucketlist_item_updates_only_the_moved_row(self):
+        """ Tests that a move writes the moved item's rank and nothing else.
+            PATCH '/bucketlists/<int:id>/items/<int:item_id>/move'
+        """
+        updates = []
+        def count_updates(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE'):
+                updates.append((statement, parameters))
+        event.listen(db.engine, 'before_cursor_execute', count_updates)
+
+        try:
+            response = self.move_bucketlist_item(1, after=2)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_updates)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('rank=?', updates[0][0])
+        self.assertEqual(updates[0][1][-1], 1)
+
+
+    def test_long_ranks_are_rebalanced_in_the_background(self):
+        """ Tests that moves making ranks too long queue a single rebalance,
+            which shortens the ranks and keeps the order.
+            PATCH '/bucketlists/<int:id>/items/<int:item_id>/move'
+        """
+        self.app.config['ITEM_RANK_MAX_LENGTH'] = 3
+        for i in range(20):
+            self.move_bucketlist_item(1 + i % 2, before=3)
+        order = self.get_item_ids()
+        self.assertGreater(max(len(item.rank) for item in BucketlistItem.query), 3)
+
+        self.assertEqual(run_pending(), 1)
+        db.session.expire_all()
+        self.assertLessEqual(max(len(item.rank) for item in BucketlistItem.query), 3)
+        self.assertEqual(self.get_item_ids(), order)
+
+
+    def test_long_ranks_of_appends_are_rebalanced_in_the_background(self):
+        """ Tests that appends making ranks too long queue a single rebalance.
+            POST '/bucketlists/<int:id>/items/'
+        """
+        self.app.config['ITEM_RANK_MAX_LENGTH'] = 3
+        for i in range(20):
+            response = self.client.post(
+                url_for('api.create_bucketlist_item', id=1),
+                headers=self.get_api_headers(self.access_token),
+                data=json.dumps({'name': 'Wish number {}'.format(i)})
+            )
+            self.assertEqual(response.status_code, 201)
+        order = self.get_item_ids()
+        self.assertGreater(max(len(item.rank) for item in BucketlistItem.query), 3)
+
+        self.assertEqual(run_pending(), 1)
+        db.session.expire_all()
+        self.assertLessEqual(max(len(item.rank) for item in BucketlistItem.query), 3)
+        self.assertEqual(self.get_item_ids(), order)
+
+
+    def test_move_bucketlist_item_with_invalid_parameters(self):
+        """ Tests that moves need exactly one valid destination in the
+            same bucketlist.
+            PATCH '/bucketlists/<int:id>/items/<int:item_id>/move'
+        """
+        self.assertEqual(self.move_bucketlist_item(1).status_code, 400)
+        self.assertEqual(self.move_bucketlist_item(1, before=2, after=3).status_code, 400)
+        self.assertEqual(self.move_bucketlist_item(1, position='middle').status_code, 400)
+        self.assertEqual(self.move_bucketlist_item(1, after=1).status_code, 400)
+        self.assertEqual(self.move_bucketlist_item(1, after=42).status_code, 404)
+        self.assertEqual(self.move_bucketlist_item(42, position='first').status_code, 404)
+
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,161 @@
+import unittest
+import json
+import zlib
+from flask import current_app, url_for
+from app import create_app, db, compress
+from app.models import User, Bucketlist, BucketlistItem
+
+
+class CompressionTestCase(unittest.TestCase):
+    """ Testcase for the api response compression
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with a bucketlist holding a page worth of items:
+        bucketlist = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add(bucketlist)
+        for i in range(20):
+            db.session.add(BucketlistItem(name="Wish number {}".format(i), bucketlist=bucketlist))
+        db.session.commit()
+
+        compress.cache.clear()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token='', encoding=None):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        headers = {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+        if encoding:
+            headers['Accept-Encoding'] = encoding
+        return headers
+
+
+    def test_large_response_is_gzipped(self):
+        """ Tests that a large response is gzipped when the client accepts it.
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token, 'gzip, deflate')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('Accept-Encoding', response.headers.get('Vary'))
+
+        response_data = json.loads(zlib.decompress(response.data, 16 + zlib.MAX_WBITS))
+        self.assertEqual(len(response_data['bucketlist']['items']), 20)
+
+
+    def test_compressed_responses_tag_their_etag_with_the_coding(self):
+        """ Tests that a compressed response's strong etag carries its
+            content-coding, and still matches the version on writes.
+            PUT '/bucketlists/<int:id>'
+        """
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        def update_bucketlist(name, encoding=None, etag=None):
+            headers = self.get_api_headers(self.access_token, encoding)
+            if etag:
+                headers['If-Match'] = etag
+            return self.client.put(url_for('api.manage_bucketlist', id=1), headers=headers,
+                                   data=json.dumps({'name': name}))
+
+        response = update_bucketlist("The Choleric's Wishlist", 'gzip')
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(response.headers.get('ETag'), '"2-gzip"')
+        self.assertEqual(update_bucketlist("The Melancholic's Wishlist").headers.get('ETag'), '"3"')
+
+        self.assertEqual(update_bucketlist("The Phlegmatic's Wishlist", etag='"2-gzip"').status_code, 412)
+        self.assertEqual(update_bucketlist("The Phlegmatic's Wishlist", etag='"3-gzip"').status_code, 200)
+        self.assertEqual(update_bucketlist("The Phlegmatic's Wishlist", etag='"4"').status_code, 200)
+
+
+    def test_deflate_is_used_when_gzip_is_not_accepted(self):
+        """ Tests that deflate is negotiated when gzip is refused.
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token, 'gzip;q=0, deflate')
+        )
+        self.assertEqual(response.headers.get('Content-Encoding'), 'deflate')
+        response_data = json.loads(zlib.decompress(response.data))
+        self.assertEqual(len(response_data['bucketlist']['items']), 20)
+
+
+    def test_response_is_not_compressed_without_accept_encoding(self):
+        """ Tests that clients not sending Accept-Encoding get identity responses.
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertEqual(len(json.loads(response.data)['bucketlist']['items']), 20)
+
+
+    def test_small_response_is_not_compressed(self):
+        """ Tests that responses under COMPRESS_MIN_SIZE are sent as is.
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlist', id=1),
+            headers=self.get_api_headers('invalid-token', 'gzip')
+        )
+        self.assertLess(len(response.data), current_app.config['COMPRESS_MIN_SIZE'])
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+
+    def test_compressed_bytes_are_cached(self):
+        """ Tests that repeated identical responses reuse the cached compressed bytes.
+        """
+        for i in range(2):
+            response = self.client.get(
+                url_for('api.get_bucketlist', id=1),
+                headers=self.get_api_headers(self.access_token, 'gzip')
+            )
+        self.assertEqual(len(compress.cache), 1)
+        self.assertIn(response.data, compress.cache.values())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
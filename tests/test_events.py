@@ -0,0 +1,222 @@
+import unittest
+import json
+from flask import current_app, url_for
+from sqlalchemy import event as sqlalchemy_event
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem
+from app.events import Events, LocalBackend, EventHub, bucketlist_channel
+
+
+class EventsTestCase(unittest.TestCase):
+    """ Testcase for the server-sent events of bucketlist changes
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def open_stream(self, id, client=None):
+        """ opens the event stream of a bucketlist and returns
+            an iterator over its frames, past the initial retry frame.
+        """
+        response = (client or self.client).get(
+            url_for('api.get_bucketlist_events', id=id),
+            headers=self.get_api_headers(self.access_token),
+            buffered=False
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        frames = iter(response.response)
+        self.assertTrue(next(frames).startswith('retry:'))
+        return frames
+
+
+    def read_event(self, frames):
+        """ reads the next frame of a stream as a tuple of (event, data).
+        """
+        lines = next(frames).strip().split('\n')
+        return lines[0][len('event: '):], json.loads(lines[1][len('data: '):])
+
+
+    def test_stream_pushes_item_changes(self):
+        """ Tests that creating, updating and deleting items of a bucketlist
+            pushes events to its stream.
+            GET '/bucketlists/<int:id>/events'
+        """
+        frames = self.open_stream(1)
+
+        self.client.post(
+            url_for('api.create_bucketlist_item', id=1),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'name': 'Camp on Mount Kilimanjaro'})
+        )
+        event, data = self.read_event(frames)
+        self.assertEqual(event, 'item_created')
+        self.assertEqual(data['bucketlist_item']['name'], 'Camp on Mount Kilimanjaro')
+
+        self.client.put(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'done': True})
+        )
+        event, data = self.read_event(frames)
+        self.assertEqual(event, 'item_updated')
+        self.assertEqual(data['bucketlist_item']['done'], True)
+
+        self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(self.read_event(frames), ('item_deleted', {'id': 1}))
+
+
+    def test_item_events_do_not_reload_the_user(self):
+        """ Tests that publishing the event of an item write
+            does not reload the user expired by its commit.
+            POST, PUT, DELETE '/bucketlists/<int:id>/items/'
+        """
+        # count the statements that read the users table:
+        statements = []
+        def count_statement(conn, cursor, statement, *args):
+            if 'FROM users' in statement:
+                statements.append(statement)
+        sqlalchemy_event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            self.client.post(
+                url_for('api.create_bucketlist_item', id=1),
+                headers=self.get_api_headers(self.access_token),
+                data=json.dumps({'name': 'Camp on Mount Kilimanjaro'})
+            )
+            self.client.put(
+                url_for('api.manage_bucketlist_item', id=1, item_id=1),
+                headers=self.get_api_headers(self.access_token),
+                data=json.dumps({'done': True})
+            )
+            self.client.delete(
+                url_for('api.manage_bucketlist_item', id=1, item_id=1),
+                headers=self.get_api_headers(self.access_token)
+            )
+        finally:
+            sqlalchemy_event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        # only the identity of each request is loaded:
+        self.assertEqual(len(statements), 3)
+
+
+    def test_stream_only_gets_its_bucketlist_events(self):
+        """ Tests that a stream skips the events of other bucketlists.
+            GET '/bucketlists/<int:id>/events'
+        """
+        frames = self.open_stream(2)
+
+        for id in (1, 2):
+            self.client.post(
+                url_for('api.create_bucketlist_item', id=id),
+                headers=self.get_api_headers(self.access_token),
+                data=json.dumps({'name': 'Item of {}'.format(id)})
+            )
+
+        event, data = self.read_event(frames)
+        self.assertEqual(data['bucketlist_item']['name'], 'Item of 2')
+
+
+    def test_stream_of_unknown_bucketlist(self):
+        """ Tests that streaming a bucketlist the user doesn't own errors out.
+            GET '/bucketlists/<int:id>/events'
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlist_events', id=233),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_events_cross_processes_through_the_backend(self):
+        """ Tests that events published by one app reach the streams of
+            another app sharing its backend, as separate workers would.
+        """
+        backend = LocalBackend()
+        Events(backend=backend).init_app(self.app)
+        other_app = create_app('testing')
+        Events(backend=backend).init_app(other_app)
+
+        with other_app.app_context():
+            frames = self.open_stream(1, other_app.test_client())
+
+        self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(self.read_event(frames), ('item_deleted', {'id': 1}))
+
+
+    def test_lagging_stream_is_ended(self):
+        """ Tests that a stream falling too far behind is ended and unsubscribed.
+        """
+        hub = EventHub(LocalBackend(), heartbeat=15, queue_size=2)
+        channel = bucketlist_channel(1, 1)
+        subscription = hub.subscribe(channel)
+
+        for i in range(3):
+            hub.publish(channel, 'item_deleted', {'id': i})
+
+        self.assertIsNone(subscription.get())
+        self.assertNotIn(channel, hub.subscriptions)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
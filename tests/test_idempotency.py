@@ -0,0 +1,207 @@
+import unittest
+import json
+from sqlalchemy import event
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist
+from app.idempotency import RedisStore
+
+
+class LocalRedis(object):
+    """ Local stand-in for a redis client, implementing the get, set and
+        release script calls used by the RedisStore.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def eval(self, script, numkeys, key, token):
+        if self.data.get(key) != token:
+            return 0
+        del self.data[key]
+        return 1
+
+
+class IdempotencyTestCase(unittest.TestCase):
+    """ Testcase for the replay of retried writes carrying an idempotency key
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token='', idempotency_key=None):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        headers = {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        return headers
+
+
+    def create_bucketlist(self, name, idempotency_key):
+        return self.client.post(
+            url_for('api.create_bucketlist'),
+            headers=self.get_api_headers(self.access_token, idempotency_key),
+            data=json.dumps({'name': name})
+        )
+
+
+    def test_retry_is_replayed(self):
+        """ Tests that a retried create returns the first response
+            without creating a duplicate.
+            POST '/bucketlists/'
+        """
+        first = self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+        retry = self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry.headers.get('Idempotent-Replayed'), 'true')
+        self.assertIsNone(first.headers.get('Idempotent-Replayed'))
+        self.assertEqual(Bucketlist.query.count(), 1)
+
+        # a new key is a new request:
+        self.assertEqual(self.create_bucketlist("The Choleric's Wishlist", 'retry-2').status_code, 201)
+        self.assertEqual(Bucketlist.query.count(), 2)
+
+
+    def test_replay_does_not_touch_the_database(self):
+        """ Tests that replaying a response runs no SQL.
+            POST '/bucketlists/'
+        """
+        self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+
+        statements = []
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statements)
+
+        try:
+            response = self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statements)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(statements, [])
+
+
+    def test_replayed_update_keeps_its_etag(self):
+        """ Tests that a retried update returns the version of the first one.
+            PUT '/bucketlists/<int:id>'
+        """
+        self.create_bucketlist("The Choleric's Wishlist", 'create-1')
+
+        def update_bucketlist():
+            return self.client.put(
+                url_for('api.manage_bucketlist', id=1),
+                headers=self.get_api_headers(self.access_token, 'update-1'),
+                data=json.dumps({'name': "The Sanguine's Wishlist"})
+            )
+        first = update_bucketlist()
+        retry = update_bucketlist()
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers.get('ETag'), '"2"')
+        self.assertEqual(retry.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(retry.headers.get('ETag'), '"2"')
+        self.assertEqual(Bucketlist.query.get(1).version_id, 2)
+
+
+    def test_key_reused_for_another_request(self):
+        """ Tests that reusing a key with a different body is rejected.
+            POST '/bucketlists/'
+        """
+        self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+        response = self.create_bucketlist("The Sanguine's Wishlist", 'retry-1')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Bucketlist.query.count(), 1)
+
+
+    def test_concurrent_duplicate_waits_for_the_lock(self):
+        """ Tests that a duplicate of a request still running is turned
+            away once it has waited for it too long.
+            POST '/bucketlists/'
+        """
+        self.app.config['IDEMPOTENCY_LOCK_TIMEOUT'] = 0.1
+        store = self.app.extensions['idempotency']
+        key = 'user:{}:POST:{}:retry-1'.format(self.user.id, url_for('api.create_bucketlist'))
+        token = store.acquire(key, 10)
+
+        response = self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Bucketlist.query.count(), 0)
+
+        # the first request finishing lets the retries through:
+        store.release(key, token)
+        self.assertEqual(self.create_bucketlist("The Choleric's Wishlist", 'retry-1').status_code, 201)
+
+
+    def test_retry_is_replayed_from_redis(self):
+        """ Tests the replay of retries with responses stored in redis.
+            POST '/bucketlists/'
+        """
+        self.app.extensions['idempotency'] = RedisStore(LocalRedis())
+
+        first = self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+        retry = self.create_bucketlist("The Choleric's Wishlist", 'retry-1')
+
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(Bucketlist.query.count(), 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
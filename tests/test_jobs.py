@@ -0,0 +1,198 @@
+import unittest
+import json
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem, Job
+from app.jobs import enqueue, run_pending, purge_deleted
+
+
+class JobsTestCase(unittest.TestCase):
+    """ Testcase for the background jobs, the deferred deletes and the purge
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app.config['JOBS_DEFER_THRESHOLD'] = 2
+        self.app.config['JOBS_DELETE_BATCH_SIZE'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Melancholic's Wishlist", created_by=self.user)
+        db.session.add(bucketlist_1)
+        bucketlist_2 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        db.session.add(bucketlist_2)
+        for i in range(3):
+            db.session.add(BucketlistItem(name="Wish number {}".format(i), bucketlist=bucketlist_1))
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", bucketlist=bucketlist_2))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def test_delete_bucketlist_is_purged_later(self):
+        """ Tests that deleting a bucketlist, however large, is done in the
+            request, and its rows are hard deleted by the purge.
+            DELETE '/bucketlists/<int:id>'
+        """
+        response = self.client.delete(
+            url_for('api.manage_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(Bucketlist.query.get(1))
+        self.assertEqual(Job.query.count(), 0)
+        self.assertEqual(BucketlistItem.query.with_deleted().filter_by(bucketlist_id=1).count(), 3)
+
+        # purge the soft deleted rows:
+        self.assertEqual(purge_deleted(0), 4)
+        self.assertEqual(Bucketlist.query.with_deleted().count(), 1)
+        self.assertEqual(BucketlistItem.query.with_deleted().filter_by(bucketlist_id=1).count(), 0)
+        self.assertEqual(BucketlistItem.query.with_deleted().filter_by(bucketlist_id=2).count(), 1)
+
+
+    def test_purge_keeps_recently_deleted_rows(self):
+        """ Tests that the purge leaves the rows deleted less than older_than ago.
+        """
+        self.client.delete(
+            url_for('api.manage_bucketlist_item', id=2, item_id=4),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(purge_deleted(3600), 0)
+        self.assertEqual(BucketlistItem.query.with_deleted().count(), 4)
+
+        self.assertEqual(purge_deleted(0), 1)
+        self.assertEqual(BucketlistItem.query.with_deleted().count(), 3)
+
+
+    def test_delete_large_user_is_deferred(self):
+        """ Tests that deregistering a large account defers deleting its bucketlists.
+            DELETE '/user/'
+        """
+        response = self.client.delete(
+            url_for('api.manage_user'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(User.query.get(1).logged_in)
+
+        run_pending()
+        self.assertIsNone(User.query.get(1))
+        self.assertEqual(Bucketlist.query.count(), 0)
+        self.assertEqual(BucketlistItem.query.count(), 0)
+
+
+    def test_deferred_delete_keeps_the_user_id_taken(self):
+        """ Tests that a user registering before the deferred delete ran
+            gets a new id, and keeps their bucketlists once it has.
+            DELETE '/user/'
+        """
+        self.client.delete(
+            url_for('api.manage_user'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        response = self.client.post(
+            url_for('api.register_user'),
+            headers=self.get_api_headers(),
+            data=json.dumps({'email': 'somebody@somedomain.com', 'password': 'anything'})
+        )
+        self.assertEqual(response.status_code, 201)
+        user = User.get_user_by_email('somebody@somedomain.com')
+        self.assertNotEqual(user.id, 1)
+        self.assertEqual(Bucketlist.query.filter_by(creator_id=user.id).count(), 0)
+
+        db.session.add(Bucketlist(name="The Phlegmatic's Wishlist", created_by=user))
+        db.session.commit()
+        run_pending()
+        self.assertEqual(Bucketlist.query.filter_by(creator_id=user.id).count(), 1)
+        self.assertEqual(Bucketlist.query.count(), 1)
+
+
+    def test_get_job_with_invalid_key(self):
+        """ Tests that getting an unknown job errors out.
+            GET '/jobs/<key>'
+        """
+        response = self.client.get(url_for('api.get_job', key='nothing'))
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_failed_job_is_recorded(self):
+        """ Tests that a job raising an error is marked as failed.
+        """
+        job = enqueue('rebalance_item_ranks', bucketlist_id=1, user_id=1, unexpected=True)
+        db.session.commit()
+
+        run_pending()
+        job = Job.query.get(job.id)
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.error)
+
+
+    def test_job_left_running_is_reclaimed(self):
+        """ Tests that a job still running past its lease is run again,
+            and one within its lease is left to its worker.
+        """
+        now = datetime.now()
+        stale = enqueue('rebalance_item_ranks', bucketlist_id=1, user_id=1)
+        stale.status, stale.claimed_at = 'running', now - timedelta(seconds=601)
+        leased = enqueue('rebalance_item_ranks', bucketlist_id=2, user_id=1)
+        leased.status, leased.claimed_at = 'running', now - timedelta(seconds=10)
+        db.session.commit()
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(Job.query.get(stale.id).status, 'done')
+        self.assertEqual(Job.query.get(leased.id).status, 'running')
+
+
+    def test_enqueue_unknown_job(self):
+        """ Tests that only registered jobs can be queued.
+        """
+        self.assertRaises(ValueError, enqueue, 'nothing')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+import json
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist
+from app.profiling import Profiler, profiler, list_profiles, load_profile_report
+
+
+class ProfilingTestCase(unittest.TestCase):
+    """ Testcase for the on demand and sampled request profiling
+    """
+
+    def setUp(self):
+
+        # setup the app with profiling enabled and push app context:
+        self.app = create_app('testing')
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.config.update(
+            PROFILE_ENABLED=True,
+            PROFILE_DIR=self.profile_dir,
+            PROFILE_SAMPLE_RATE=0.0,
+        )
+        profiler.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.add(Bucketlist(name="The Sanguine's Wishlist", created_by=self.user))
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.profile_dir)
+
+
+    def get_api_headers(self, access_token='', profile_token=None):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        headers = {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+        if profile_token:
+            headers['X-Profile'] = profile_token
+        return headers
+
+
+    def get_bucketlists(self, profile_token=None):
+        return self.client.get(
+            url_for('api.get_bucketlists'),
+            headers=self.get_api_headers(self.access_token, profile_token)
+        )
+
+
+    def test_request_with_signed_header_is_profiled(self):
+        """ Tests that a request carrying a valid token gets its stats dumped.
+            GET '/bucketlists/'
+        """
+        response = self.get_bucketlists(Profiler.make_token(self.app))
+        profile_id = response.headers.get('X-Profile-Id')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(profile_id)
+        self.assertEqual(list_profiles(os.path.join(self.profile_dir, 'requests')), [profile_id])
+        self.assertIn('api.get_bucketlists', profile_id)
+
+
+    def test_request_with_forged_header_is_not_profiled(self):
+        """ Tests that a request with an invalid token is served unprofiled.
+            GET '/bucketlists/'
+        """
+        response = self.get_bucketlists('profile.forged.token')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('X-Profile-Id'))
+        self.assertFalse(os.path.exists(os.path.join(self.profile_dir, 'requests')))
+
+
+    def test_sampled_profiles_are_bounded_and_aggregated(self):
+        """ Tests that only the most recent sampled profiles are kept and
+            that the report aggregates those of the api views.
+            GET '/bucketlists/'
+        """
+        self.app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        self.app.config['PROFILE_MAX_SAMPLES'] = 2
+        for i in range(3):
+            self.get_bucketlists()
+
+        samples = list_profiles(os.path.join(self.profile_dir, 'samples'))
+        self.assertEqual(len(samples), 2)
+
+        stats, count = load_profile_report(self.app, 'api.')
+        self.assertEqual(count, 2)
+        self.assertTrue(any(function[2] == 'get_bucketlists' for function in stats.stats))
+
+        stats, count = load_profile_report(self.app, 'api.get_job')
+        self.assertIsNone(stats)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import unittest
+import json
+import time
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User
+from app.ratelimit import RateLimiter, MemoryStore, RedisStore
+
+
+class LocalRedis(object):
+    """ Local stand-in for a redis client, implementing the get
+        and compare-and-set script calls used by the RedisStore.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def eval(self, script, numkeys, key, expected, value, ttl):
+        if self.data.get(key, '') != expected:
+            return 0
+        self.data[key] = value
+        return 1
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """ Testcase for the rate limiting of API endpoints
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app.config['RATELIMIT_LIMITS'] = {'login': (3, 60)}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def login(self, client=None):
+        """ attempts a login with invalid credentials.
+        """
+        return (client or self.client).post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'wrong',
+            })
+        )
+
+
+    def test_rate_limit_headers(self):
+        """ Tests that limited endpoints report the client's remaining budget.
+        """
+        response = self.login()
+        self.assertEqual(response.headers.get('X-RateLimit-Limit'), '3')
+        self.assertEqual(response.headers.get('X-RateLimit-Remaining'), '2')
+        self.assertIsNotNone(response.headers.get('X-RateLimit-Reset'))
+
+
+    def test_login_is_rate_limited(self):
+        """ Tests that login attempts over the limit are rejected with a 429.
+            POST '/auth/login'
+        """
+        for i in range(3):
+            self.assertEqual(self.login().status_code, 401)
+
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers.get('X-RateLimit-Remaining'), '0')
+        self.assertGreater(int(response.headers.get('Retry-After')), 0)
+
+
+    def test_unlimited_endpoints_are_not_rate_limited(self):
+        """ Tests that endpoints without a configured limit are untouched.
+        """
+        response = self.client.get(url_for('api.get_bucketlists'), headers=self.get_api_headers())
+        self.assertIsNone(response.headers.get('X-RateLimit-Limit'))
+
+
+    def test_reads_of_limited_endpoints_are_not_rate_limited(self):
+        """ Tests that only the writes to a limited endpoint are limited.
+            GET '/user/'
+        """
+        self.app.config['RATELIMIT_LIMITS'] = {'api.manage_user': (1, 60)}
+        for i in range(3):
+            response = self.client.get(url_for('api.manage_user'), headers=self.get_api_headers())
+            self.assertNotEqual(response.status_code, 429)
+            self.assertIsNone(response.headers.get('X-RateLimit-Limit'))
+
+        response = self.client.put(url_for('api.manage_user'), headers=self.get_api_headers())
+        self.assertEqual(response.headers.get('X-RateLimit-Limit'), '1')
+
+
+    def test_shared_store_limits_across_apps(self):
+        """ Tests that apps sharing a store share their clients' budgets.
+        """
+        store = RedisStore(LocalRedis())
+        self.app.extensions['ratelimit'] = store
+
+        other_app = create_app('testing')
+        other_app.config['RATELIMIT_LIMITS'] = {'login': (3, 60)}
+        other_app.extensions['ratelimit'] = store
+        other_client = other_app.test_client()
+
+        self.assertEqual(self.login().status_code, 401)
+        self.assertEqual(self.login(other_client).status_code, 401)
+        self.assertEqual(self.login().status_code, 401)
+        self.assertEqual(self.login(other_client).status_code, 429)
+
+
+    def test_bucket_refills_over_time(self):
+        """ Tests that an exhausted bucket refills a token per interval.
+        """
+        limiter = RateLimiter()
+        store = MemoryStore()
+        for i in range(2):
+            self.assertTrue(limiter.hit(store, 'key', 2, 10, 100.0)[0])
+        self.assertFalse(limiter.hit(store, 'key', 2, 10, 100.0)[0])
+        self.assertTrue(limiter.hit(store, 'key', 2, 10, 105.0)[0])
+
+
+    def test_refilled_buckets_are_swept(self):
+        """ Tests that the in-process store drops the refilled buckets
+            every sweep interval of writes.
+        """
+        store = MemoryStore()
+        store.sweep_interval = 3
+        store.compare_and_set('refilled', None, 1.0, 10)
+        store.compare_and_set('filling', None, time.time() + 100, 10)
+        self.assertEqual(store.get('refilled'), 1.0)
+        store.compare_and_set('another', None, 1.0, 10)
+        self.assertEqual(sorted(store.buckets), ['filling'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import json
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem
+from app.api_1_0 import responses
+
+
+class ResponsesTestCase(unittest.TestCase):
+    """ Testcase for the json responses of the api
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def get_bucketlist(self, id, **params):
+        return self.client.get(
+            url_for('api.get_bucketlist', id=id, **params),
+            headers=self.get_api_headers(self.access_token)
+        )
+
+
+    def test_responses_are_compact(self):
+        """ Tests that responses are encoded without whitespace by default.
+            GET '/bucketlists/<int:id>'
+        """
+        response = self.get_bucketlist(1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertNotIn('\n', response.data)
+        self.assertNotIn('": ', response.data)
+        self.assertEqual(json.loads(response.data)['bucketlist']['items'][0]['name'], "Kayak across the Atlantic")
+
+
+    def test_pretty_responses(self):
+        """ Tests that ?pretty=1 indents the same response.
+            GET '/bucketlists/<int:id>?pretty=1'
+        """
+        compact = self.get_bucketlist(1)
+        pretty = self.get_bucketlist(1, pretty=1)
+        self.assertIn('\n  "', pretty.data)
+        self.assertGreater(len(pretty.data), len(compact.data))
+        self.assertEqual(json.loads(pretty.data)['bucketlist'], json.loads(compact.data)['bucketlist'])
+
+        response = self.get_bucketlist(233, pretty=1)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('\n  "', response.data)
+
+
+    def test_error_bodies_are_encoded_once(self):
+        """ Tests that the body of an error response is reused.
+            GET '/bucketlists/<int:id>'
+        """
+        responses.error_bodies.clear()
+        first = self.get_bucketlist(233)
+        second = self.get_bucketlist(234)
+
+        self.assertEqual(first.status_code, 404)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(json.loads(first.data), {'error': 'not_found', 'message': 'Item does not exist'})
+        self.assertEqual(responses.error_bodies.keys(), [('not_found', 'Item does not exist')])
+
+
+    def test_error_bodies_cache_evicts_the_least_recently_used(self):
+        """ Tests that the error bodies cache keeps caching new messages once full.
+        """
+        responses.error_bodies.clear()
+        with self.app.test_request_context():
+            for i in range(responses.ERROR_BODIES_MAX):
+                responses.error_response(400, 'bad request', 'message {}'.format(i))
+            responses.error_response(400, 'bad request', 'message 0')
+            response = responses.error_response(404, 'not_found', 'Item does not exist')
+
+        self.assertEqual(len(responses.error_bodies), responses.ERROR_BODIES_MAX)
+        self.assertIn(('bad request', 'message 0'), responses.error_bodies)
+        self.assertNotIn(('bad request', 'message 1'), responses.error_bodies)
+        self.assertEqual(responses.error_bodies.keys()[-1], ('not_found', 'Item does not exist'))
+        self.assertEqual(json.loads(response.data)['message'], 'Item does not exist')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
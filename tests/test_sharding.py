@@ -0,0 +1,204 @@
+import unittest
+import json
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem
+from app.sharding import rebalance_shards, using_user_shard
+from app.jobs import run_pending, purge_deleted
+
+
+class ShardingTestCase(unittest.TestCase):
+    """ Testcase for the bucketlists spread across several databases
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing-sharded')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test users, one per shard:
+        for i in range(3):
+            user = User(
+                username="Somebody {}".format(i),
+                email="somebody{}@somedomain.com".format(i),
+                password="anything"
+            )
+            db.session.add(user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the users in and get their authentication tokens:
+        self.access_tokens = {}
+        for i in range(3):
+            response = self.client.post(
+                url_for('login'),
+                headers=self.get_api_headers(),
+                data=json.dumps({
+                    'email': 'somebody{}@somedomain.com'.format(i),
+                    'password': 'anything',
+                })
+            )
+            self.access_tokens[i + 1] = json.loads(response.data).get('access_token')
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def create_bucketlist(self, user_id, name):
+        """ creates a bucketlist through the api as the given user.
+        """
+        response = self.client.post(
+            url_for('api.create_bucketlist'),
+            headers=self.get_api_headers(self.access_tokens[user_id]),
+            data=json.dumps({'name': name})
+        )
+        return json.loads(response.data)['bucketlist']
+
+
+    def count_rows(self, engine, table):
+        """ counts the rows of a table in the database of engine.
+        """
+        return engine.execute(table.count()).scalar()
+
+
+    def test_bucketlists_are_written_to_their_users_shard(self):
+        """ Tests that each user's bucketlists land on their own shard only.
+            POST '/bucketlists/'
+        """
+        for user_id in self.access_tokens:
+            self.create_bucketlist(user_id, "Wishlist of user {}".format(user_id))
+
+        bucketlists = Bucketlist.__table__
+        for shard in range(3):
+            engine = db.get_shard_engine(shard)
+            rows = engine.execute(bucketlists.select()).fetchall()
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(rows[0].creator_id % 3, shard)
+
+        # nothing is written to the default database:
+        self.assertEqual(self.count_rows(db.engine, bucketlists), 0)
+
+
+    def test_users_read_from_their_shard(self):
+        """ Tests that bucketlists with the same id on different shards
+            are each served to their own user.
+            GET '/bucketlists/<int:id>'
+        """
+        for user_id in self.access_tokens:
+            self.create_bucketlist(user_id, "Wishlist of user {}".format(user_id))
+
+        for user_id, access_token in self.access_tokens.items():
+            response = self.client.get(
+                url_for('api.get_bucketlist', id=1),
+                headers=self.get_api_headers(access_token)
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                json.loads(response.data)['bucketlist']['name'],
+                "Wishlist of user {}".format(user_id)
+            )
+
+
+    def test_items_are_managed_on_their_shard(self):
+        """ Tests creating, updating and deleting items on a shard.
+            POST '/bucketlists/<int:id>/items/'
+            PUT, DELETE '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        bucketlist = self.create_bucketlist(2, "The Sanguine's Wishlist")
+        headers = self.get_api_headers(self.access_tokens[2])
+
+        response = self.client.post(
+            url_for('api.create_bucketlist_item', id=bucketlist['id']),
+            headers=headers,
+            data=json.dumps({'name': 'Kayak across the Atlantic'})
+        )
+        self.assertEqual(response.status_code, 201)
+        item_id = json.loads(response.data)['bucketlist_item']['id']
+
+        response = self.client.put(
+            url_for('api.manage_bucketlist_item', id=bucketlist['id'], item_id=item_id),
+            headers=headers,
+            data=json.dumps({'done': True})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['bucketlist_item']['done'], True)
+
+        response = self.client.delete(
+            url_for('api.manage_bucketlist_item', id=bucketlist['id'], item_id=item_id),
+            headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        items = BucketlistItem.__table__
+        live_items = items.count(items.c.deleted_at == None)
+        self.assertEqual(db.get_shard_engine(2).execute(live_items).scalar(), 0)
+
+
+    def test_purge_runs_on_every_shard(self):
+        """ Tests that the purge hard deletes the rows soft deleted on the user's shard.
+            DELETE '/bucketlists/<int:id>'
+        """
+        with using_user_shard(1):
+            bucketlist = Bucketlist(name="The Melancholic's Wishlist", creator_id=1)
+            db.session.add(bucketlist)
+            db.session.add(BucketlistItem(name="Kayak across the Atlantic", bucketlist=bucketlist))
+            db.session.commit()
+
+        response = self.client.delete(
+            url_for('api.manage_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_tokens[1])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.count_rows(db.get_shard_engine(1), BucketlistItem.__table__), 1)
+
+        purge_deleted(0)
+        self.assertEqual(self.count_rows(db.get_shard_engine(1), Bucketlist.__table__), 0)
+        self.assertEqual(self.count_rows(db.get_shard_engine(1), BucketlistItem.__table__), 0)
+
+
+    def test_rebalance_moves_bucketlists_to_their_shard(self):
+        """ Tests that rebalancing moves unsharded bucketlists to their shards.
+        """
+        bucketlists = Bucketlist.__table__
+        items = BucketlistItem.__table__
+        bucketlist_id = db.engine.execute(bucketlists.insert().values(
+            name="The Phlegmatic's Wishlist", creator_id=2)).inserted_primary_key[0]
+        db.engine.execute(items.insert().values(
+            name="Kayak across the Atlantic", bucketlist_id=bucketlist_id, done=False))
+
+        self.assertEqual(rebalance_shards(0), 3)
+
+        self.assertEqual(self.count_rows(db.engine, bucketlists), 0)
+        self.assertEqual(self.count_rows(db.engine, items), 0)
+        self.assertEqual(self.count_rows(db.get_shard_engine(2), bucketlists), 1)
+        self.assertEqual(self.count_rows(db.get_shard_engine(2), items), 1)
+
+        response = self.client.get(
+            url_for('api.get_bucketlists'),
+            headers=self.get_api_headers(self.access_tokens[2])
+        )
+        self.assertEqual(json.loads(response.data)['total'], 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+import json
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist
+from app.slowqueries import slow_query_log
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    """ Testcase for the log of slow SQL statements
+    """
+
+    def setUp(self):
+
+        # setup the app logging every statement and push app context:
+        self.app = create_app('testing')
+        self.log_dir = tempfile.mkdtemp()
+        self.app.config.update(
+            SLOWQUERY_ENABLED=True,
+            SLOWQUERY_THRESHOLD_MS=0,
+            SLOWQUERY_LOG_FILE=os.path.join(self.log_dir, 'slowqueries.log'),
+        )
+        slow_query_log.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.add(Bucketlist(name="The Sanguine's Wishlist", created_by=self.user))
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        for handler in self.app.extensions['slowqueries'].handlers:
+            handler.close()
+        shutil.rmtree(self.log_dir)
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def read_records(self):
+        """ reads the json records of the slow query log.
+        """
+        with open(self.app.config['SLOWQUERY_LOG_FILE']) as log:
+            return [json.loads(line) for line in log]
+
+
+    def test_slow_queries_are_logged_with_view_and_plan(self):
+        """ Tests that the statements of a search are logged with the
+            view running them and their query plan.
+            GET '/bucketlists/?q=Sanguine'
+        """
+        response = self.client.get(
+            url_for('api.get_bucketlists', q='Sanguine', count='exact'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+
+        records = [record for record in self.read_records()
+                   if record['view'] == 'get_bucketlists' and 'LIKE' in record['statement']]
+        self.assertTrue(records)
+        for record in records:
+            self.assertEqual(record['endpoint'], 'api.get_bucketlists')
+            self.assertIn('%Sanguine%', record['parameters'])
+            self.assertTrue(any('ix_bucketlists_live_creator_id' in ' '.join(row) for row in record['explain']))
+
+
+    def test_fast_queries_are_not_logged(self):
+        """ Tests that statements under the threshold are not logged.
+        """
+        self.app.config['SLOWQUERY_THRESHOLD_MS'] = 60 * 1000
+        records = len(self.read_records())
+        self.client.get(
+            url_for('api.get_bucketlists'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(len(self.read_records()), records)
+
+
+    def test_failed_statements_are_not_timed(self):
+        """ Tests that a statement failing leaves no start time behind.
+        """
+        with db.engine.connect() as conn:
+            self.assertRaises(Exception, conn.execute, 'SELECT * FROM nothing')
+            self.assertEqual(conn.info.get('query_start_time'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import json
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem, UserStats
+from app.jobs import purge_deleted
+
+
+class SoftDeleteTestCase(unittest.TestCase):
+    """ Testcase for the soft deletes of bucketlists and items and their purge
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1))
+        db.session.add(BucketlistItem(name="Camp on Mount Kilimanjaro", done=True, bucketlist=bucketlist_1))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def get_bucketlist(self, id):
+        return self.client.get(
+            url_for('api.get_bucketlist', id=id),
+            headers=self.get_api_headers(self.access_token)
+        )
+
+
+    def test_deleted_item_is_hidden(self):
+        """ Tests that a deleted item is kept but left out of its bucketlist.
+            DELETE '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        response = self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=2),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+
+        items = json.loads(self.get_bucketlist(1).data)['bucketlist']['items']
+        self.assertEqual([item['id'] for item in items], [1])
+        self.assertIsNone(BucketlistItem.query.get(2))
+        self.assertIsNotNone(BucketlistItem.query.with_deleted().get(2).deleted_at)
+
+        # it can't be updated or deleted again:
+        response = self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=2),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_deleted_bucketlist_is_hidden(self):
+        """ Tests that a deleted bucketlist is left out of the user's bucketlists.
+            DELETE '/bucketlists/<int:id>'
+        """
+        response = self.client.delete(
+            url_for('api.manage_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_bucketlist(1).status_code, 404)
+
+        response = self.client.get(
+            url_for('api.get_bucketlists'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        bucketlists = json.loads(response.data)['bucketlists']
+        self.assertEqual([bucketlist['id'] for bucketlist in bucketlists], [2])
+        self.assertEqual(self.user.bucketlists.count(), 1)
+
+
+    def test_stats_survive_the_purge(self):
+        """ Tests that soft deletes (of bucketlists, on their purge) take rows
+            out of the stats once, as a backfill would compute them.
+        """
+        self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=2),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.client.delete(
+            url_for('api.manage_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        stats = UserStats.query.get(self.user.id)
+        self.assertEqual((stats.bucketlist_count, stats.item_count, stats.done_count), (1, 1, 0))
+
+        # the deleted bucketlist's items leave the stats with the purge:
+        self.assertEqual(purge_deleted(0), 3)
+        db.session.expire_all()
+        stats = UserStats.query.get(self.user.id)
+        self.assertEqual((stats.bucketlist_count, stats.item_count, stats.done_count), (1, 0, 0))
+        UserStats.backfill(self.user.id)
+        db.session.commit()
+        stats = UserStats.query.get(self.user.id)
+        self.assertEqual((stats.bucketlist_count, stats.item_count, stats.done_count), (1, 0, 0))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import unittest
+import json
+from datetime import date
+from sqlalchemy import event
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem, UserStats
+from app.jobs import purge_deleted
+
+
+class StatsTestCase(unittest.TestCase):
+    """ Testcase for the user stats endpoint and the rollups behind it
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add_all([
+            BucketlistItem(name="Bungee off the Brooklyn Bridge", done=True, bucketlist=bucketlist_1),
+            BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1),
+            BucketlistItem(name="Scuba dive in the Mariannah Trench", done=False, bucketlist=bucketlist_2),
+        ])
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token=''):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        return {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+
+
+    def get_stats(self, **params):
+        response = self.client.get(
+            url_for('api.get_user_stats', **params),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['stats']
+
+
+    def set_done(self, id, item_id, done):
+        return self.client.put(
+            url_for('api.manage_bucketlist_item', id=id, item_id=item_id),
+            headers=self.get_api_headers(self.access_token),
+            data=json.dumps({'done': done})
+        )
+
+
+    def test_stats_count_created_bucketlists_and_items(self):
+        """ Tests that the stats reflect the bucketlists and items created.
+            GET '/user/stats'
+        """
+        stats = self.get_stats()
+        today = date.today().isoformat()
+
+        self.assertEqual(stats['bucketlists'], 2)
+        self.assertEqual(stats['items'], 3)
+        self.assertEqual(stats['items_done'], 1)
+        self.assertEqual(stats['completion_percentage'], 33.3)
+        self.assertEqual(stats['completed'], [{'day': today, 'count': 1}])
+
+
+    def test_stats_follow_done_transitions(self):
+        """ Tests that only flipping the done flag of an item changes the stats,
+            and that undoing an item takes it out of its day's completions.
+            PUT '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        self.assertEqual(self.set_done(1, 2, True).status_code, 200)
+        self.assertEqual(self.set_done(1, 2, True).status_code, 200)
+        stats = self.get_stats()
+        self.assertEqual(stats['items_done'], 2)
+        self.assertEqual(stats['completed'][0]['count'], 2)
+
+        self.assertEqual(self.set_done(1, 1, False).status_code, 200)
+        stats = self.get_stats()
+        self.assertEqual(stats['items_done'], 1)
+        self.assertEqual(stats['completed'][0]['count'], 1)
+
+        # toggling an item doesn't inflate its day's completions:
+        for done in (False, True, False, True):
+            self.assertEqual(self.set_done(1, 2, done).status_code, 200)
+        self.assertEqual(self.get_stats()['completed'][0]['count'], 1)
+
+        # orm updates are counted too:
+        item = BucketlistItem.query.get(3)
+        item.done = True
+        db.session.commit()
+        self.assertEqual(self.get_stats()['completed'][0]['count'], 2)
+        item.done = False
+        db.session.commit()
+        stats = self.get_stats()
+        self.assertEqual((stats['items_done'], stats['completed'][0]['count']), (1, 1))
+
+
+    def test_concurrent_flips_are_counted_once(self):
+        """ Tests that a flip committed by a concurrent request just before
+            the item's UPDATE isn't counted again.
+            PUT '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        table = BucketlistItem.__table__
+        flipped = []
+        def flip_concurrently(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE bucketlist_item') and not flipped:
+                flipped.append(statement)
+                with db.engine.begin() as other:
+                    other.execute(table.update().where(table.c.id == 2).values(done=True))
+                    UserStats.adjust(other, self.user.id, done=1)
+        event.listen(db.engine, 'before_cursor_execute', flip_concurrently)
+
+        try:
+            response = self.set_done(1, 2, True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', flip_concurrently)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(flipped)
+        stats = self.get_stats()
+        self.assertEqual(stats['items_done'], 2)
+        self.assertEqual(stats['completion_percentage'], 66.7)
+
+
+    def test_stats_follow_deletes(self):
+        """ Tests that deleting items, and purging deleted bucketlists, takes
+            them out of the stats, done ones out of their day's completions too.
+            DELETE '/bucketlists/<int:id>/items/<int:item_id>'
+            DELETE '/bucketlists/<int:id>'
+        """
+        self.set_done(2, 3, True)
+        self.assertEqual(self.get_stats()['completed'][0]['count'], 2)
+        response = self.client.delete(
+            url_for('api.manage_bucketlist_item', id=2, item_id=3),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+        stats = self.get_stats()
+        self.assertEqual((stats['bucketlists'], stats['items'], stats['items_done']), (2, 2, 1))
+        self.assertEqual(stats['completed'][0]['count'], 1)
+
+        response = self.client.delete(
+            url_for('api.manage_bucketlist', id=1),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+        stats = self.get_stats()
+        self.assertEqual((stats['bucketlists'], stats['items'], stats['items_done']), (1, 2, 1))
+
+        # the items of a deleted bucketlist leave the stats once purged:
+        UserStats.backfill(self.user.id)
+        db.session.commit()
+        self.assertEqual(purge_deleted(0), 4)
+        stats = self.get_stats()
+        self.assertEqual((stats['bucketlists'], stats['items'], stats['items_done']), (1, 0, 0))
+        self.assertEqual(stats['completion_percentage'], 0.0)
+        self.assertEqual(stats['completed'], [])
+
+
+    def test_stats_are_one_read(self):
+        """ Tests that the stats come from a single query on the rollups.
+            GET '/user/stats?period=week'
+        """
+        statements = []
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM bucketlist' in statement or 'user_stats' in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statements)
+
+        try:
+            stats = self.get_stats(period='week', days=14)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statements)
+
+        self.assertEqual(len(statements), 1)
+        self.assertIn('FROM user_stats', statements[0])
+        self.assertEqual(stats['period'], 'week')
+        self.assertEqual(len(stats['completed']), 1)
+        self.assertIn('week', stats['completed'][0])
+
+
+    def test_stats_with_invalid_period(self):
+        """ Tests that the stats endpoint rejects unknown periods.
+            GET '/user/stats?period=year'
+        """
+        response = self.client.get(
+            url_for('api.get_user_stats', period='year'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_backfill_recomputes_stats(self):
+        """ Tests that backfilling rebuilds lost or drifted rollups.
+        """
+        UserStats.delete_user_stats(db.session, self.user.id)
+        db.session.commit()
+        self.assertEqual(self.get_stats()['items'], 0)
+
+        UserStats.backfill(self.user.id)
+        db.session.commit()
+        stats = self.get_stats()
+        self.assertEqual((stats['bucketlists'], stats['items'], stats['items_done']), (2, 3, 1))
+        self.assertEqual(stats['completed'][0]['count'], 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
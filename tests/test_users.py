@@ -2,7 +2,7 @@ import unittest
 import json
 from flask import current_app, url_for
 from app import create_app, db
-from app.models import User
+from app.models import User, Bucketlist, BucketlistItem
 
 
 class UsersTestCase(unittest.TestCase):
@@ -113,6 +113,24 @@ class UsersTestCase(unittest.TestCase):
         self.assertEqual(User.query.get(self.user.id), None)
 
 
+    def test_deregister_user_deletes_bucketlists(self):
+        """ Tests deregister_user removes the user's bucketlists and items.
+            DELETE '/user/'
+        """
+        bucketlist = Bucketlist(name="The Phlegmatic's Wishlist", created_by=self.user)
+        db.session.add(bucketlist)
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", bucketlist=bucketlist))
+        db.session.commit()
+
+        response = self.client.delete(
+            url_for('api.manage_user'),
+            headers=self.get_api_headers(self.access_token)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Bucketlist.query.count(), 0)
+        self.assertEqual(BucketlistItem.query.count(), 0)
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+import json
+from sqlalchemy.orm.exc import StaleDataError
+from flask import current_app, url_for
+from app import create_app, db
+from app.models import User, Bucketlist, BucketlistItem
+
+
+class VersionsTestCase(unittest.TestCase):
+    """ Testcase for the optimistic concurrency control of updates with If-Match
+    """
+
+    def setUp(self):
+
+        # setup the app and push app context:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # setup the db:
+        db.create_all()
+
+        # create test user:
+        self.user = User(
+            username="Somebody",
+            email="somebody@somedomain.com",
+            password="anything"
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # init the test client:
+        self.client = self.app.test_client()
+
+        # log the user in and get authentication token:
+        response = self.client.post(
+            url_for('login'),
+            headers=self.get_api_headers(),
+            data=json.dumps({
+                'email': 'somebody@somedomain.com',
+                'password': 'anything',
+            })
+        )
+        self.access_token = json.loads(response.data).get('access_token')
+
+        # fix the db with sample bucketlists and items for the user:
+        bucketlist_1 = Bucketlist(name="The Choleric's Wishlist", created_by=self.user)
+        bucketlist_2 = Bucketlist(name="The Sanguine's Wishlist", created_by=self.user)
+        db.session.add_all([bucketlist_1, bucketlist_2])
+        db.session.add(BucketlistItem(name="Kayak across the Atlantic", done=False, bucketlist=bucketlist_1))
+        db.session.commit()
+
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    def get_api_headers(self, access_token='', if_match=None):
+        """ formats the headers to be used when accessing API endpoints.
+        """
+        headers = {
+            'Authorization': "JWT {}".format(access_token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+        if if_match:
+            headers['If-Match'] = if_match
+        return headers
+
+
+    def update_item(self, if_match, **values):
+        return self.client.put(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token, if_match),
+            data=json.dumps(values)
+        )
+
+
+    def test_item_update_with_if_match(self):
+        """ Tests that an item update applies only to the version in If-Match.
+            PUT '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        response = self.update_item('"1"', done=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['bucketlist_item']['version'], 2)
+        self.assertEqual(response.headers.get('ETag'), '"2"')
+
+        # a client still at the first version is turned away:
+        response = self.update_item('"1"', name='Row across the Atlantic')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(BucketlistItem.query.get(1).name, "Kayak across the Atlantic")
+        self.assertEqual(self.update_item('"1"').status_code, 412)
+
+        # any of several versions, or any at all, match:
+        self.assertEqual(self.update_item('"1", "2"', done=False).status_code, 200)
+        self.assertEqual(self.update_item('*', done=True).status_code, 200)
+        self.assertEqual(self.update_item(None, done=False).status_code, 200)
+        self.assertEqual(BucketlistItem.query.get(1).version_id, 5)
+
+
+    def test_item_delete_with_if_match(self):
+        """ Tests that an item delete applies only to the version in If-Match.
+            DELETE '/bucketlists/<int:id>/items/<int:item_id>'
+        """
+        self.update_item(None, done=True)
+        response = self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token, '"1"')
+        )
+        self.assertEqual(response.status_code, 412)
+
+        response = self.client.delete(
+            url_for('api.manage_bucketlist_item', id=1, item_id=1),
+            headers=self.get_api_headers(self.access_token, '"2"')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(BucketlistItem.query.get(1))
+
+
+    def test_bucketlist_update_and_delete_with_if_match(self):
+        """ Tests that bucketlist writes apply only to the version in If-Match.
+            PUT, DELETE '/bucketlists/<int:id>'
+        """
+        response = self.client.put(
+            url_for('api.manage_bucketlist', id=2),
+            headers=self.get_api_headers(self.access_token, '"1"'),
+            data=json.dumps({'name': "The Phlegmatic's Wishlist"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['bucketlist']['version'], 2)
+        self.assertEqual(response.headers.get('ETag'), '"2"')
+
+        response = self.client.delete(
+            url_for('api.manage_bucketlist', id=2),
+            headers=self.get_api_headers(self.access_token, '"1"')
+        )
+        self.assertEqual(response.status_code, 412)
+        self.assertIsNotNone(Bucketlist.query.get(2))
+
+        response = self.client.delete(
+            url_for('api.manage_bucketlist', id=2),
+            headers=self.get_api_headers(self.access_token, '"2"')
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_stale_instance_is_not_written(self):
+        """ Tests that a bucketlist changed since it was loaded isn't overwritten.
+        """
+        bucketlist = Bucketlist.query.get(1)
+        table = Bucketlist.__table__
+        db.session.execute(table.update().where(table.c.id == 1).values(version_id=table.c.version_id + 1))
+
+        bucketlist.name = "The Phlegmatic's Wishlist"
+        self.assertRaises(StaleDataError, db.session.commit)
+
+
+
+if __name__ == '__main__':
+    unittest.main()